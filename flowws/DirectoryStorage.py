@@ -1,10 +1,69 @@
+import hashlib
+import json
 import os
+import re
+import threading
 
-from .Storage import Storage
+from .Storage import Storage, StorageStat
+
+#: Name of the file listing the contents of sharded storage directories
+MANIFEST_NAME = '.flowws_manifest'
+
+#: Available sharded directory layouts
+SHARD_LAYOUTS = ('hash', 'group')
+
+# number of consecutively-numbered files per directory in the 'group' layout
+_GROUP_BUCKET_SIZE = 1000
+
+_NUMBER = re.compile(r'\d+')
+
+def shard_path(full_name, shard):
+    """Return the relative location of a file within a sharded directory layout.
+
+    :param full_name: Full (internal) name of the file
+    :param shard: Layout to use (None for a flat layout, or one of `SHARD_LAYOUTS`)
+    """
+    if shard is None:
+        return full_name
+
+    (dirname, basename) = os.path.split(full_name)
+    if shard == 'hash':
+        digest = hashlib.md5(full_name.encode()).hexdigest()
+        shard_dirs = [digest[:2], digest[2:4]]
+    elif shard == 'group':
+        numbers = _NUMBER.findall(basename)
+        pattern = _NUMBER.sub('#', basename)
+        bucket = int(numbers[-1])//_GROUP_BUCKET_SIZE if numbers else 0
+        shard_dirs = [pattern, str(bucket)]
+    else:
+        raise ValueError('Unknown shard layout {}; use one of {}'.format(
+            shard, SHARD_LAYOUTS))
+
+    return os.path.join(dirname, *(shard_dirs + [basename]))
 
 class DirectoryStorage(Storage):
-    """Stores files directly on the filesystem."""
-    def __init__(self, root=os.curdir, group=None):
+    """Stores files directly on the filesystem.
+
+    By default, files are stored directly under `root/group`. Storage
+    directories holding very many files can instead use a sharded
+    layout that spreads files among many subdirectories while
+    remaining transparent to `open`:
+
+    - 'hash': files are placed in two levels of directories named by the hash of their name (like `3f/a2/frame_12.bin`)
+    - 'group': files are grouped by their name, with numbers replaced by '#', and by blocks of 1000 consecutive numbers (like `frame_#.bin/0/frame_12.bin`)
+
+    Sharded directories contain a manifest file listing the layout
+    and the names of all stored files, so that `list` does not need
+    to walk the directory tree. The layout is read from the manifest
+    whenever an existing directory is opened; use
+    :py:mod:`flowws.reshard` to convert existing directories between
+    layouts.
+
+    :param root: Root directory of the storage
+    :param group: Optional subdirectory of `root` to use
+    :param shard: Sharded layout to use for new storage directories (None for the layout of an existing directory, or a flat layout)
+    """
+    def __init__(self, root=os.curdir, group=None, shard=None):
         self.root = root
         self.group = group
 
@@ -15,13 +74,132 @@ class DirectoryStorage(Storage):
 
         os.makedirs(self.full_prefix, exist_ok=True)
 
+        self._manifest_lock = threading.Lock()
+        self._manifest_names = {}
+        self._manifest_offset = 0
+        self._manifest_shard = None
+        manifest_shard = self._read_manifest()
+
+        if shard is not None and shard not in SHARD_LAYOUTS:
+            raise ValueError('Unknown shard layout {}; use one of {}'.format(
+                shard, SHARD_LAYOUTS))
+        elif manifest_shard is not None and shard not in (None, manifest_shard):
+            raise ValueError(
+                'Directory {} uses the {} layout; use flowws.reshard to change '
+                'it'.format(self.full_prefix, manifest_shard))
+        elif shard is not None and manifest_shard is None:
+            if any(entry.is_file() for entry in os.scandir(self.full_prefix)):
+                raise ValueError(
+                    'Directory {} already contains files; use flowws.reshard to '
+                    'shard it'.format(self.full_prefix))
+            write_manifest(self.full_prefix, shard, [])
+            self._read_manifest()
+
+        self.shard = shard or manifest_shard
+
     def to_JSON(self):
-        return dict(type='DirectoryStorage', root=self.root, group=self.group)
+        result = dict(type='DirectoryStorage', root=self.root, group=self.group)
+        if self.shard is not None:
+            result['shard'] = self.shard
+        return result
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_manifest_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._manifest_lock = threading.Lock()
+
+    def _read_manifest(self):
+        """Read new entries of the manifest, returning its layout (if it exists)."""
+        path = os.path.join(self.full_prefix, MANIFEST_NAME)
+        with self._manifest_lock:
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(self._manifest_offset)
+                    contents = f.read()
+            except FileNotFoundError:
+                return None
+
+            # only consume complete lines
+            contents = contents[:contents.rfind(b'\n') + 1]
+            lines = contents.decode().splitlines()
+            if not self._manifest_offset and lines:
+                header = json.loads(lines.pop(0))
+                self._manifest_shard = header['shard']
+            self._manifest_offset += len(contents)
+
+            for line in lines:
+                self._manifest_names[json.loads(line)] = None
+
+            return self._manifest_shard
+
+    def _add_to_manifest(self, full_name):
+        if full_name in self._manifest_names:
+            return
+
+        path = os.path.join(self.full_prefix, MANIFEST_NAME)
+        with self._manifest_lock:
+            self._manifest_names[full_name] = None
+            # single small appends are atomic, so several processes
+            # can share a manifest
+            with open(path, 'ab') as f:
+                f.write(json.dumps(full_name).encode() + b'\n')
+
+    def _make_path(self, full_name, mode):
+        path = os.path.join(self.full_prefix, shard_path(full_name, self.shard))
+        if 'w' in mode or 'a' in mode:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.shard is not None:
+                self._add_to_manifest(full_name)
+        return path
 
     def open_stream(self, full_name, mode):
-        full_name = os.path.join(self.full_prefix, full_name)
-        return open(full_name, mode)
+        return open(self._make_path(full_name, mode), mode)
 
     def open_file(self, full_name, mode):
-        full_name = os.path.join(self.full_prefix, full_name)
-        return open(full_name, mode)
+        return open(self._make_path(full_name, mode), mode)
+
+    def stat_file(self, full_name):
+        path = self._make_path(full_name, 'r')
+        stat = os.stat(path)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        return StorageStat(full_name, stat.st_size, stat.st_mtime)
+
+    def list_files(self, prefix):
+        if self.shard is not None:
+            self._read_manifest()
+            for name in list(self._manifest_names):
+                if name.startswith(prefix):
+                    yield name
+            return
+
+        # only walk the directory containing the prefix
+        (prefix_dir, _) = os.path.split(prefix)
+        walk_root = os.path.join(self.full_prefix, prefix_dir)
+
+        for (dirpath, dirnames, filenames) in os.walk(walk_root):
+            relative_dir = os.path.relpath(dirpath, self.full_prefix)
+            for filename in filenames:
+                name = os.path.normpath(os.path.join(relative_dir, filename))
+                name = name.replace(os.sep, '/')
+                if name.startswith(prefix):
+                    yield name
+
+def write_manifest(directory, shard, names):
+    """Write a new manifest describing the layout and contents of a directory.
+
+    :param directory: Storage directory
+    :param shard: Layout of the directory (one of `SHARD_LAYOUTS`)
+    :param names: Full names of all files stored in the directory
+    """
+    path = os.path.join(directory, MANIFEST_NAME)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(json.dumps(dict(shard=shard)) + '\n')
+        for name in names:
+            f.write(json.dumps(name) + '\n')
+    os.replace(temp_path, path)
@@ -1,36 +1,112 @@
+import collections
+import contextlib
 import tempfile
 import io
+import os
+import struct
+import tarfile
+import threading
+import time
+import zipfile
 
-from .Storage import Storage
+from .Storage import Storage, StorageStat
+
+_IndexEntry = collections.namedtuple(
+    '_IndexEntry', ['size', 'mtime', 'offset', 'zip_info'])
+_IndexEntry.__new__.__defaults__ = (None, None, None, None)
+
+class _RangeReader(io.RawIOBase):
+    """Seekable, lazily-read view of a range of bytes within a file."""
+    def __init__(self, filename, offset, size):
+        super(_RangeReader, self).__init__()
+        self._file = open(filename, 'rb', buffering=0)
+        self.offset = offset
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += self.size
+        self.position = max(0, position)
+        return self.position
+
+    def readinto(self, target):
+        count = max(0, min(len(target), self.size - self.position))
+        if not count:
+            return 0
+
+        self._file.seek(self.offset + self.position)
+        count = self._file.readinto(memoryview(target)[:count])
+        self.position += count
+        return count
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super(_RangeReader, self).close()
+
+def _zip_data_offset(filename, header_offset):
+    with open(filename, 'rb') as f:
+        f.seek(header_offset)
+        header = f.read(zipfile.sizeFileHeader)
+    (name_length, extra_length) = struct.unpack('<HH', header[26:30])
+    return header_offset + zipfile.sizeFileHeader + name_length + extra_length
+
+def _open_zip_data(filename, data_offset, zip_info):
+    # ZipExtFile is not part of the public zipfile API, but lets
+    # members be decompressed without rereading the archive directory
+    source = open(filename, 'rb')
+    source.seek(data_offset)
+    try:
+        return zipfile.ZipExtFile(source, 'r', zip_info, None, True)
+    except Exception:
+        source.close()
+        raise
+
+# modifier prefix of the records storing blocks appended to record logs
+_LOG_CHUNK_PREFIX = 'chunk'
 
 class GetarBinaryBuffer(io.BytesIO):
-    def __init__(self, gtar_file, target_path, mode):
+    def __init__(self, storage, target_path, mode):
         super(GetarBinaryBuffer, self).__init__()
-        self.gtar_file = gtar_file
+        self.storage = storage
         self.target_path = target_path
 
         if 'a' in mode:
-            contents = self.gtar_file.readBytes(self.target_path)
+            contents = self.storage._read(self.target_path, True)
             if contents:
                 self.write(contents)
 
     def close(self):
-        self.gtar_file.writeBytes(self.target_path, self.getvalue())
+        if not self.closed:
+            self.storage._write(self.target_path, self.getvalue())
         super(GetarBinaryBuffer, self).close()
 
 class GetarTextBuffer(io.StringIO):
-    def __init__(self, gtar_file, target_path, mode):
+    def __init__(self, storage, target_path, mode):
         super(GetarTextBuffer, self).__init__()
-        self.gtar_file = gtar_file
+        self.storage = storage
         self.target_path = target_path
 
         if 'a' in mode:
-            contents = self.gtar_file.readStr(self.target_path)
+            contents = self.storage._read(self.target_path, False)
             if contents:
                 self.write(contents)
 
     def close(self):
-        self.gtar_file.writeStr(self.target_path, self.getvalue())
+        if not self.closed:
+            self.storage._write(self.target_path, self.getvalue())
         super(GetarTextBuffer, self).close()
 
 class GetarStorage(Storage):
@@ -39,7 +115,36 @@ class GetarStorage(Storage):
     These can be zip, tar, or sqlite-formatted archives. Note that zip
     and tar files will currently accumulate copies of files as they
     are appended to or overwritten.
+
+    Writes made inside a `batch` context are held in memory and
+    written using a single bulk write (a single transaction for
+    sqlite archives) when the context exits.
+
+    An index of the names and sizes of stored records is kept in
+    memory to quickly answer `exists`, `list`, and `stat` queries
+    and to avoid reading records that do not exist. For zip and tar
+    archives, the index is read from the archive directory when the
+    storage is created; for sqlite archives, it is built the first
+    time it is needed. The index is updated for every write made
+    through this object.
+
+    Record logs (see `Storage.log`) are stored as a series of chunk
+    records (named like `energy.chunk00000001.log`), so that each
+    flush only writes the newly-appended rows. Chunk records of a log
+    whose main record is rewritten (rather than appended to through
+    `Storage.log`) are ignored afterward.
+
+    Records that were already stored in zip and tar archives when
+    the storage was opened (and have not been rewritten since) are
+    read lazily: streams returned by `open` for these records are
+    seekable and only read the requested portions of the archive,
+    directly from the record's offset for uncompressed records and
+    chunk-by-chunk for compressed zip records. Other records
+    (including all records of sqlite archives, which are stored as
+    compressed blobs) are read completely into memory when opened.
     """
+    _text_encoding = 'utf-8'
+
     def __init__(self, target, group=None):
         try:
             import gtar
@@ -49,28 +154,292 @@ class GetarStorage(Storage):
         self.target = target
         self.group = group
 
-        self.gtar_file = gtar.GTAR(self.target, 'a')
+        self._index = None
+        self._gtar_file = None
+        self._pending_writes = None
+        # getar archives are not safe to use from several threads
+        # (for example, when prefetching) at once
+        self._lock = threading.RLock()
+        self.gtar_file
+
+    @property
+    def gtar_file(self):
+        """`gtar.GTAR` object of the archive, which is (re)opened when needed."""
+        with self._lock:
+            if self._gtar_file is None:
+                import gtar
+                # zip and tar archive directories must be read before
+                # getar starts appending to them
+                self._index = self._read_archive_index()
+                self._gtar_file = gtar.GTAR(self.target, 'a')
+            return self._gtar_file
 
     def to_JSON(self):
         return dict(type='GetarStorage', target=self.target, group=self.group)
 
-    def open_stream(self, full_name, mode):
+    @contextlib.contextmanager
+    def batch(self):
+        if self._pending_writes is not None:
+            yield self
+            return
+
+        # the index is only complete once the archive has been opened
+        self.gtar_file
+        self._pending_writes = {}
+        try:
+            yield self
+        finally:
+            (pending, self._pending_writes) = (self._pending_writes, None)
+            if pending:
+                with self._lock, self.gtar_file.getBulkWriter() as writer:
+                    for (path, contents) in pending.items():
+                        if isinstance(contents, bytes):
+                            writer.writeBytes(path, contents)
+                        else:
+                            writer.writeStr(path, contents)
+
+    def close(self):
+        # the archive (and its index, which may be changed by other
+        # processes in the meantime) is reopened if used again
+        with self._lock:
+            if self._gtar_file is not None:
+                self._gtar_file.close()
+                self._gtar_file = None
+                self._index = None
+
+    def _read_archive_index(self):
+        if not os.path.exists(self.target) or not os.path.getsize(self.target):
+            return {}
+        elif os.path.isdir(self.target):
+            # directory-based archive; use the getar API later instead
+            return None
+
+        result = {}
+        if zipfile.is_zipfile(self.target):
+            with zipfile.ZipFile(self.target) as archive:
+                # later copies of the same record override earlier ones
+                for info in archive.infolist():
+                    mtime = time.mktime(info.date_time + (0, 0, -1))
+                    result[info.filename] = _IndexEntry(
+                        info.file_size, mtime, info.header_offset, info)
+            return result
+
+        try:
+            archive = tarfile.open(self.target, 'r:')
+        except tarfile.ReadError:
+            # sqlite archive; use the getar API later instead
+            return None
+
+        with archive:
+            for info in archive:
+                if info.isfile():
+                    result[info.name] = _IndexEntry(
+                        info.size, info.mtime, info.offset_data)
+        return result
+
+    def _get_index(self):
+        with self._lock:
+            return self._build_index()
+
+    def _build_index(self):
+        # opening the archive reads the directory of zip and tar archives
+        gtar_file = self.gtar_file
+        if self._index is None:
+            index = {}
+            for record in gtar_file.getRecordTypes():
+                for frame in (gtar_file.queryFrames(record) or ['']):
+                    record.setIndex(frame)
+                    index[record.getPath()] = _IndexEntry()
+            self._index = index
+        return self._index
+
+    def _group_path(self, full_name):
         if self.group is not None:
-            full_name = os.path.join(self.group, full_name)
+            return os.path.join(self.group, full_name)
+        return full_name
+
+    def stat_file(self, full_name):
+        path = self._group_path(full_name)
+        index = self._get_index()
+        if path not in index:
+            raise FileNotFoundError(full_name)
+
+        entry = index[path]
+        if entry.size is None:
+            contents = self._read(path, True) or b''
+            entry = index[path] = entry._replace(size=len(contents))
+
+        return StorageStat(full_name, entry.size, entry.mtime)
+
+    @staticmethod
+    def _log_chunk_path(path, label):
+        # name chunks like 'energy.chunk00000001.log', keeping the suffix
+        (prefix, suffix) = os.path.splitext(path)
+        return '{}.{}{}{}'.format(prefix, _LOG_CHUNK_PREFIX, label, suffix)
+
+    def _log_chunk_paths(self, path):
+        """Return a sorted list of (number, path) of the chunk records of a log."""
+        (prefix, suffix) = os.path.splitext(path)
+        chunk_prefix = prefix + '.' + _LOG_CHUNK_PREFIX
+        result = []
+        for name in self._get_index():
+            number = name[len(chunk_prefix):len(name) - len(suffix)]
+            if (name.startswith(chunk_prefix) and name.endswith(suffix) and
+                    number.isdigit()):
+                result.append((int(number), name))
+        return sorted(result)
+
+    def _log_chunk_start(self, path):
+        # number of the first chunk that belongs to the current log record
+        start_path = self._log_chunk_path(path, 'start')
+        if start_path not in self._get_index():
+            return 1
+        return int(self._read(start_path, False))
+
+    def _supersede_log_chunks(self, path):
+        # records can not be removed from archives, so chunks of a log
+        # that is rewritten are skipped when it is read instead
+        chunks = self._log_chunk_paths(path)
+        start = chunks[-1][0] + 1 if chunks else 1
+        self._write_locked(self._log_chunk_path(path, 'start'), str(start))
+
+    def _append_log(self, filename, modifiers, contents):
+        # appending to a record rewrites it completely (and adds a new
+        # copy of it to zip and tar archives), so blocks appended to
+        # an existing log are stored as separate chunk records instead
+        if not self.exists(filename, modifiers):
+            with self.open(filename, 'wb', modifiers) as f:
+                f.write(contents)
+            return
+
+        path = self._group_path(self._full_name(filename, modifiers))
+        with self._lock:
+            chunks = self._log_chunk_paths(path)
+            number = chunks[-1][0] + 1 if chunks else 1
+        chunk_modifiers = list(modifiers) + [
+            '{}{:08d}'.format(_LOG_CHUNK_PREFIX, number)]
+        with self.open(filename, 'wb', chunk_modifiers) as f:
+            f.write(contents)
+
+    def _open_log(self, filename, modifiers):
+        with self.open(filename, 'rb', modifiers) as f:
+            contents = [f.read()]
+
+        path = self._group_path(self._full_name(filename, modifiers))
+        with self._lock:
+            start = self._log_chunk_start(path)
+            for (number, chunk_path) in self._log_chunk_paths(path):
+                if number >= start:
+                    contents.append(self._read(chunk_path, True))
+        return io.BytesIO(b''.join(contents))
+
+    def _prefetch_size(self, full_name):
+        # avoid reading records of unknown size just to find their size
+        path = self._group_path(full_name)
+        index = self._get_index()
+        if path not in index:
+            raise FileNotFoundError(full_name)
+        return index[path].size
+
+    def list_files(self, prefix):
+        group_prefix = self._group_path('')
+        full_prefix = self._group_path(prefix)
+        for path in self._get_index():
+            if path.startswith(full_prefix):
+                yield path[len(group_prefix):]
+
+    def _open_lazy(self, path):
+        if self._pending_writes is not None and path in self._pending_writes:
+            return None
+
+        entry = self._index.get(path) if self._index is not None else None
+        if entry is None or entry.offset is None:
+            return None
+        elif not entry.size:
+            raise FileNotFoundError(path)
+
+        if entry.zip_info is None:
+            return io.BufferedReader(
+                _RangeReader(self.target, entry.offset, entry.size))
+
+        data_offset = _zip_data_offset(self.target, entry.offset)
+        if entry.zip_info.compress_type == zipfile.ZIP_STORED:
+            return io.BufferedReader(
+                _RangeReader(self.target, data_offset, entry.size))
+
+        # compressed records are decompressed in chunks as they are read
+        try:
+            return _open_zip_data(self.target, data_offset, entry.zip_info)
+        except TypeError: # incompatible ZipExtFile in this python version
+            pass
+
+        # the archive holds a reference to the file until the stream is closed
+        with zipfile.ZipFile(self.target) as archive:
+            return archive.open(entry.zip_info)
+
+    def _read(self, path, binary):
+        with self._lock:
+            return self._read_locked(path, binary)
+
+    def _read_locked(self, path, binary):
+        if self._pending_writes is not None and path in self._pending_writes:
+            contents = self._pending_writes[path]
+            if binary and not isinstance(contents, bytes):
+                contents = contents.encode()
+            elif not binary and isinstance(contents, bytes):
+                contents = contents.decode()
+            return contents
+
+        if binary:
+            return self.gtar_file.readBytes(path)
+        return self.gtar_file.readStr(path)
+
+    def _write(self, path, contents):
+        with self._lock:
+            self._write_locked(path, contents)
+
+    def _write_locked(self, path, contents):
+        size = len(contents if isinstance(contents, bytes) else contents.encode())
+        # open the archive (and read its index) before recording the write
+        gtar_file = self.gtar_file
+        # rewriting a record log supersedes its chunk records
+        if self._log_chunk_path(path, '{:08d}'.format(1)) in self._build_index():
+            self._supersede_log_chunks(path)
+        if self._index is not None:
+            self._index[path] = _IndexEntry(size, time.time())
+
+        if self._pending_writes is not None:
+            self._pending_writes[path] = contents
+        elif isinstance(contents, bytes):
+            gtar_file.writeBytes(path, contents)
+        else:
+            gtar_file.writeStr(path, contents)
+
+    def open_stream(self, full_name, mode):
+        full_name = self._group_path(full_name)
 
         if 'w' in mode or 'a' in mode:
             if 'b' in mode:
-                return GetarBinaryBuffer(self.gtar_file, full_name, mode)
+                return GetarBinaryBuffer(self, full_name, mode)
 
-            return GetarTextBuffer(self.gtar_file, full_name, mode)
+            return GetarTextBuffer(self, full_name, mode)
+
+        if self._index is not None and full_name not in self._index:
+            raise FileNotFoundError(full_name)
+
+        lazy_stream = self._open_lazy(full_name)
+        if lazy_stream is not None:
+            if 'b' in mode:
+                return lazy_stream
+            return io.TextIOWrapper(lazy_stream, encoding='utf-8')
 
         if 'b' in mode:
-            contents = self.gtar_file.readBytes(full_name)
+            contents = self._read(full_name, True)
             if not contents:
                 raise FileNotFoundError()
             return io.BytesIO(contents)
 
-        contents = self.gtar_file.readStr(full_name)
+        contents = self._read(full_name, False)
         if not contents:
             raise FileNotFoundError()
         return io.StringIO(contents)
@@ -0,0 +1,154 @@
+import json
+import struct
+import time
+
+MAGIC = b'FLWSLOG\x00'
+
+# struct format character -> numpy type
+_NUMPY_TYPES = {
+    'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'I': 'u4',
+    'q': 'i8', 'Q': 'u8', 'f': 'f4', 'd': 'f8', '?': '?',
+}
+_STRUCT_CODES = {value: key for (key, value) in _NUMPY_TYPES.items()}
+
+def _parse_schema(schema):
+    if isinstance(schema, dict):
+        schema = list(schema.items())
+
+    result = []
+    for (name, code) in schema:
+        code = _STRUCT_CODES.get(code, code)
+        if code not in _NUMPY_TYPES:
+            raise ValueError('Unknown type {} for field {}; use one of {}'.format(
+                code, name, sorted(_NUMPY_TYPES) + sorted(_STRUCT_CODES)))
+        result.append((str(name), code))
+
+    if not result:
+        raise ValueError('Record logs must have at least one field')
+    return result
+
+def _read_header(stream):
+    magic = stream.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError('Not a flowws record log')
+    (length,) = struct.unpack('<I', stream.read(4))
+    header = json.loads(stream.read(length).decode('utf-8'))
+    return [tuple(field) for field in header['fields']]
+
+def _make_header(fields):
+    header = json.dumps(dict(fields=fields)).encode('utf-8')
+    return MAGIC + struct.pack('<I', len(header)) + header
+
+class RecordLog:
+    """Buffered, append-only log of fixed-size binary records.
+
+    Record logs store a series of rows (for example, one per
+    simulation timestep) with a fixed set of typed fields. Rows are
+    packed into a compact binary format and held in memory until
+    `flush_bytes` bytes have accumulated or `flush_interval` seconds
+    have passed since the last write, at which point they are
+    appended to the file in a single operation. The interval is only
+    checked when rows are appended (there is no background timer),
+    so rows can be held indefinitely if no more are appended; call
+    `flush` to write them explicitly. Remaining rows are written when
+    the log is closed.
+
+    RecordLog objects are created by `Storage.log`, and their
+    contents are read using `Storage.read_log`::
+
+        with storage.log('energy.log', [('step', 'i8'), ('energy', 'f8')]) as log:
+            for step in range(N):
+                log.append(step, compute_energy())
+
+        energies = storage.read_log('energy.log', as_array=True)['energy']
+
+    Field types are given as numpy-style type names ('i1', 'i2',
+    'i4', 'i8', 'u1', 'u2', 'u4', 'u8', 'f4', 'f8', or '?') or the
+    equivalent `struct` format characters. Files consist of a short
+    header (describing the fields) followed by packed little-endian
+    rows. Appending to an existing log requires the same fields.
+
+    :param storage: Storage object to write to
+    :param filename: Name of the (internal) file
+    :param schema: List of (field name, type) pairs (or an ordered dictionary)
+    :param modifiers: List of filename modifiers
+    :param flush_bytes: Number of buffered bytes that triggers a write
+    :param flush_interval: Time (in seconds) after which buffered rows are written, checked whenever new rows are appended
+    """
+    def __init__(self, storage, filename, schema, modifiers=[],
+                 flush_bytes=1024*1024, flush_interval=5):
+        self.storage = storage
+        self.filename = filename
+        self.modifiers = list(modifiers)
+        self.fields = _parse_schema(schema)
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+
+        self._struct = struct.Struct('<' + ''.join(code for (_, code) in self.fields))
+        self._buffer = bytearray()
+        self._last_flush = time.monotonic()
+        self.closed = False
+
+        if storage.exists(filename, self.modifiers):
+            with storage.open(filename, 'rb', self.modifiers) as f:
+                existing = _read_header(f)
+            if existing != [tuple(field) for field in self.fields]:
+                raise ValueError('Existing log {} has fields {}, not {}'.format(
+                    filename, existing, self.fields))
+        else:
+            self._buffer.extend(_make_header(self.fields))
+
+    def append(self, *values):
+        """Add a row to the log, given the value of each field in order."""
+        self._buffer.extend(self._struct.pack(*values))
+        self._maybe_flush()
+
+    def extend(self, rows):
+        """Add many rows to the log."""
+        pack = self._struct.pack
+        for row in rows:
+            self._buffer.extend(pack(*row))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (len(self._buffer) >= self.flush_bytes or
+                time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows to the storage."""
+        if self._buffer:
+            self.storage._append_log(
+                self.filename, self.modifiers, bytes(self._buffer))
+            self._buffer = bytearray()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+def read_record_log(stream, as_array=False):
+    """Read the contents of a record log.
+
+    :param stream: Binary stream of the log file
+    :param as_array: If True, return a numpy structured array instead of a list of tuples
+    """
+    fields = _read_header(stream)
+    data = stream.read()
+    row_struct = struct.Struct('<' + ''.join(code for (_, code) in fields))
+    # ignore a partially-written final row
+    data = data[:len(data) - len(data) % row_struct.size]
+
+    if as_array:
+        import numpy as np
+        dtype = np.dtype([(name, '<' + _NUMPY_TYPES[code]) for (name, code) in fields])
+        return np.frombuffer(data, dtype=dtype)
+
+    return list(row_struct.iter_unpack(data))
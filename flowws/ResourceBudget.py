@@ -0,0 +1,120 @@
+import contextlib
+import re
+import threading
+
+_memory_suffixes = dict(k=1024, m=1024**2, g=1024**3, t=1024**4)
+
+def parse_memory(value):
+    """Parse a memory size like '512M' or '4G' into a number of bytes.
+
+    Plain numbers are interpreted as bytes; suffixes (K, M, G, and T,
+    optionally followed by B or iB) are interpreted as powers of
+    1024. None is returned unchanged.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+
+    match = re.match(r'^\s*([0-9.]+)\s*([kmgt]?)(i?b)?\s*$', value.lower())
+    if match is None:
+        raise ValueError('Unable to parse {} as a memory size'.format(value))
+
+    (number, suffix, _) = match.groups()
+    return int(float(number)*_memory_suffixes.get(suffix, 1))
+
+class ResourceBudget:
+    """Limit the resources used by concurrently-running stages.
+
+    Stages declare their needs through their `RESOURCES` class
+    attribute (see `Stage.get_resources`). Runners acquire these
+    resources from a shared budget before running each stage, waiting
+    until enough resources are available if necessary::
+
+        budget = ResourceBudget(max_cores=8, max_memory='16G')
+        with budget.acquire(stage.get_resources()):
+            stage.run(scope, storage)
+
+    Budgets are thread-safe and can be shared between any number of
+    workflows or parallel executors within the same process. Note
+    that the stages of a single workflow run one at a time, so
+    budgets only limit concurrency when they are shared (for example,
+    among the jobs of a `flowws_queue` worker run with `--jobs`); for
+    a single workflow, they cap the number of cores granted to each
+    stage.
+
+    :param max_cores: Maximum number of cores to use at once (None: unlimited)
+    :param max_memory: Maximum memory (in bytes, or a string like '4G') to use at once (None: unlimited)
+    """
+    def __init__(self, max_cores=None, max_memory=None):
+        self.max_cores = max_cores
+        self.max_memory = parse_memory(max_memory)
+
+        self.used_cores = 0
+        self.used_memory = 0
+        self.storage_locked = False
+
+        self._condition = threading.Condition()
+
+    def allocation(self, needs={}):
+        """Return the resources that would be granted for a set of needs.
+
+        The number of cores is limited to the total number of cores
+        of the budget; stages can find their granted allocation in
+        the `flowws.allocation` scope entry while they run.
+
+        :param needs: Dictionary of resource needs, with optional keys 'cores', 'memory', and 'exclusive_storage'
+        :returns: Dictionary with keys 'cores', 'memory', and 'exclusive_storage'
+        """
+        (cores, memory, exclusive_storage) = self._normalize(needs)
+        return dict(cores=cores, memory=memory, exclusive_storage=exclusive_storage)
+
+    def _normalize(self, needs):
+        cores = needs.get('cores', 1)
+        memory = parse_memory(needs.get('memory', 0)) or 0
+        exclusive_storage = bool(needs.get('exclusive_storage', False))
+
+        if self.max_cores is not None:
+            cores = min(cores, self.max_cores)
+        if self.max_memory is not None and memory > self.max_memory:
+            msg = ('Requested memory ({} bytes) exceeds the total memory '
+                   'budget ({} bytes)'.format(memory, self.max_memory))
+            raise ValueError(msg)
+
+        return cores, memory, exclusive_storage
+
+    def _available(self, cores, memory, exclusive_storage):
+        if self.max_cores is not None and self.used_cores + cores > self.max_cores:
+            return False
+        if self.max_memory is not None and self.used_memory + memory > self.max_memory:
+            return False
+        if exclusive_storage and self.storage_locked:
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def acquire(self, needs={}):
+        """Context manager to reserve resources while running a stage.
+
+        Requests for more cores than are available in total are
+        limited to the total (see `allocation`); requests for more
+        memory than is available in total raise a ValueError.
+
+        :param needs: Dictionary of resource needs, with optional keys 'cores', 'memory', and 'exclusive_storage'
+        """
+        (cores, memory, exclusive_storage) = self._normalize(needs)
+
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._available(cores, memory, exclusive_storage))
+            self.used_cores += cores
+            self.used_memory += memory
+            self.storage_locked |= exclusive_storage
+
+        try:
+            yield self
+        finally:
+            with self._condition:
+                self.used_cores -= cores
+                self.used_memory -= memory
+                if exclusive_storage:
+                    self.storage_locked = False
+                self._condition.notify_all()
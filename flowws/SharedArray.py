@@ -0,0 +1,180 @@
+import functools
+import logging
+import sys
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# python < 3.13 registers every attached block with the resource
+# tracker, which destroys it when the attaching process exits
+_TRACK_UNSUPPORTED = sys.version_info < (3, 13)
+
+def _open_shared_memory(name=None, create=False, size=0):
+    try:
+        from multiprocessing import shared_memory
+    except ImportError: # python < 3.8
+        raise ImportError(
+            'SharedArray requires multiprocessing.shared_memory (python 3.8 or newer)')
+
+    if create:
+        return shared_memory.SharedMemory(create=True, size=max(size, 1))
+
+    if not _TRACK_UNSUPPORTED:
+        # only the creating process should clean up the memory
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    memory = shared_memory.SharedMemory(name=name)
+    if getattr(shared_memory, '_USE_POSIX', False):
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+def _unlink_shared_memory(memory):
+    from multiprocessing import shared_memory
+
+    if _TRACK_UNSUPPORTED and getattr(shared_memory, '_USE_POSIX', False):
+        # processes sharing our resource tracker may have unregistered
+        # the block when attaching to it; register it again so that
+        # unlinking (which unregisters it) is consistent
+        from multiprocessing import resource_tracker
+        resource_tracker.register(memory._name, 'shared_memory')
+
+    try:
+        memory.unlink()
+    except FileNotFoundError:
+        pass
+
+class SharedArray:
+    """Array stored in shared memory that can be cheaply sent to other processes.
+
+    SharedArray objects wrap a `multiprocessing.shared_memory` block
+    holding the contents of a numpy array. When pickled (for example,
+    when being sent to a worker process), only the name, shape, and
+    data type of the block are transmitted; the receiving process
+    attaches to the same memory rather than receiving a copy of the
+    data. The underlying numpy array is accessible through the
+    `array` property.
+
+    SharedArrays are typically created using `from_array` with the
+    `flowws.exit_stack` of a running workflow, which will release the
+    shared memory when the workflow finishes::
+
+        shared = flowws.SharedArray.from_array(
+            positions, scope['flowws.exit_stack'])
+        scope['positions'] = shared
+        pool.map(analyze, [shared]*N)
+
+    :param name: Name of the shared memory block
+    :param shape: Shape of the array
+    :param dtype: numpy data type (or data type string) of the array
+    """
+    def __init__(self, name, shape, dtype, _memory=None):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self._memory = _memory
+        self._owner = _memory is not None
+        self._array = None
+
+    def __getstate__(self):
+        import numpy as np
+        return dict(name=self.name, shape=self.shape,
+                    dtype=np.dtype(self.dtype).str)
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], state['shape'], state['dtype'])
+
+    def __array__(self, dtype=None, copy=None):
+        import numpy as np
+
+        array = self.array
+        if dtype is not None and np.dtype(dtype) != array.dtype:
+            if copy is False:
+                raise ValueError(
+                    'Unable to convert SharedArray to {} without a copy'.format(dtype))
+            return array.astype(dtype)
+        elif copy:
+            return array.copy()
+        return array
+
+    def __repr__(self):
+        return 'SharedArray(name={!r}, shape={}, dtype={!r})'.format(
+            self.name, self.shape, self.dtype)
+
+    @classmethod
+    def from_array(cls, array, exit_stack=None):
+        """Copy an array into a new block of shared memory.
+
+        :param array: Array-like object to copy
+        :param exit_stack: If given, a `contextlib.ExitStack` (such as the `flowws.exit_stack` scope entry within `Workflow.run`) that will release the shared memory when unwound
+        """
+        import numpy as np
+
+        array = np.asarray(array)
+        memory = _open_shared_memory(create=True, size=array.nbytes)
+        result = cls(memory.name, array.shape, array.dtype, _memory=memory)
+        result.array[...] = array
+
+        if exit_stack is not None:
+            exit_stack.callback(result.unlink)
+
+        return result
+
+    @classmethod
+    def set_call(cls, scope, key, callback):
+        """Register a scope callback whose result is stored in shared memory.
+
+        The callback is evaluated lazily (see `Scope.set_call`); its
+        result is copied into a SharedArray that is released when the
+        `flowws.exit_stack` of the scope is unwound. If the callback is
+        evaluated after the workflow has finished running, the memory
+        is instead released when the SharedArray is garbage-collected.
+
+        :param scope: `Scope` object of a running workflow
+        :param key: Scope key to associate the callback with
+        :param callback: Parameter-free callable returning an array-like value
+        """
+        def wrapped():
+            exit_stack = scope.get('flowws.exit_stack')
+            result = cls.from_array(callback(), exit_stack)
+            if exit_stack is None:
+                weakref.finalize(
+                    result, functools.partial(_unlink_shared_memory, result._memory))
+            return result
+
+        scope.set_call(key, wrapped)
+
+    @property
+    def array(self):
+        """numpy array view of the shared memory."""
+        if self._array is None:
+            import numpy as np
+
+            if self._memory is None:
+                self._memory = _open_shared_memory(self.name)
+            self._array = np.ndarray(
+                self.shape, dtype=self.dtype, buffer=self._memory.buf)
+        return self._array
+
+    def close(self):
+        """Detach this process from the shared memory."""
+        self._array = None
+        if self._memory is not None:
+            try:
+                self._memory.close()
+            except BufferError:
+                # views of the array still exist; the mapping will be
+                # released once they are garbage-collected
+                logger.debug('Unable to close shared array {} with live views'.format(
+                    self.name))
+            self._memory = None
+
+    def unlink(self):
+        """Detach from and destroy the shared memory.
+
+        This should only be called once, by the process that created the array.
+        """
+        memory = self._memory
+        self.close()
+        if self._owner and memory is not None:
+            _unlink_shared_memory(memory)
@@ -1,12 +1,34 @@
 import argparse
+import collections.abc
 import copy
 import inspect
 import logging
-import pkg_resources
 import sys
+import weakref
 
 logger = logging.getLogger(__name__)
 
+class _StageArgumentParser(argparse.ArgumentParser):
+    """Argument parser that only formats its description when help is requested."""
+    def __init__(self, stage_cls, **kwargs):
+        self.stage_cls = stage_cls
+        super().__init__(**kwargs)
+
+    def format_help(self):
+        if self.description is None:
+            description = self.stage_cls.__doc__ or ''
+            try:
+                # don't include :param: markup, for example
+                description = description[:description.index('\n:')]
+            except ValueError:
+                pass
+            self.description = description
+
+        return super().format_help()
+
+# map stage class -> (ARGS used to build the parser, parser, {name: Argument})
+_parser_cache = weakref.WeakKeyDictionary()
+
 def add_stage_arguments(cls):
     """Adds the arguments specified in a class's ARGS entry to its docstring."""
 
@@ -45,9 +67,39 @@ class Stage:
 
         python -m flowws.run Initialize --seed 13 Run --parameter 1.5
 
+    Stages can declare the resources they need to run through the
+    `RESOURCES` class attribute, a dictionary with (optional) keys
+    'cores' (number of cores used; default 1), 'memory' (bytes or a
+    string like '4G'; default 0), and 'exclusive_storage' (True if no
+    other stage declaring exclusive storage access should run at the
+    same time; default False). These are enforced when a workflow is
+    run with a `ResourceBudget`. Requests for more cores than the
+    budget holds are reduced to the budget total, so stages should
+    use the allocation they were actually granted, found in the
+    `flowws.allocation` scope entry while they run::
+
+        class Simulate(flowws.Stage):
+            ARGS = [...]
+            RESOURCES = dict(cores=4, memory='2G')
+
+            def run(self, scope, storage):
+                cores = scope['flowws.allocation']['cores']
+
+    Stages can also list the scope keys they read through the
+    `SCOPE_INPUTS` class attribute. Values for these keys that were
+    registered lazily using `Scope.set_call` by earlier stages are
+    computed in background threads (see `Scope.prefetch`) while the
+    preceding stages of the workflow are still running::
+
+        class Analyze(flowws.Stage):
+            ARGS = [...]
+            SCOPE_INPUTS = ['trajectory', 'topology']
+
     """
 
     ARGS = []
+    RESOURCES = {}
+    SCOPE_INPUTS = []
 
     def __init__(self, **kwargs):
         self.arg_specifications = {arg.name: copy.deepcopy(arg) for arg in self.ARGS}
@@ -85,6 +137,23 @@ class Stage:
         """Initialize this stage from a JSON representation"""
         return cls(**json_object['arguments'])
 
+    @classmethod
+    def _from_validated(cls, arguments):
+        """Initialize this stage from already-validated argument values.
+
+        Stages that customize `__init__` are always constructed (and
+        their arguments validated) normally.
+        """
+        if cls.__init__ is not Stage.__init__:
+            return cls(**arguments)
+
+        result = cls.__new__(cls)
+        result.arg_specifications = {
+            arg.name: copy.deepcopy(arg) for arg in cls.ARGS}
+        result.arguments = dict(arguments)
+        result.unused_arguments = []
+        return result
+
     def to_JSON(self):
         Cls = type(self)
         name = Cls.__name__
@@ -96,17 +165,13 @@ class Stage:
         return result
 
     @classmethod
-    def from_command(cls, args):
-        """Initialize this stage from a command-line description"""
-        description = cls.__doc__ or ''
-        try:
-            # don't include :param: markup, for example
-            description = description[:description.index('\n:')]
-        except ValueError:
-            pass
-
-        parser = argparse.ArgumentParser(
-            prog=cls.__name__, description=description,
+    def _get_parser(cls):
+        cached = _parser_cache.get(cls)
+        if cached is not None and cached[0] == tuple(cls.ARGS):
+            return cached[1:]
+
+        parser = _StageArgumentParser(
+            cls, prog=cls.__name__,
             formatter_class=argparse.RawDescriptionHelpFormatter,
         )
 
@@ -116,11 +181,97 @@ class Stage:
             arg_objects[arg.name] = arg
             arg.register_parser(parser)
 
+        _parser_cache[cls] = (tuple(cls.ARGS), parser, arg_objects)
+        return parser, arg_objects
+
+    @classmethod
+    def from_command(cls, args):
+        """Initialize this stage from a command-line description.
+
+        The argument parser for each Stage class is created once and
+        reused. If `args` is a dictionary of (already-structured)
+        argument values rather than a list of strings, command-line
+        parsing is skipped and the values are passed directly to the
+        constructor.
+        """
+        if isinstance(args, collections.abc.Mapping):
+            return cls(**args)
+
+        (parser, arg_objects) = cls._get_parser()
+
         arguments = {key: arg_objects[key].validate_cmd(val)
                      for (key, val) in vars(parser.parse_args(args)).items()
                      if val is not None}
         return cls(**arguments)
 
+    def get_resources(self):
+        """Return the resources this stage needs to run.
+
+        By default, this returns the `RESOURCES` class
+        attribute. Stages whose needs depend on their arguments can
+        override this method.
+        """
+        return dict(self.RESOURCES)
+
+    def get_scope_inputs(self):
+        """Return the scope keys this stage will read.
+
+        By default, this returns the `SCOPE_INPUTS` class
+        attribute. Stages whose inputs depend on their arguments can
+        override this method.
+        """
+        return list(self.SCOPE_INPUTS)
+
+    def setup(self):
+        """Perform expensive one-time initialization for this stage.
+
+        This is called once, before the first time the stage is run
+        (or, for runners that execute many workflows, before the first
+        time an equivalent stage is run; see `StageCache`). Stages can
+        override this method to, for example, compile kernels or load
+        models that can be reused between runs with the same
+        arguments.
+        """
+        pass
+
+    def teardown(self):
+        """Release any resources acquired by `setup`.
+
+        This is called when the workflow finishes or, for stages kept
+        in a `StageCache`, when the cache is closed or the stage is
+        evicted.
+        """
+        pass
+
+    def _ensure_set_up(self):
+        if not getattr(self, '_flowws_set_up', False):
+            self.setup()
+            self._flowws_set_up = True
+
+    def _ensure_torn_down(self):
+        if getattr(self, '_flowws_set_up', False):
+            self._flowws_set_up = False
+            self.teardown()
+
+    @classmethod
+    def run_batch(cls, stages, scopes, storages):
+        """Run several stages of this type at once.
+
+        When many workflows of a sweep (see :py:mod:`flowws.sweep`)
+        reach stages of the same type that differ only in their
+        scalar arguments, the stages are run together by a single
+        call to this method, each with its own scope and
+        storage. Stages can override this method to process all of
+        them at once (for example, in a single vectorized numpy
+        call); by default, each stage is simply run in turn.
+
+        :param stages: List of stage objects of this type to run
+        :param scopes: List of scope objects, one for each stage
+        :param storages: List of storage objects, one for each stage
+        """
+        for (stage, scope, storage) in zip(stages, scopes, storages):
+            stage.run(scope, storage)
+
     def run(self, scope, storage):
         """Run the contents of this stage"""
         pass
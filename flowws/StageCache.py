@@ -0,0 +1,88 @@
+import collections
+import json
+import threading
+
+def _stage_key(stage):
+    return json.dumps(stage.to_JSON(), sort_keys=True, default=repr)
+
+class StageCache:
+    """Reuse set-up stage objects among many workflow runs.
+
+    Runners that execute many workflows in one process can share
+    stage objects between workflows: when a workflow uses a stage
+    whose `Stage.to_JSON` description matches that of a stage that
+    was already run, the earlier stage object (on which `Stage.setup`
+    has already been called) is used instead. Stages are torn down
+    (see `Stage.teardown`) when they are evicted from the cache or
+    the cache is closed::
+
+        with flowws.StageCache() as cache:
+            for workflow in workflows:
+                workflow.stage_cache = cache
+                workflow.run()
+
+    Stages kept in a cache may be reused by several workflows running
+    at the same time in different threads; runners that run
+    workflows in parallel threads should give each thread its own
+    cache.
+
+    :param max_size: Maximum number of stages to keep (None for no limit); least-recently-used stages are evicted first
+    """
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self._stages = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # keys of stages that belong to (and are torn down by) another
+        # process that forked this one
+        self._inherited = set()
+
+    def __len__(self):
+        return len(self._stages)
+
+    def get(self, stage):
+        """Return the cached stage equivalent to `stage`, adding `stage` if none is found."""
+        key = _stage_key(stage)
+        evicted = []
+        with self._lock:
+            if key in self._stages:
+                self._stages.move_to_end(key)
+                return self._stages[key]
+
+            self._stages[key] = stage
+            while self.max_size is not None and len(self._stages) > self.max_size:
+                (old_key, old_stage) = self._stages.popitem(last=False)
+                if old_key in self._inherited:
+                    self._inherited.remove(old_key)
+                else:
+                    evicted.append(old_stage)
+
+        for old_stage in evicted:
+            old_stage._ensure_torn_down()
+        return stage
+
+    def close(self):
+        """Tear down and forget all stages in the cache."""
+        with self._lock:
+            stages = [stage for (key, stage) in self._stages.items()
+                      if key not in self._inherited]
+            self._stages.clear()
+            self._inherited.clear()
+
+        for stage in stages:
+            stage._ensure_torn_down()
+
+    def _inherit(self):
+        """Mark all stages currently in the cache as owned by a parent process.
+
+        Called in a forked child process, so that stages the parent
+        set up (and will continue to use) are not torn down by the
+        child when they are evicted or the cache is closed.
+        """
+        with self._lock:
+            self._inherited = set(self._stages)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
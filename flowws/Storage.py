@@ -1,7 +1,14 @@
+import collections
+import contextlib
+import functools
+import io
 import os
 import shutil
 import tempfile
 
+from .load_cache import LoadCache
+from .prefetch import PrefetchBuffer
+
 class FileWriterBuffer:
     def __init__(self, filename, stream_target):
         self.filename = filename
@@ -40,6 +47,39 @@ class NoopBuffer:
     def close(self):
         pass
 
+class WriteStreamWrapper:
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def __enter__(self, *args, **kwargs):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            (on_close, self.on_close) = (self.on_close, None)
+            if on_close is not None:
+                on_close()
+
+StorageStat = collections.namedtuple('StorageStat', ['name', 'size', 'mtime'])
+StorageStat.__doc__ = """Information about a file stored in a `Storage` object.
+
+:param name: Full (internal) name of the file
+:param size: Size of the file in bytes (None if unknown)
+:param mtime: Modification time of the file as a UNIX timestamp (None if unknown)
+"""
+
 class Storage:
     """Base class for file storage.
 
@@ -48,25 +88,401 @@ class Storage:
     example.
 
     """
-    def open(self, filename, mode='r', modifiers=[], on_filesystem=False, noop=False):
+    def open(self, filename, mode='r', modifiers=[], on_filesystem=False, noop=False,
+             compress=None):
         """Open a file stored within this object.
 
+        Files can be transparently compressed using the gzip, bz2, or
+        lzma formats from the python standard library by passing the
+        name of the method as the `compress` argument. Large files are
+        compressed block-wise in a thread pool (see
+        :py:class:`flowws.compression.CompressedWriter`). When reading
+        with any truthy value of `compress` (for example, True), the
+        compression method is detected from the file contents and
+        uncompressed files are returned unchanged::
+
+            with storage.open('trajectory.bin', 'wb', compress='lzma') as f:
+                f.write(contents)
+
+            with storage.open('trajectory.bin', 'rb', compress=True) as f:
+                contents = f.read()
+
         :param filename: Name of the (internal) file
         :param mode: One of 'r' (read), 'w' (write/overwrite), 'a' (append) and, optionally, 'b' (open in binary mode)
         :param modifiers: List of filename modifiers which will be appended to the filename, respecting the file suffix
         :param on_filesystem: If True, the file must exist as a real file on the filesystem; otherwise, a python stream object may be returned
         :param noop: If True, return a dummy file object instead that does nothing
+        :param compress: Compression method ('gzip', 'bz2', or 'lzma') to use when writing; when reading, detect and decompress compressed files if given
         """
-        prefix, suffix = os.path.splitext(filename)
-        full_name = '.'.join([prefix] + modifiers + [suffix[1:]])
+        full_name = self._full_name(filename, modifiers)
 
         if noop:
             return NoopBuffer(full_name)
 
+        if 'w' not in mode and 'a' not in mode:
+            return self._open(full_name, mode, on_filesystem, compress)
+
+        for callback in self._write_callbacks:
+            callback(full_name)
+        if self._prefetch_buffer is not None:
+            self._prefetch_buffer.discard(full_name)
+
+        # values loaded while the file is being written are not cached
+        load_cache = self._get_load_cache()
+        load_cache.begin_write(full_name)
+        try:
+            result = self._open(full_name, mode, on_filesystem, compress)
+        except BaseException:
+            load_cache.end_write(full_name)
+            raise
+        return WriteStreamWrapper(
+            result, functools.partial(self._end_write, load_cache, full_name))
+
+    def _open(self, full_name, mode, on_filesystem, compress):
+        if compress:
+            return self._open_compressed(full_name, mode, on_filesystem, compress)
+
         if on_filesystem:
             return self.open_file(full_name, mode)
 
-        return self.open_stream(full_name, mode)
+        return self._open_stream(full_name, mode)
+
+    def _end_write(self, load_cache, full_name):
+        if self._prefetch_buffer is not None:
+            self._prefetch_buffer.discard(full_name)
+        load_cache.end_write(full_name)
+
+    def _open_compressed(self, full_name, mode, on_filesystem, compress):
+        from . import compression
+
+        binary_mode = mode.replace('t', '').replace('b', '') + 'b'
+        writing = 'w' in mode or 'a' in mode
+
+        if writing:
+            method = compression.get_method(compress)
+            result = compression.CompressedWriter(
+                self.open_stream(full_name, binary_mode), method)
+            if on_filesystem:
+                return FileWriterBuffer(full_name, result)
+        else:
+            result = compression.open_decompressed(
+                self._open_stream(full_name, binary_mode))
+            if on_filesystem:
+                temp_file = tempfile.NamedTemporaryFile(suffix=full_name)
+                with result:
+                    shutil.copyfileobj(result, temp_file)
+                temp_file.seek(0)
+                return temp_file
+
+        if 'b' not in mode:
+            result = io.TextIOWrapper(result)
+        return result
+
+    #: Maximum number of bytes of prefetched file contents to hold in memory
+    prefetch_max_bytes = 64*1024*1024
+    #: Maximum number of prefetched files to hold (or be reading) at once
+    prefetch_max_files = 16
+    #: Number of files to read ahead when files named with consecutive numbers are read in order (0, the default, to disable)
+    prefetch_readahead = 0
+
+    _prefetch_buffer = None
+    # encoding of text read from prefetched binary contents
+    _text_encoding = None
+
+    def prefetch(self, filenames, modifiers=[]):
+        """Start reading files that will soon be opened in background threads.
+
+        The contents of the given files are read in order into a
+        bounded in-memory buffer (see `prefetch_max_bytes` and
+        `prefetch_max_files`); opening one of these files for reading
+        through `open` then returns a stream of the buffered contents.
+        Files larger than `prefetch_max_bytes` are not prefetched. If
+        `prefetch_readahead` is set, files are also read ahead
+        automatically when files named by consecutive numbers (like
+        `frame_0.bin`, `frame_1.bin`, ...) are opened in order. Note
+        that prefetched files are read completely, rather than lazily
+        as `GetarStorage` can for some records.
+
+        Buffered contents are discarded when the file is opened for
+        writing through this object, but changes made by other
+        processes are not detected.
+
+        :param filenames: Iterable of (internal) file names
+        :param modifiers: List of filename modifiers to apply to each file name
+        """
+        self._get_prefetch_buffer().prefetch(
+            [self._full_name(filename, modifiers) for filename in filenames])
+
+    def _get_prefetch_buffer(self):
+        if self._prefetch_buffer is None:
+            self._prefetch_buffer = PrefetchBuffer(
+                self._read_prefetched, self.prefetch_max_bytes,
+                self.prefetch_max_files, self.prefetch_readahead,
+                self._prefetch_size)
+        return self._prefetch_buffer
+
+    def _prefetch_size(self, full_name):
+        try:
+            return self.stat_file(full_name).size
+        except NotImplementedError:
+            return None
+
+    def _read_prefetched(self, full_name):
+        with self.open_stream(full_name, 'rb') as f:
+            return f.read()
+
+    def _open_stream(self, full_name, mode):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            return self.open_stream(full_name, mode)
+
+        buffer = self._get_prefetch_buffer()
+        contents = buffer.take(full_name)
+        buffer.observe(full_name)
+
+        if contents is None:
+            return self.open_stream(full_name, mode)
+        elif 'b' in mode:
+            return io.BytesIO(contents)
+        return io.TextIOWrapper(io.BytesIO(contents), encoding=self._text_encoding)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_prefetch_buffer', None)
+        state.pop('_load_cache', None)
+        return state
+
+    async def _run_in_executor(self, function, *args, **kwargs):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(function, *args, **kwargs))
+
+    async def open_async(self, filename, mode='r', modifiers=[], **kwargs):
+        """Open a file stored within this object without blocking the event loop.
+
+        The file is opened (see `open`) in the default executor of the
+        running asyncio event loop. Note that reads and writes of the
+        returned file object are not asynchronous; use
+        `read_bytes_async` and `write_bytes_async` to transfer entire
+        files without blocking.
+        """
+        return await self._run_in_executor(
+            self.open, filename, mode, modifiers, **kwargs)
+
+    def _read_bytes(self, filename, modifiers=[], **kwargs):
+        with self.open(filename, 'rb', modifiers, **kwargs) as f:
+            return f.read()
+
+    def _write_bytes(self, filename, contents, modifiers=[], **kwargs):
+        with self.open(filename, 'wb', modifiers, **kwargs) as f:
+            f.write(contents)
+
+    async def read_bytes_async(self, filename, modifiers=[], **kwargs):
+        """Read the entire contents of a file in the default executor of the running event loop.
+
+        :param filename: Name of the (internal) file
+        :param modifiers: List of filename modifiers which will be appended to the filename, respecting the file suffix
+        :param kwargs: Additional arguments (i.e. `compress`) for `open`
+        """
+        return await self._run_in_executor(
+            self._read_bytes, filename, modifiers, **kwargs)
+
+    async def write_bytes_async(self, filename, contents, modifiers=[], **kwargs):
+        """Replace the contents of a file in the default executor of the running event loop.
+
+        :param filename: Name of the (internal) file
+        :param contents: Bytes to write
+        :param modifiers: List of filename modifiers which will be appended to the filename, respecting the file suffix
+        :param kwargs: Additional arguments (i.e. `compress`) for `open`
+        """
+        return await self._run_in_executor(
+            self._write_bytes, filename, contents, modifiers, **kwargs)
+
+    def log(self, filename, schema, modifiers=[], **kwargs):
+        """Open a buffered, append-only log of binary records.
+
+        See :py:class:`flowws.RecordLog.RecordLog` for details.
+
+        :param filename: Name of the (internal) file
+        :param schema: List of (field name, type) pairs, like `[('step', 'i8'), ('energy', 'f8')]`
+        :param modifiers: List of filename modifiers which will be appended to the filename, respecting the file suffix
+        :param kwargs: Additional arguments (`flush_bytes`, `flush_interval`) for the `RecordLog`
+        """
+        from .RecordLog import RecordLog
+        return RecordLog(self, filename, schema, modifiers, **kwargs)
+
+    def read_log(self, filename, modifiers=[], as_array=False):
+        """Read the rows of a log written using `log`.
+
+        :param filename: Name of the (internal) file
+        :param modifiers: List of filename modifiers which will be appended to the filename, respecting the file suffix
+        :param as_array: If True, return a numpy structured array rather than a list of tuples
+        """
+        from .RecordLog import read_record_log
+        with self._open_log(filename, modifiers) as f:
+            return read_record_log(f, as_array)
+
+    def _append_log(self, filename, modifiers, contents):
+        """Append binary contents to a record log."""
+        with self.open(filename, 'ab', modifiers) as f:
+            f.write(contents)
+
+    def _open_log(self, filename, modifiers):
+        """Open a binary stream of the complete contents of a record log."""
+        return self.open(filename, 'rb', modifiers)
+
+    #: Maximum total (estimated) size in bytes of values cached by `load`
+    load_cache_max_bytes = 256*1024*1024
+
+    _load_cache = None
+
+    def load(self, filename, decoder=None, modifiers=[]):
+        """Read and decode a file, caching the decoded value in memory.
+
+        Files are decoded using the decoders of
+        :py:class:`flowws.StorageReference`, chosen by the file suffix
+        (.json, .npy, or .txt; other files are read as bytes) unless
+        a decoder name (or a function taking a binary stream) is
+        given. Decoded values are kept in a least-recently used cache
+        of at most `load_cache_max_bytes` bytes, so that stages of a
+        workflow that load the same file only read and decode it
+        once::
+
+            config = storage.load('config.json')
+            positions = storage.load('positions.npy')
+
+        Cached values are discarded when the file is opened for
+        writing through this object (and again when the written
+        stream is closed; values are not cached while it is open),
+        but changes made by other processes are not detected. Values are shared among all
+        callers and should not be modified.
+
+        :param filename: Name of the (internal) file
+        :param decoder: Name of the decoder to use, or a function taking a binary stream and returning the decoded value (default: choose based on the file suffix)
+        :param modifiers: List of filename modifiers which will be appended to the filename, respecting the file suffix
+        """
+        from .StorageReference import StorageReference
+
+        full_name = self._full_name(filename, modifiers)
+        if decoder is None:
+            suffix = os.path.splitext(filename)[1]
+            decoder = StorageReference.suffix_decoders.get(suffix, 'bytes')
+
+        cache = self._get_load_cache()
+
+        key = (full_name, decoder)
+        try:
+            return cache.get(key)
+        except KeyError:
+            pass
+
+        decode = decoder if callable(decoder) else StorageReference.decoders[decoder]
+        generation = cache.generation
+        with self._open_stream(full_name, 'rb') as f:
+            contents = f.read()
+        result = decode(io.BytesIO(contents))
+        cache.put(key, result, len(contents), generation)
+        return result
+
+    def _get_load_cache(self):
+        if self._load_cache is None:
+            self._load_cache = LoadCache(self.load_cache_max_bytes)
+        self._load_cache.max_bytes = self.load_cache_max_bytes
+        return self._load_cache
+
+    _write_callbacks = ()
+
+    def add_write_callback(self, callback):
+        """Register a function to be called whenever a file is opened for writing.
+
+        :param callback: Function taking the full name of each file that is opened for writing or appending
+        """
+        self._write_callbacks = tuple(self._write_callbacks) + (callback,)
+
+    def remove_write_callback(self, callback):
+        """Remove a function previously registered using `add_write_callback`."""
+        self._write_callbacks = tuple(
+            c for c in self._write_callbacks if c is not callback)
+
+    @staticmethod
+    def _full_name(filename, modifiers=[]):
+        prefix, suffix = os.path.splitext(filename)
+        return '.'.join([prefix] + list(modifiers) + [suffix[1:]])
+
+    def exists(self, filename, modifiers=[]):
+        """Return True if a file is stored within this object.
+
+        :param filename: Name of the (internal) file
+        :param modifiers: List of filename modifiers, as in `open`
+        """
+        full_name = self._full_name(filename, modifiers)
+        try:
+            self.stat_file(full_name)
+        except FileNotFoundError:
+            return False
+        except NotImplementedError:
+            # storage types implementing only open_stream
+            try:
+                with self.open_stream(full_name, 'rb'):
+                    pass
+            except FileNotFoundError:
+                return False
+        return True
+
+    def stat(self, filename, modifiers=[]):
+        """Return a `StorageStat` object describing a stored file.
+
+        Raises FileNotFoundError if the file does not exist.
+
+        :param filename: Name of the (internal) file
+        :param modifiers: List of filename modifiers, as in `open`
+        """
+        return self.stat_file(self._full_name(filename, modifiers))
+
+    def list(self, prefix=''):
+        """Return a sorted list of the names of all stored files beginning with a prefix.
+
+        :param prefix: Only return files whose full (internal) name begins with this string
+        """
+        return sorted(self.list_files(prefix))
+
+    def stat_file(self, full_name):
+        """Return a `StorageStat` for a file given its full name."""
+        raise NotImplementedError('Storage.stat_file')
+
+    def list_files(self, prefix):
+        """Return an iterable of the full names of stored files beginning with a prefix."""
+        raise NotImplementedError('Storage.list_files')
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Group all writes made within this context together.
+
+        Storage backends that support it (such as `GetarStorage`)
+        write all files closed within the context in a single
+        transaction or archive append when the context exits, rather
+        than separately for each file. The default implementation
+        does nothing. Batches can be nested; writes are performed when
+        the outermost batch exits.
+
+        Example::
+
+            with storage.batch():
+                for i in range(1000):
+                    with storage.open('frame.txt', 'w', modifiers=[str(i)]) as f:
+                        f.write(contents[i])
+        """
+        yield self
+
+    def close(self):
+        """Release any resources (such as open archive files) held by this object.
+
+        Files written through this object are only guaranteed to be
+        complete (for example, visible to other processes) once it is
+        closed. The object can still be used afterward, reopening
+        files as needed. The default implementation does nothing.
+        """
+        pass
 
     def open_stream(self, full_name, mode):
         """Open a file stored within this object as a stream."""
@@ -0,0 +1,118 @@
+import json
+import threading
+
+def _load_npy(stream):
+    import numpy as np
+    return np.load(stream, allow_pickle=False)
+
+class StorageReference:
+    """Reference to a scope value stored in a file of a storage object.
+
+    Scope values of JSON workflow descriptions (and of the initial
+    scope given to `Workflow`) can refer to files rather than
+    embedding large values directly::
+
+        "scope": {"table": {"$storage": "inputs/table.npy"}}
+
+    References are resolved lazily using `Scope.set_call` when the
+    workflow is run, so files are only read if a stage actually
+    accesses the corresponding scope key. Files are read from the
+    storage of the workflow unless a JSON description of another
+    storage is given through the `storage` key. The contents of the
+    file are converted to a value using a decoder, which is chosen
+    by the file suffix (.json, .npy, or .txt; other files are read
+    as bytes) unless given explicitly by the `decoder` key. Additional
+    decoders can be added using `register_decoder`. Values are read
+    through `Storage.load`, so references to the same file share a
+    single decoded value.
+
+    :param name: Name of the file within the storage
+    :param decoder: Name of the decoder to use (default: choose based on the file suffix)
+    :param storage: JSON description of the storage to read from (default: use the workflow storage)
+    """
+
+    #: Functions to convert a binary stream into a value, by name
+    decoders = dict(
+        bytes=lambda stream: stream.read(),
+        text=lambda stream: stream.read().decode('utf-8'),
+        json=lambda stream: json.loads(stream.read().decode('utf-8')),
+        npy=_load_npy,
+    )
+
+    #: Default decoder names, by file suffix
+    suffix_decoders = {
+        '.json': 'json',
+        '.npy': 'npy',
+        '.txt': 'text',
+    }
+
+    def __init__(self, name, decoder=None, storage=None):
+        if decoder is not None and decoder not in self.decoders:
+            raise ValueError('Unknown decoder {}; use one of {}'.format(
+                decoder, sorted(self.decoders)))
+
+        self.name = name
+        self.decoder = decoder
+        self.storage = storage
+        # storage object described by `storage`, created when first used
+        self._storage = None
+        self._storage_lock = threading.Lock()
+
+    def __getstate__(self):
+        return dict(name=self.name, decoder=self.decoder, storage=self.storage)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __eq__(self, other):
+        return (isinstance(other, StorageReference) and
+                self.to_JSON() == other.to_JSON())
+
+    def __hash__(self):
+        return hash(json.dumps(self.to_JSON(), sort_keys=True))
+
+    def __repr__(self):
+        return 'StorageReference({})'.format(
+            json.dumps(self.to_JSON(), sort_keys=True))
+
+    @classmethod
+    def register_decoder(cls, name, function, suffixes=[]):
+        """Register a new decoder for scope references.
+
+        :param name: Name of the decoder
+        :param function: Function taking a binary stream and returning the decoded value
+        :param suffixes: File suffixes (like '.csv') to use this decoder for by default
+        """
+        cls.decoders[name] = function
+        for suffix in suffixes:
+            cls.suffix_decoders[suffix] = name
+
+    @classmethod
+    def from_JSON(cls, value):
+        """Return a StorageReference if `value` is a JSON reference, else return `value` unchanged."""
+        if isinstance(value, dict) and '$storage' in value:
+            return cls(value['$storage'], value.get('decoder'), value.get('storage'))
+        return value
+
+    def to_JSON(self):
+        result = {'$storage': self.name}
+        if self.decoder is not None:
+            result['decoder'] = self.decoder
+        if self.storage is not None:
+            result['storage'] = self.storage
+        return result
+
+    def load(self, storage):
+        """Read and decode the referenced value.
+
+        :param storage: Storage to read from, if this reference does not specify its own storage
+        """
+        if self.storage is not None:
+            # reuse one storage object (and its load cache) for all loads
+            with self._storage_lock:
+                if self._storage is None:
+                    from .Workflow import storage_from_JSON
+                    self._storage = storage_from_JSON(self.storage)
+            storage = self._storage
+
+        return storage.load(self.name, self.decoder)
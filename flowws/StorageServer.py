@@ -0,0 +1,231 @@
+import io
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+
+from .Storage import Storage
+
+logger = logging.getLogger(__name__)
+
+def _handle_client(connection, storage, lock):
+    while True:
+        try:
+            request = connection.recv()
+        except (EOFError, OSError):
+            break
+
+        (command, args) = request[0], request[1:]
+        try:
+            with lock:
+                if command == 'read':
+                    (full_name, mode) = args
+                    with storage.open_stream(full_name, mode) as f:
+                        result = f.read()
+                elif command == 'write':
+                    (full_name, mode, contents) = args
+                    with storage.open_stream(full_name, mode) as f:
+                        f.write(contents)
+                    result = None
+                elif command == 'stat':
+                    (full_name,) = args
+                    result = storage.stat_file(full_name)
+                elif command == 'list':
+                    (prefix,) = args
+                    result = list(storage.list_files(prefix))
+                else:
+                    raise ValueError('Unknown storage server command {}'.format(command))
+        except Exception as e:
+            connection.send(('error', e))
+        else:
+            connection.send(('ok', result))
+
+    connection.close()
+
+def _serve(storage_description, authkey, address_pipe, stop_pipe):
+    from .Workflow import storage_from_JSON
+
+    storage = storage_from_JSON(storage_description)
+    lock = threading.Lock()
+    listener = multiprocessing.connection.Listener(authkey=authkey)
+
+    def accept():
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, multiprocessing.AuthenticationError):
+                continue
+            thread = threading.Thread(
+                target=_handle_client, args=(connection, storage, lock),
+                daemon=True)
+            thread.start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    address_pipe.send(listener.address)
+
+    # wait until the owner asks us to stop (or goes away)
+    try:
+        stop_pipe.recv()
+    except EOFError:
+        pass
+
+    with lock:
+        storage.close()
+
+class _ServedBuffer:
+    def __init__(self, storage, full_name, mode):
+        self.storage = storage
+        self.full_name = full_name
+        self.mode = mode
+        self.buffer = io.BytesIO() if 'b' in mode else io.StringIO()
+
+    def __getattr__(self, name):
+        return getattr(self.buffer, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def close(self):
+        if not self.buffer.closed:
+            self.storage._request('write', self.full_name, self.mode,
+                                  self.buffer.getvalue())
+            self.buffer.close()
+
+class ServedStorage(Storage):
+    """Storage client that forwards all operations to a `StorageServer`.
+
+    ServedStorage objects can be pickled and sent to other processes
+    (for example, using `multiprocessing`); each process opens its
+    own connection to the server when it first uses the storage.
+    Files opened for writing are sent to the server when they are
+    closed. Data appended to files (mode 'a') are sent to the server
+    as a single append operation, so concurrent appends from
+    different workers are not lost.
+
+    ServedStorage objects are created through `StorageServer.storage`.
+    """
+    def __init__(self, address, authkey, description):
+        self.address = address
+        self.authkey = bytes(authkey)
+        self.description = description
+        self._connection = None
+        self._connection_pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return dict(address=self.address, authkey=self.authkey,
+                    description=self.description)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def to_JSON(self):
+        return dict(self.description)
+
+    def _request(self, *args):
+        with self._lock:
+            if self._connection is None or self._connection_pid != os.getpid():
+                self._connection = multiprocessing.connection.Client(
+                    self.address, authkey=self.authkey)
+                self._connection_pid = os.getpid()
+
+            self._connection.send(args)
+            (status, result) = self._connection.recv()
+
+        if status == 'error':
+            raise result
+        return result
+
+    def stat_file(self, full_name):
+        return self._request('stat', full_name)
+
+    def list_files(self, prefix):
+        return self._request('list', prefix)
+
+    def open_stream(self, full_name, mode):
+        if 'w' in mode or 'a' in mode:
+            return _ServedBuffer(self, full_name, mode)
+
+        contents = self._request('read', full_name, mode)
+        if 'b' in mode:
+            return io.BytesIO(contents)
+        return io.StringIO(contents)
+
+class StorageServer:
+    """Own a storage object in a separate process and serve it to many workers.
+
+    Some storage backends, such as `GetarStorage`, cannot be safely
+    written to by several processes at once. A StorageServer starts
+    a single writer process that owns the storage; workers send file
+    contents to it through a local socket using the `ServedStorage`
+    object given by the `storage` property. All operations are
+    performed in order by the writer process, so every read sees the
+    result of all previously-completed writes.
+
+    Example::
+
+        description = dict(type='GetarStorage', target='results.sqlite')
+        with flowws.StorageServer(description) as server:
+            pool.map(analyze_frame, [(i, server.storage) for i in range(N)])
+
+    The server process opens its own storage object from the JSON
+    description. When a storage object is given instead, the server
+    takes it over: it is closed (see `Storage.close`), so that only
+    the server process writes to the underlying archive, and should
+    not be used by the caller afterward.
+
+    :param storage: JSON description of the storage to serve, or a storage object to take over
+    """
+    def __init__(self, storage):
+        if isinstance(storage, Storage):
+            description = storage.to_JSON()
+            storage.close()
+            storage = description
+
+        self.description = dict(storage)
+        self.authkey = os.urandom(32)
+        self._process = None
+        self._stop_pipe = None
+        self._storage = None
+
+    def start(self):
+        """Start the writer process."""
+        (address_receiver, address_sender) = multiprocessing.Pipe(False)
+        (stop_receiver, self._stop_pipe) = multiprocessing.Pipe(False)
+
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.description, self.authkey,
+                                 address_sender, stop_receiver),
+            daemon=True)
+        self._process.start()
+
+        address = address_receiver.recv()
+        self._storage = ServedStorage(address, self.authkey, self.description)
+        return self
+
+    def stop(self):
+        """Stop the writer process after all pending operations have finished."""
+        if self._process is None:
+            return
+
+        self._stop_pipe.send(None)
+        self._process.join()
+        self._process = None
+        self._storage = None
+
+    @property
+    def storage(self):
+        """`ServedStorage` object to use for reading and writing files."""
+        if self._storage is None:
+            raise RuntimeError('StorageServer has not been started')
+        return self._storage
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args, **kwargs):
+        self.stop()
@@ -1,15 +1,80 @@
 import argparse
 import collections
+import collections.abc
 import contextlib
 import copy
 import datetime
 import functools
 import importlib
+import inspect
 import json
-import pkg_resources
+import os
 
+from . import bundle
 from .DirectoryStorage import DirectoryStorage
-from .GetarStorage import GetarStorage
+from .internal import LazyExecutor
+from .ResourceBudget import ResourceBudget
+from .StorageReference import StorageReference
+
+# map entry_point group -> list of installed entry points
+_entry_point_cache = {}
+# map entry point -> loaded object
+_loaded_entry_points = {}
+
+def _iter_entry_points(group):
+    if group not in _entry_point_cache:
+        try:
+            from importlib import metadata
+        except ImportError: # python < 3.8
+            import pkg_resources
+            entry_points = list(pkg_resources.iter_entry_points(group))
+        else:
+            entry_points = metadata.entry_points()
+            if hasattr(entry_points, 'select'):
+                entry_points = list(entry_points.select(group=group))
+            else: # python < 3.10
+                entry_points = list(entry_points.get(group, []))
+        _entry_point_cache[group] = entry_points
+
+    return _entry_point_cache[group]
+
+def _load_entry_point(entry_point):
+    try:
+        return _loaded_entry_points[entry_point]
+    except (KeyError, TypeError):
+        pass
+
+    result = entry_point.load()
+    try:
+        _loaded_entry_points[entry_point] = result
+    except TypeError: # unhashable entry point
+        pass
+    return result
+
+def storage_from_JSON(json_object):
+    """Construct a Storage object from its JSON description."""
+    storage_args = dict(json_object)
+    storage_type = storage_args.pop('type', 'DirectoryStorage')
+    if storage_type == 'DirectoryStorage':
+        return DirectoryStorage(**storage_args)
+    elif storage_type == 'GetarStorage':
+        from .GetarStorage import GetarStorage
+        return GetarStorage(**storage_args)
+
+    raise NotImplementedError()
+
+_prefetch_executor = LazyExecutor(
+    min(32, (os.cpu_count() or 1) + 4), 'flowws-prefetch')
+
+class _Prefetched:
+    # callback whose value is being computed in the background
+    __slots__ = ['future']
+
+    def __init__(self, callback):
+        self.future = _prefetch_executor.submit(callback)
+
+    def __call__(self):
+        return self.future.result()
 
 class Scope(dict):
     """Simple dictionary that can parse callbacks.
@@ -19,6 +84,13 @@ class Scope(dict):
     to populate the scope with the callback result. Calling `set_call`
     will not necessarily add a key to the set of keys produced when
     iterating over the dictionary for performance purposes.
+
+    Callbacks can also be evaluated ahead of time in a shared pool of
+    background threads, either as soon as they are registered (using
+    `set_call(..., prefetch=True)`) or later through `prefetch`;
+    accessing the key then waits for the background computation to
+    finish. `Workflow.run` prefetches the keys declared by the
+    `SCOPE_INPUTS` of each stage (see `Stage.get_scope_inputs`).
     """
 
     def __init__(self, *args, **kwargs):
@@ -43,14 +115,181 @@ class Scope(dict):
             return self[key]
         return super().get(key, default)
 
-    def set_call(self, key, callback):
+    def prefetch(self, keys):
+        """Start evaluating the callbacks of some keys in background threads.
+
+        Keys that have already been evaluated (or that do not have a
+        callback) are ignored.
+
+        :param keys: iterable of dictionary keys
+        """
+        for key in keys:
+            callback = self._callbacks.get(key)
+            if callback is not None and not isinstance(callback, _Prefetched):
+                self._callbacks[key] = _Prefetched(callback)
+
+    def set_call(self, key, callback, prefetch=False):
         """Register a callback to later retrieve a value.
 
         :param key: dictionary key for this object to associate the callback with
         :param callback: a parameter-free callable that returns the value to set
+        :param prefetch: If True, immediately start evaluating the callback in a background thread
         """
+        if prefetch:
+            callback = _Prefetched(callback)
         self._callbacks[key] = callback
 
+    def snapshot(self):
+        """Return a shallow copy of this scope, including its callbacks."""
+        return copy.copy(self)
+
+_DELETED = object()
+
+class _Callback:
+    __slots__ = ['function']
+
+    def __init__(self, function):
+        self.function = function
+
+class PersistentScope(collections.abc.MutableMapping):
+    """Scope with cheap, structurally-shared snapshots.
+
+    PersistentScope objects behave like `Scope` (including lazy
+    callbacks registered with `set_call`), but are stored as a stack
+    of immutable layers of key-value pairs plus a small mutable layer
+    of recent changes. Taking a snapshot (through `snapshot` or
+    `copy.copy`) freezes the mutable layer and shares all layers
+    between the original and the snapshot; later writes to either
+    object only touch the keys that change. Layers are merged
+    log-structured style (whenever a layer grows at least as large as
+    the layer below it), so lookups only consult a logarithmic number
+    of layers. A snapshot that triggers a merge copies the merged
+    layers, so individual snapshots can take time proportional to
+    the size of the scope, but the cost of a series of snapshots is
+    amortized to a logarithmic number of copies of each changed key.
+
+    Unlike `Scope`, PersistentScope is not a `dict` subclass. Use
+    `Workflow(..., persistent_scope=True)` to run a workflow with a
+    PersistentScope.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._local = {}
+        self._layers = ()
+        self._length = 0
+        self.update(*args, **kwargs)
+
+    def _lookup(self, key):
+        if key in self._local:
+            return self._local[key]
+        for layer in self._layers:
+            if key in layer:
+                return layer[key]
+        return _DELETED
+
+    def _set(self, key, value):
+        old = self._lookup(key)
+        was_visible = old is not _DELETED and not isinstance(old, _Callback)
+        is_visible = value is not _DELETED and not isinstance(value, _Callback)
+        self._length += int(is_visible) - int(was_visible)
+
+        if value is _DELETED and not any(key in layer for layer in self._layers):
+            self._local.pop(key, None)
+        else:
+            self._local[key] = value
+
+    def __contains__(self, key):
+        return self._lookup(key) is not _DELETED
+
+    def __copy__(self):
+        return self.snapshot()
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is _DELETED:
+            raise KeyError(key)
+        elif isinstance(value, _Callback):
+            value = value.function()
+            self._set(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._set(key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._set(key, _DELETED)
+
+    def __iter__(self):
+        seen = set()
+        for layer in (self._local,) + self._layers:
+            for (key, value) in layer.items():
+                if key in seen:
+                    continue
+                seen.add(key)
+                if value is not _DELETED and not isinstance(value, _Callback):
+                    yield key
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return 'PersistentScope({})'.format(
+            {key: self._lookup(key) for key in self})
+
+    def prefetch(self, keys):
+        """Start evaluating the callbacks of some keys in background threads.
+
+        Snapshots sharing a callback also share its background
+        computation.
+
+        :param keys: iterable of dictionary keys
+        """
+        for key in keys:
+            value = self._lookup(key)
+            if (isinstance(value, _Callback) and
+                    not isinstance(value.function, _Prefetched)):
+                value.function = _Prefetched(value.function)
+
+    def set_call(self, key, callback, prefetch=False):
+        """Register a callback to later retrieve a value.
+
+        :param key: dictionary key for this object to associate the callback with
+        :param callback: a parameter-free callable that returns the value to set
+        :param prefetch: If True, immediately start evaluating the callback in a background thread
+        """
+        if prefetch:
+            callback = _Prefetched(callback)
+        self._set(key, _Callback(callback))
+
+    def snapshot(self):
+        """Return an independent copy of this scope.
+
+        Only the keys changed since the last snapshot are copied,
+        except when layers are merged (see `PersistentScope`).
+        """
+        if self._local:
+            layers = (self._local,) + self._layers
+            self._local = {}
+
+            while len(layers) > 1 and len(layers[0]) >= len(layers[1]):
+                merged = dict(layers[1])
+                merged.update(layers[0])
+                if len(layers) == 2:
+                    # nothing left to hide below the bottom layer
+                    merged = {key: value for (key, value) in merged.items()
+                              if value is not _DELETED}
+                layers = (merged,) + layers[2:]
+
+            self._layers = layers
+
+        result = type(self).__new__(type(self))
+        result._local = {}
+        result._layers = self._layers
+        result._length = self._length
+        return result
+
 class Workflow:
     """Specify a complete sequence of operations to perform.
 
@@ -67,7 +306,13 @@ class Workflow:
 
     :param stages: List of `Stage` objects specifying the operations to perform
     :param storage: `Storage` object specifying where results should be saved (default: create a DirectoryStorage using the current working directory)
-    :param scope: Dictionary of key-value pairs specifying external input parameters
+    :param scope: Dictionary of key-value pairs specifying external input parameters; values can be `StorageReference` objects (or their JSON form, like `{"$storage": "table.npy"}`), which are read lazily when first accessed
+    :param resources: Optional `ResourceBudget` object limiting the resources used by stages (see `Stage.get_resources`); can be shared among workflows that are run in parallel
+    :param batch_storage: If True, group all storage writes made by each stage together (see `Storage.batch`)
+    :param persistent_scope: If True, use a `PersistentScope` (with cheap, amortized snapshots) rather than a `Scope` when running
+    :param profile: If True, profile each stage using cProfile (or, if 'memory', also trace memory allocations using tracemalloc) and write reports into the storage (see `flowws.profiling.StageProfiler`)
+    :param catalog: Optional `flowws.catalog.Catalog` object (or database filename) in which to record each run of this workflow
+    :param stage_cache: Optional `StageCache` from which to reuse already set-up stages (see `Stage.setup`); otherwise, stages are torn down when the workflow finishes running
 
     """
 
@@ -80,39 +325,44 @@ class Workflow:
         def load(self):
             return self.target
 
-    def __init__(self, stages, storage=None, scope={}):
+    def __init__(self, stages, storage=None, scope={}, resources=None,
+                 batch_storage=False, persistent_scope=False, profile=False,
+                 catalog=None, stage_cache=None):
         if storage is None:
             storage = DirectoryStorage()
 
         self.stages = stages
         self.storage = storage
-        self.scope = dict(scope)
+        self.scope = {key: StorageReference.from_JSON(value)
+                      for (key, value) in dict(scope).items()}
+        self.resources = resources
+        self.batch_storage = batch_storage
+        self.persistent_scope = persistent_scope
+        self.profile = profile
+        if isinstance(catalog, str):
+            from .catalog import Catalog
+            catalog = Catalog(catalog)
+        self.catalog = catalog
+        self.stage_cache = stage_cache
 
     @classmethod
     def from_JSON(cls, json_object, module_names='flowws_modules'):
-        """Construct a Workflow from a JSON object."""
-        modules = cls.get_named_modules(module_names)
+        """Construct a Workflow from a JSON object.
 
-        storage_args = dict(json_object['storage'])
-        storage_type = storage_args.pop('type', 'DirectoryStorage')
-        if storage_type == 'DirectoryStorage':
-            storage = DirectoryStorage(**storage_args)
-        elif storage_type == 'GetarStorage':
-            storage = GetarStorage(**storage_args)
-        else:
-            raise NotImplementedError()
+        Stage classes are imported using the `module_name` recorded
+        for each stage; entry points registered under `module_names`
+        are only searched for stages that can not be found that way.
+        """
+        storage = storage_from_JSON(json_object['storage'])
 
         stages_json = json_object['stages']
         stages = []
         for stage_json in stages_json:
             stage_json = dict(stage_json)
             stage_type = stage_json.pop('type')
-            try:
-                module_name = stage_json.pop('module_name')
-                module = importlib.import_module(module_name)
-                stage_cls = getattr(module, stage_type)
-            except (KeyError, AttributeError, ModuleNotFoundError):
-                stage_cls = modules[stage_type].load()
+            module_name = stage_json.pop('module_name', None)
+            stage_cls = cls.find_stage_class(
+                stage_type, module_name, module_names)
             stages.append(stage_cls.from_JSON(stage_json))
 
         scope = dict(json_object.get('scope', {}))
@@ -130,45 +380,98 @@ class Workflow:
 
     def to_JSON(self):
         stages = [stage.to_JSON() for stage in self.stages]
+        scope = {key: (value.to_JSON() if isinstance(value, StorageReference)
+                       else value) for (key, value) in self.scope.items()}
         result = dict(storage=self.storage.to_JSON(),
                       stages=stages,
-                      scope=self.scope)
+                      scope=scope)
         return result
 
     @classmethod
     def get_named_modules(cls, module_names):
+        """Return a dictionary of entry points for all modules registered under a name.
+
+        Installed entry points are only scanned once per process.
+        """
         modules = {}
-        for entry_point in pkg_resources.iter_entry_points(module_names):
+        for entry_point in _iter_entry_points(module_names):
             modules[entry_point.name] = entry_point
         for name, entry_point in cls._additional_entry_points[module_names].items():
             modules[name] = entry_point
         return modules
 
     @classmethod
-    def from_command(cls, args=None, module_names='flowws_modules', scope={}):
-        """Construct a Workflow from a command-line description.
+    def find_stage_class(cls, qualname, module_name=None,
+                         module_names='flowws_modules'):
+        """Return a stage class given its location.
 
-        Stages are found based on setuptools entry_point specified
-        under `module_names`.
+        The class is imported directly from `module_name` if it is
+        given; otherwise (or if the import fails), it is found by name
+        among the entry points registered under `module_names`.
 
-        :param args: List of command-line arguments (list of strings)
-        :param module_names: setuptools entry_point to use for module searches
-        :param scope: Dictionary of initial key-value pairs to pass to child Stages
+        :param qualname: Qualified name of the class within its module (or name of its entry point)
+        :param module_name: Name of the module defining the class
+        :param module_names: setuptools entry_point to search if the class can not be imported directly
         """
+        if module_name is not None:
+            try:
+                result = importlib.import_module(module_name)
+                for name in qualname.split('.'):
+                    result = getattr(result, name)
+                return result
+            except (AttributeError, ImportError):
+                pass
+
+        modules = cls.get_named_modules(module_names)
+        return _load_entry_point(modules[qualname.split('.')[-1]])
+
+    _command_parser = None
+
+    @classmethod
+    def _get_command_parser(cls):
+        if Workflow._command_parser is not None:
+            return Workflow._command_parser
+
         parser = argparse.ArgumentParser(
             description='Run a workflow')
         parser.add_argument('--storage', help='Storage location to use')
         parser.add_argument('-d', '--define', nargs=2, action='append', default=[],
             help='Define a workflow-specific value')
-        parser.add_argument('-m', '--module-names', default=module_names,
+        parser.add_argument('-m', '--module-names',
             help='Registered module entry_point to search')
+        parser.add_argument('--batch-storage', action='store_true',
+            help='Group all storage writes made by each stage together')
+        parser.add_argument('--max-cores', type=int,
+            help='Maximum number of cores to grant to each stage (stages of a workflow run one at a time)')
+        parser.add_argument('--max-memory',
+            help='Maximum amount of memory (i.e. 512M or 4G) for stages to use at once')
+        parser.add_argument('--profile', action='store_true',
+            help='Profile each stage, writing reports to the flowws_profile/ group of the storage')
+        parser.add_argument('--profile-memory', action='store_true',
+            help='Profile each stage, also tracing memory allocations')
+        parser.add_argument('--catalog',
+            help='SQLite database to record this run in (default: FLOWWS_CATALOG environment variable)')
         parser.add_argument('workflow', nargs=argparse.REMAINDER,
             help='Workflow description')
 
+        Workflow._command_parser = parser
+        return parser
+
+    @classmethod
+    def from_command(cls, args=None, module_names='flowws_modules', scope={}):
+        """Construct a Workflow from a command-line description.
+
+        Stages are found based on setuptools entry_point specified
+        under `module_names`.
+
+        :param args: List of command-line arguments (list of strings)
+        :param module_names: setuptools entry_point to use for module searches
+        :param scope: Dictionary of initial key-value pairs to pass to child Stages
+        """
+        parser = cls._get_command_parser()
         args_str = args
         args = parser.parse_args(args)
-
-        modules = cls.get_named_modules(args.module_names)
+        args.module_names = args.module_names or module_names
 
         scope = dict(scope)
         storage = None
@@ -187,6 +490,7 @@ class Workflow:
 
             if any(location.endswith(suffix)
                    for suffix in ('.zip', '.tar', '.sqlite')):
+                from .GetarStorage import GetarStorage
                 storage = GetarStorage(location)
             else:
                 storage = DirectoryStorage(location)
@@ -200,7 +504,15 @@ class Workflow:
             scope.update(template_workflow.scope)
             storage = template_workflow.storage
             workflow_stages = template_workflow.stages
+        elif len(args.workflow) == 1 and bundle.is_bundle(args.workflow[0]):
+            template_workflow = bundle.load_bundle(
+                args.workflow[0], args.module_names)
+            scope.update(template_workflow.scope)
+            storage = template_workflow.storage
+            workflow_stages = template_workflow.stages
         else:
+            modules = cls.get_named_modules(args.module_names)
+
             stages = []
             for word in args.workflow:
                 if word in modules:
@@ -218,7 +530,7 @@ class Workflow:
                     continue
 
                 stage_name, stage_args = description[0], description[1:]
-                stage_cls = modules[stage_name].load()
+                stage_cls = _load_entry_point(modules[stage_name])
                 stage = stage_cls.from_command(stage_args)
                 assert stage is not None, 'Stage.from_command returned None'
 
@@ -232,7 +544,16 @@ class Workflow:
 
             scope[name] = val
 
-        return cls(workflow_stages, storage, scope)
+        resources = None
+        if args.max_cores is not None or args.max_memory is not None:
+            resources = ResourceBudget(args.max_cores, args.max_memory)
+
+        profile = 'memory' if args.profile_memory else args.profile
+
+        catalog = args.catalog or os.environ.get('FLOWWS_CATALOG') or None
+
+        return cls(workflow_stages, storage, scope, resources,
+                   args.batch_storage, profile=profile, catalog=catalog)
 
     @classmethod
     def register_module(cls, *args, module_names='flowws_modules', name=None):
@@ -272,13 +593,139 @@ class Workflow:
 
         Returns the scope after running all stages.
         """
-        scope = Scope(self.scope)
-        scope['workflow'] = scope['flowws.workflow'] = self
+        scope = self._make_scope()
+        with self._running(scope):
+            for (i, stage) in enumerate(self.stages):
+                self._prefetch_inputs(self.stages[i:], scope)
+                self._run_stage(stage, scope)
+
+        return scope
+
+    async def run_async(self):
+        """Run each stage inside this workflow from an asyncio event loop.
+
+        Stages whose `run` method is a coroutine function (`async
+        def run(self, scope, storage)`) are awaited directly, so they
+        can overlap many I/O-bound operations (for example, using
+        `Storage.read_bytes_async`). Other stages are run in the
+        default executor of the event loop so that they do not block
+        it, as is waiting for the resources of coroutine stages (see
+        `ResourceBudget`).
+
+        Returns the scope after running all stages.
+        """
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        scope = self._make_scope()
+        with self._running(scope):
+            for (i, stage) in enumerate(self.stages):
+                self._prefetch_inputs(self.stages[i:], scope)
+                if inspect.iscoroutinefunction(stage.run):
+                    with contextlib.ExitStack() as stack:
+                        # only waiting for resources happens in the
+                        # executor; the stage (and profiler) run here
+                        if self.resources is not None:
+                            await loop.run_in_executor(
+                                None, stack.enter_context,
+                                self.resources.acquire(stage.get_resources()))
+                        stage = stack.enter_context(self._stage_context(
+                            stage, scope, acquire_resources=False))
+                        await stage.run(scope, self.storage)
+                else:
+                    await loop.run_in_executor(
+                        None, self._run_stage, stage, scope)
+
+        return scope
+
+    @contextlib.contextmanager
+    def _running(self, scope):
         with contextlib.ExitStack() as stack:
             scope['flowws.exit_stack'] = stack
-            for stage in self.stages:
+            if self.catalog is not None:
+                scope['flowws.run_record'] = stack.enter_context(
+                    self.catalog.record(self))
+
+            yield
+
+            profiler = scope.get('flowws.profiler')
+            if profiler is not None:
+                profiler.write_summary(self.storage)
+
+        # callbacks can no longer be registered once the stack is closed
+        scope['flowws.exit_stack'] = None
+
+    def _make_scope(self):
+        scope_type = PersistentScope if self.persistent_scope else Scope
+        scope = scope_type(
+            (key, value) for (key, value) in self.scope.items()
+            if not isinstance(value, StorageReference))
+        for (key, value) in self.scope.items():
+            if isinstance(value, StorageReference):
+                scope.set_call(key, functools.partial(value.load, self.storage))
+        scope['workflow'] = scope['flowws.workflow'] = self
+        scope['flowws.resources'] = self.resources
+        if self.profile:
+            from .profiling import StageProfiler
+            scope['flowws.profiler'] = StageProfiler(memory=self.profile == 'memory')
+        return scope
+
+    @staticmethod
+    def _prefetch_inputs(stages, scope):
+        keys = set()
+        for stage in stages:
+            keys.update(stage.get_scope_inputs())
+        if keys:
+            scope.prefetch(keys)
+
+    def _run_stage(self, stage, scope, stage_cache=None):
+        with self._stage_context(stage, scope, stage_cache) as stage:
+            if inspect.iscoroutinefunction(stage.run):
+                # asyncio.run is not available before python 3.7
+                import asyncio
+                loop = asyncio.new_event_loop()
+                try:
+                    loop.run_until_complete(stage.run(scope, self.storage))
+                finally:
+                    loop.close()
+            else:
                 stage.run(scope, self.storage)
 
-        return scope
+    @contextlib.contextmanager
+    def _stage_context(self, stage, scope, stage_cache=None, primary=True,
+                       acquire_resources=True):
+        # stages run together in a batch (see Stage.run_batch) enter a
+        # context for each workflow, but only the primary one acquires
+        # resources and is profiled; acquire_resources=False is used
+        # when the caller has already acquired them
+        if stage_cache is None:
+            stage_cache = self.stage_cache
+        if stage_cache is not None:
+            stage = stage_cache.get(stage)
+
+        with contextlib.ExitStack() as stack:
+            needs = stage.get_resources()
+            if self.resources is not None:
+                if primary and acquire_resources:
+                    stack.enter_context(self.resources.acquire(needs))
+                scope['flowws.allocation'] = self.resources.allocation(needs)
+            else:
+                scope['flowws.allocation'] = ResourceBudget().allocation(needs)
+            if self.batch_storage:
+                stack.enter_context(self.storage.batch())
+            profiler = scope.get('flowws.profiler')
+            if profiler is not None and primary:
+                stack.enter_context(profiler.profile(stage, self.storage))
+            record = scope.get('flowws.run_record')
+            if record is not None:
+                stack.enter_context(record.stage(stage, self.storage))
+
+            if not getattr(stage, '_flowws_set_up', False):
+                stage._ensure_set_up()
+                # cached stages are torn down by their cache instead
+                if stage_cache is None and scope.get('flowws.exit_stack') is not None:
+                    scope['flowws.exit_stack'].callback(stage._ensure_torn_down)
+
+            yield stage
 
 register_module = Workflow.register_module
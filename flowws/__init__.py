@@ -1,10 +1,50 @@
+import importlib
+import sys
+import types
+
 from .version import __version__
 
-from .Argument import Argument, Range
-from .Stage import add_stage_arguments, Stage
-from .Workflow import register_module, Workflow
+# map exported name -> module (within this package) defining it;
+# modules are only imported when one of their objects is first used
+_LAZY_EXPORTS = dict(
+    Argument='.Argument',
+    Range='.Argument',
+    ResourceBudget='.ResourceBudget',
+    add_stage_arguments='.Stage',
+    Stage='.Stage',
+    StageCache='.StageCache',
+    register_module='.Workflow',
+    Workflow='.Workflow',
+    SharedArray='.SharedArray',
+    DirectoryStorage='.DirectoryStorage',
+    GetarStorage='.GetarStorage',
+    StorageServer='.StorageServer',
+    StorageReference='.StorageReference',
+    try_to_import='.internal',
+)
+
+__all__ = ['__version__'] + list(_LAZY_EXPORTS)
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, name):
+        try:
+            module_name = _LAZY_EXPORTS[name]
+        except KeyError:
+            raise AttributeError(
+                'module {} has no attribute {}'.format(self.__name__, name))
+
+        result = getattr(importlib.import_module(module_name, self.__name__), name)
+        self.__dict__[name] = result
+        return result
+
+    def __setattr__(self, name, value):
+        # importing a submodule (like flowws.Workflow) binds it to an
+        # attribute of this package; keep the exported object instead
+        if name in _LAZY_EXPORTS and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
 
-from .DirectoryStorage import DirectoryStorage
-from .GetarStorage import GetarStorage
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(_LAZY_EXPORTS))
 
-from .internal import try_to_import
+sys.modules[__name__].__class__ = _LazyModule
@@ -0,0 +1,133 @@
+"""Precompiled workflow bundles
+
+Workflow bundles are created by :py:mod:`flowws.freeze` using the
+`--bundle` option::
+
+    python -m flowws.freeze --bundle workflow.bundle Module1 Module2
+
+Unlike JSON workflow descriptions, bundles store the exact location
+(module and qualified name) of each stage class along with its
+already-validated argument values in pickle form. When a bundle is
+loaded (for example, by `flowws.run workflow.bundle`), stage classes
+are imported directly, without searching installed entry points,
+and arguments are not validated again as long as the arguments
+declared by the stage class still match those it had when the
+bundle was created (as determined by a hash of its `ARGS`). Stages
+whose arguments have changed are constructed and validated
+normally instead.
+
+Bundles are loaded using pickle and should only be loaded from
+trusted sources.
+
+"""
+
+import hashlib
+import os
+import pickle
+
+#: Bytes identifying the beginning of a workflow bundle
+MAGIC = b'FLWSBNDL'
+
+#: Version of the bundle format
+VERSION = 1
+
+def _describe(value):
+    """Return a stable (address-independent) string describing a value."""
+    if isinstance(value, (list, tuple)):
+        contents = ', '.join(_describe(v) for v in value)
+        return '{}[{}]'.format(type(value).__name__, contents)
+    elif isinstance(value, dict):
+        contents = ', '.join(sorted(
+            '{}: {}'.format(_describe(k), _describe(v))
+            for (k, v) in value.items()))
+        return 'dict[{}]'.format(contents)
+    elif hasattr(value, '__qualname__'):
+        return '{}.{}'.format(
+            getattr(value, '__module__', None), value.__qualname__)
+    elif type(value).__repr__ is object.__repr__ and hasattr(value, '__dict__'):
+        return '{}({})'.format(_describe(type(value)), _describe(vars(value)))
+    return repr(value)
+
+def schema_hash(stage_cls):
+    """Return a hash of the location and declared arguments of a stage class.
+
+    :param stage_cls: Stage class to hash
+    """
+    description = [stage_cls.__module__, stage_cls.__qualname__]
+    for arg in stage_cls.ARGS:
+        description.append(_describe([
+            arg.name, arg.type, arg.default, arg.required, arg.valid_values]))
+    return hashlib.sha256('\n'.join(description).encode()).hexdigest()
+
+def is_bundle(filename):
+    """Return True if the given file is a workflow bundle."""
+    if not os.path.isfile(filename):
+        return False
+
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def write_bundle(workflow, filename):
+    """Save a workflow as a bundle.
+
+    :param workflow: Workflow object to save
+    :param filename: Name of the bundle file to write
+    """
+    stages = []
+    for stage in workflow.stages:
+        stage_cls = type(stage)
+        stages.append(dict(
+            module=stage_cls.__module__, qualname=stage_cls.__qualname__,
+            schema_hash=schema_hash(stage_cls),
+            arguments=dict(stage.arguments)))
+
+    description = workflow.to_JSON()
+    contents = dict(
+        version=VERSION, storage=description['storage'],
+        scope=description['scope'], stages=stages)
+
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        pickle.dump(contents, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_bundle(filename, module_names='flowws_modules'):
+    """Load a workflow from a bundle.
+
+    :param filename: Name of the bundle file to read
+    :param module_names: setuptools entry_point to search for stage classes that can no longer be imported from their recorded location
+    """
+    import datetime
+    from .Workflow import Workflow, storage_from_JSON
+
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a flowws workflow bundle'.format(filename))
+        contents = pickle.load(f)
+
+    if contents['version'] != VERSION:
+        raise ValueError('Unsupported workflow bundle version {}'.format(
+            contents['version']))
+
+    stages = []
+    for description in contents['stages']:
+        stage_cls = Workflow.find_stage_class(
+            description['qualname'], description['module'], module_names)
+        if schema_hash(stage_cls) == description['schema_hash']:
+            stage = stage_cls._from_validated(description['arguments'])
+        else:
+            stage = stage_cls.from_JSON(dict(arguments=description['arguments']))
+        stages.append(stage)
+
+    storage = storage_from_JSON(contents['storage'])
+
+    scope = dict(contents['scope'])
+    metadata = dict(scope.get('metadata', {}))
+    metadata['invocation'] = dict(
+        name='load_bundle', filename=filename,
+        module_names=module_names,
+        time=datetime.datetime.now().isoformat(),
+        time_utc=datetime.datetime.utcnow().isoformat(),
+    )
+    scope['metadata'] = metadata
+
+    return Workflow(stages, storage, scope)
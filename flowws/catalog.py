@@ -0,0 +1,310 @@
+"""Index and search workflow runs in a SQLite catalog
+
+When a catalog is given to a workflow (using the `--catalog` argument
+of `flowws.run` or the `FLOWWS_CATALOG` environment variable), each
+run of the workflow is recorded in a local SQLite database: its
+invocation metadata, the JSON description of its stages, its storage
+location, the duration of each stage, and the names of all files
+written to the storage::
+
+    python -m flowws.run --catalog ~/runs.sqlite Module1 --param-1 2.5 Module2
+
+The `flowws.catalog` utility queries the catalog. Scalar stage
+arguments (as well as scalar elements of lists and dictionaries,
+named like `param.0` or `param.key`) and scalar scope values (such as
+those given using `flowws.run -d`) are indexed and can be compared
+using `--where`. Arguments can be named either directly or prefixed
+by the stage type, as in `Module1.param_1`::
+
+    python -m flowws.catalog ~/runs.sqlite --where param_1 '>' 1.5 --where Module2.mode = fast
+
+A `flowws_catalog` script is also installed for this command for
+convenience.
+
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started TEXT,
+    finished TEXT,
+    duration REAL,
+    status TEXT,
+    cwd TEXT,
+    storage TEXT,
+    invocation TEXT,
+    stages TEXT
+);
+CREATE TABLE IF NOT EXISTS stages (
+    run_id INTEGER REFERENCES runs(id),
+    position INTEGER,
+    type TEXT,
+    description TEXT,
+    duration REAL
+);
+CREATE TABLE IF NOT EXISTS arguments (
+    run_id INTEGER REFERENCES runs(id),
+    position INTEGER,
+    stage_type TEXT,
+    name TEXT,
+    value
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    run_id INTEGER REFERENCES runs(id),
+    name TEXT
+);
+CREATE INDEX IF NOT EXISTS arguments_name_value ON arguments (name, value);
+CREATE INDEX IF NOT EXISTS stages_run ON stages (run_id);
+CREATE INDEX IF NOT EXISTS outputs_run ON outputs (run_id);
+"""
+
+#: Comparison operators usable in `Catalog.query` conditions
+OPERATORS = ('=', '==', '!=', '<', '<=', '>', '>=', 'like')
+
+def _to_JSON(value):
+    return json.dumps(value, sort_keys=True, default=repr)
+
+def _flatten(name, value):
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        yield (name, value)
+    elif isinstance(value, dict):
+        for (key, val) in value.items():
+            yield from _flatten('{}.{}'.format(name, key), val)
+    elif isinstance(value, (list, tuple)):
+        for (i, val) in enumerate(value):
+            yield from _flatten('{}.{}'.format(name, i), val)
+
+class RunRecord:
+    """Information about a single workflow run, collected while it is running.
+
+    RunRecord objects are created by `Catalog.record`.
+    """
+    def __init__(self, workflow):
+        self.workflow = workflow
+        self.started = datetime.datetime.now()
+        self.stage_durations = []
+        self.outputs = []
+        self._output_set = set()
+
+    def add_output(self, full_name):
+        if full_name not in self._output_set:
+            self._output_set.add(full_name)
+            self.outputs.append(full_name)
+
+    def copy(self, workflow=None):
+        """Return an independent copy of this record.
+
+        :param workflow: Workflow the copy describes (default: the workflow of this record)
+        """
+        result = type(self)(self.workflow if workflow is None else workflow)
+        result.started = self.started
+        result.stage_durations = list(self.stage_durations)
+        for name in self.outputs:
+            result.add_output(name)
+        return result
+
+    @contextlib.contextmanager
+    def stage(self, stage, storage=None):
+        """Context manager to time the execution of a single stage.
+
+        :param stage: Stage being run
+        :param storage: If given, also record files written to this storage while the stage runs
+        """
+        if storage is not None:
+            storage.add_write_callback(self.add_output)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_durations.append(time.perf_counter() - start)
+            if storage is not None:
+                storage.remove_write_callback(self.add_output)
+
+class Catalog:
+    """SQLite database recording runs of workflows.
+
+    Each process opens its own short-lived connection for every
+    recorded run, so many workflows (for example, running in a
+    `flowws_queue` or `flowws_sweep`) can share the same catalog.
+
+    :param filename: Location of the SQLite database (it is created if it does not exist)
+    :param timeout: Time (in seconds) to wait for other processes writing to the catalog
+    """
+    def __init__(self, filename, timeout=60):
+        self.filename = filename
+        self.timeout = timeout
+
+        with self._connect():
+            pass
+
+    def _connect(self):
+        connection = sqlite3.connect(self.filename, timeout=self.timeout)
+        connection.row_factory = sqlite3.Row
+        connection.executescript(_SCHEMA)
+        return contextlib.closing(connection)
+
+    @contextlib.contextmanager
+    def record(self, workflow):
+        """Context manager to record a run of a workflow in the catalog.
+
+        Files written to the workflow's storage while the context is
+        active are recorded as outputs of the run. The run is added
+        to the catalog when the context exits, with a status of
+        'failed' if an exception was raised.
+
+        :param workflow: `Workflow` object being run
+        """
+        record = RunRecord(workflow)
+        workflow.storage.add_write_callback(record.add_output)
+        status = 'failed'
+        try:
+            yield record
+            status = 'ok'
+        finally:
+            workflow.storage.remove_write_callback(record.add_output)
+            self.add_run(record, status)
+
+    def add_run(self, record, status='ok'):
+        """Add a completed run to the catalog.
+
+        :param record: `RunRecord` describing the run
+        :param status: Final status of the run
+        :returns: The integer ID of the new run
+        """
+        workflow = record.workflow
+        finished = datetime.datetime.now()
+        stages = [stage.to_JSON() for stage in workflow.stages]
+        invocation = workflow.scope.get('metadata', {}).get('invocation', {})
+
+        with self._connect() as connection, connection:
+            cursor = connection.execute(
+                'INSERT INTO runs (started, finished, duration, status, cwd, '
+                'storage, invocation, stages) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (record.started.isoformat(), finished.isoformat(),
+                 (finished - record.started).total_seconds(), status,
+                 os.getcwd(), _to_JSON(workflow.storage.to_JSON()),
+                 _to_JSON(invocation), _to_JSON(stages)))
+            run_id = cursor.lastrowid
+
+            for (position, description) in enumerate(stages):
+                duration = (record.stage_durations[position]
+                            if position < len(record.stage_durations) else None)
+                connection.execute(
+                    'INSERT INTO stages VALUES (?, ?, ?, ?, ?)',
+                    (run_id, position, description.get('type'),
+                     _to_JSON(description), duration))
+
+            argument_rows = []
+            for (position, description) in enumerate(stages):
+                for (name, value) in description.get('arguments', {}).items():
+                    for (flat_name, flat_value) in _flatten(name, value):
+                        argument_rows.append(
+                            (run_id, position, description.get('type'),
+                             flat_name, flat_value))
+            for (name, value) in workflow.scope.items():
+                if name == 'metadata':
+                    continue
+                for (flat_name, flat_value) in _flatten(name, value):
+                    argument_rows.append(
+                        (run_id, None, 'scope', flat_name, flat_value))
+            connection.executemany(
+                'INSERT INTO arguments VALUES (?, ?, ?, ?, ?)', argument_rows)
+
+            connection.executemany(
+                'INSERT INTO outputs VALUES (?, ?)',
+                [(run_id, name) for name in record.outputs])
+
+        return run_id
+
+    def query(self, conditions=[]):
+        """Find runs matching all of a set of argument conditions.
+
+        Each condition is a tuple `(name, operator, value)`, where
+        `name` is either a bare argument name or one prefixed by the
+        stage type (`Type.name`) and `operator` is one of `OPERATORS`.
+
+        :param conditions: List of conditions that must all be satisfied
+        :returns: List of dictionaries describing each matching run
+        """
+        clauses = []
+        parameters = []
+        for (name, operator, value) in conditions:
+            operator = operator.lower()
+            if operator not in OPERATORS:
+                raise ValueError('Unknown operator {}; use one of {}'.format(
+                    operator, OPERATORS))
+
+            clauses.append(
+                'id IN (SELECT run_id FROM arguments WHERE '
+                "(name = ? OR stage_type || '.' || name = ?) AND value {} ?)".format(
+                    operator))
+            parameters.extend([name, name, value])
+
+        sql = 'SELECT * FROM runs'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY id'
+
+        result = []
+        with self._connect() as connection:
+            for row in connection.execute(sql, parameters):
+                run = dict(row)
+                for key in ('storage', 'invocation', 'stages'):
+                    run[key] = json.loads(run[key])
+                run['stage_durations'] = [
+                    r[0] for r in connection.execute(
+                        'SELECT duration FROM stages WHERE run_id = ? '
+                        'ORDER BY position', (run['id'],))]
+                run['outputs'] = [
+                    r[0] for r in connection.execute(
+                        'SELECT name FROM outputs WHERE run_id = ?', (run['id'],))]
+                result.append(run)
+
+        return result
+
+def _parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Search workflow runs recorded in a catalog')
+    parser.add_argument('catalog',
+        help='Catalog database location')
+    parser.add_argument('-w', '--where', nargs=3, action='append', default=[],
+        metavar=('NAME', 'OPERATOR', 'VALUE'),
+        help='Only show runs with an argument satisfying a condition')
+    parser.add_argument('--json', action='store_true',
+        help='Print complete run descriptions as JSON')
+
+    args = parser.parse_args()
+
+    catalog = Catalog(args.catalog)
+    conditions = [(name, operator, _parse_value(value))
+                  for (name, operator, value) in args.where]
+    runs = catalog.query(conditions)
+
+    if args.json:
+        json.dump(runs, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+
+    for run in runs:
+        stage_types = [stage.get('type') for stage in run['stages']]
+        print('{}\t{}\t{}\t{}\t{}'.format(
+            run['id'], run['started'], run['status'],
+            _to_JSON(run['storage']), ' '.join(stage_types)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import bz2
+import collections
+import gzip
+import io
+import lzma
+import os
+
+from .internal import LazyExecutor
+
+#: Size (in bytes) of uncompressed blocks that are compressed in parallel
+BLOCK_SIZE = 4*1024*1024
+
+_COMPRESSORS = dict(
+    gzip=lambda data: gzip.compress(data, compresslevel=6),
+    bz2=bz2.compress,
+    lzma=lzma.compress,
+)
+
+_DECOMPRESSORS = dict(
+    gzip=lambda stream: gzip.GzipFile(fileobj=stream, mode='rb'),
+    bz2=lambda stream: bz2.BZ2File(stream, 'rb'),
+    lzma=lambda stream: lzma.LZMAFile(stream, 'rb'),
+)
+
+_MAGIC_BYTES = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'lzma'),
+]
+
+_executor = LazyExecutor(os.cpu_count() or 1, 'flowws-compress')
+
+def get_method(compress):
+    """Return the name of the compression method to use for writing.
+
+    :param compress: Compression method name ('gzip', 'bz2', or 'lzma'), or True to use gzip
+    """
+    if compress is True:
+        return 'gzip'
+    if compress not in _COMPRESSORS:
+        raise ValueError('Unknown compression method {}; use one of {}'.format(
+            compress, sorted(_COMPRESSORS)))
+    return compress
+
+def detect_method(stream):
+    """Detect the compression method of a binary stream from its first bytes.
+
+    :param stream: Binary stream object supporting `peek`
+    :returns: Name of the compression method, or None if the stream does not appear to be compressed
+    """
+    header = stream.peek(8)
+    for (magic, method) in _MAGIC_BYTES:
+        if header.startswith(magic):
+            return method
+    return None
+
+class CompressedWriter(io.BufferedIOBase):
+    """Binary stream that compresses blocks of data in parallel.
+
+    Written data are split into blocks of `BLOCK_SIZE` bytes, which
+    are compressed independently in a thread pool and written (in
+    order) to the target stream as a series of concatenated
+    compressed streams. gzip, bz2, and lzma all transparently
+    decompress concatenated streams, so the result can be read with
+    the standard library modules (or `open_decompressed`).
+
+    :param stream: Binary stream to write compressed data to; it is closed when this object is closed
+    :param method: Compression method name ('gzip', 'bz2', or 'lzma')
+    :param block_size: Size (in bytes) of blocks to compress independently
+    """
+    def __init__(self, stream, method, block_size=None):
+        super().__init__()
+        self.stream = stream
+        self.method = method
+        self.block_size = block_size or BLOCK_SIZE
+        self.name = getattr(stream, 'name', None)
+
+        self._compress = _COMPRESSORS[method]
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._max_pending = 2*(os.cpu_count() or 1)
+        self._wrote_block = False
+
+    def writable(self):
+        return True
+
+    def write(self, contents):
+        if self.closed:
+            raise ValueError('write to closed file')
+
+        self._buffer.extend(contents)
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block)
+
+        return len(contents)
+
+    def _submit(self, block):
+        self._pending.append(_executor.submit(self._compress, block))
+        self._wrote_block = True
+
+        # bound the memory used by blocks waiting to be written
+        while len(self._pending) > self._max_pending:
+            self.stream.write(self._pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            if self._buffer or not self._wrote_block:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+
+            while self._pending:
+                self.stream.write(self._pending.popleft().result())
+        finally:
+            super().close()
+            self.stream.close()
+
+class _DecompressedReader(io.BufferedReader):
+    # close the compressed source stream along with the decompressor
+    def __init__(self, decompressor, source):
+        super().__init__(decompressor)
+        self.source = source
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.source.close()
+
+def open_decompressed(stream, method=None):
+    """Wrap a binary stream to transparently decompress its contents.
+
+    :param stream: Binary stream to read from
+    :param method: Compression method; if None, detect it from the stream contents
+    :returns: A binary stream of decompressed contents (or the original stream if it does not appear to be compressed and no method was given)
+    """
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream)
+
+    if method is None:
+        method = detect_method(stream)
+        if method is None:
+            return stream
+
+    decompressor = _DECOMPRESSORS[get_method(method)](stream)
+    return _DecompressedReader(decompressor, stream)
@@ -0,0 +1,224 @@
+"""Keep flowws and plugin modules loaded to quickly run many workflows
+
+The `flowws.daemon` utility starts a long-running server process that
+accepts workflow submissions over a local Unix socket. Modules (such
+as plugins with expensive imports) are imported once by the daemon,
+and each submitted workflow is run in a forked child process, so
+workflows are isolated from each other but do not pay the cost of
+interpreter startup and module imports::
+
+    python -m flowws.daemon /tmp/flowws.sock --preload hoomd freud
+
+Workflows can then be submitted using `flowws.run` with the
+`--daemon` argument (or by setting the `FLOWWS_DAEMON` environment
+variable to the socket location). The output of the workflow is
+streamed back to the client, and the client exits with the status
+of the workflow::
+
+    python -m flowws.run --daemon /tmp/flowws.sock Module1 --param-1 x Module2
+
+Workflows are run with the working directory and environment
+variables of the submitting client. A `flowws_daemon` script is also
+installed for this command for convenience.
+
+"""
+
+import argparse
+import base64
+import importlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import traceback
+
+from .Workflow import Workflow
+
+logger = logging.getLogger(__name__)
+
+def _send_message(stream, **kwargs):
+    stream.write(json.dumps(kwargs).encode() + b'\n')
+    stream.flush()
+
+def _run_child(request, output_fd):
+    # runs inside the forked child process; never returns
+    status = 1
+    workflow = None
+    try:
+        # existing stdout/stderr objects (and logging handlers using
+        # them) now write to the client
+        os.dup2(output_fd, 1)
+        os.dup2(output_fd, 2)
+        os.close(output_fd)
+        # sys.stdout and sys.stderr may not have been using these
+        # descriptors (for example, if output was being captured)
+        sys.stdout = open(1, 'w', buffering=1, closefd=False)
+        sys.stderr = open(2, 'w', buffering=1, closefd=False)
+
+        os.chdir(request.get('cwd', os.curdir))
+        if 'environment' in request:
+            os.environ.clear()
+            os.environ.update(request['environment'])
+
+        module_names = request.get('module_names', 'flowws_modules')
+        if 'workflow' in request:
+            workflow = Workflow.from_JSON(request['workflow'], module_names)
+        else:
+            workflow = Workflow.from_command(
+                request.get('arguments', []), module_names)
+        workflow.run()
+        status = 0
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            # os._exit skips cleanup, so archives must be finished here
+            if workflow is not None:
+                workflow.storage.close()
+        except BaseException:
+            traceback.print_exc()
+            status = status or 1
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(status)
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode())
+
+        (read_fd, write_fd) = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            _run_child(request, write_fd)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as output:
+            while True:
+                chunk = output.read1(65536)
+                if not chunk:
+                    break
+                try:
+                    _send_message(
+                        self.wfile, output=base64.b64encode(chunk).decode())
+                except OSError:
+                    # client went away; let the workflow keep running
+                    pass
+
+        (_, wait_status) = os.waitpid(pid, 0)
+        if os.WIFEXITED(wait_status):
+            status = os.WEXITSTATUS(wait_status)
+        else:
+            status = 128 + os.WTERMSIG(wait_status)
+
+        try:
+            _send_message(self.wfile, status=status)
+        except OSError:
+            pass
+
+class DaemonServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server that runs submitted workflows in forked processes.
+
+    :param address: Filename of the Unix socket to listen on
+    """
+    def __init__(self, address):
+        super().__init__(address, _RequestHandler)
+
+def preload(module_names='flowws_modules', modules=[]):
+    """Import modules once so that they are available to all workflows.
+
+    :param module_names: setuptools entry_point whose registered stages should all be loaded
+    :param modules: Additional module names to import
+    """
+    for name in modules:
+        importlib.import_module(name)
+
+    for (name, entry_point) in Workflow.get_named_modules(module_names).items():
+        try:
+            entry_point.load()
+        except Exception as e:
+            logger.warning('Failed to preload module {}: {}'.format(name, e))
+
+def submit(address, arguments=None, workflow=None, module_names='flowws_modules',
+           output=None):
+    """Submit a workflow to a running daemon and wait for it to finish.
+
+    Exactly one of `arguments` (a command-line workflow description,
+    as for `flowws.run`) or `workflow` (a JSON-like workflow
+    description) should be given.
+
+    :param address: Filename of the Unix socket the daemon is listening on
+    :param arguments: List of command-line arguments describing the workflow
+    :param workflow: JSON-like workflow description, as produced by `Workflow.to_JSON`
+    :param module_names: setuptools entry_point to use for module searches
+    :param output: Binary stream to write the output of the workflow to (default: standard output)
+    :returns: The exit status of the workflow
+    """
+    if output is None:
+        output = sys.stdout.buffer
+
+    request = dict(cwd=os.getcwd(), environment=dict(os.environ),
+                   module_names=module_names)
+    if workflow is not None:
+        request['workflow'] = workflow
+    else:
+        request['arguments'] = list(arguments or [])
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(address)
+        stream = connection.makefile('rwb')
+        _send_message(stream, **request)
+
+        for line in stream:
+            message = json.loads(line.decode())
+            if 'output' in message:
+                output.write(base64.b64decode(message['output']))
+                output.flush()
+            elif 'status' in message:
+                return message['status']
+
+    raise ConnectionError('flowws daemon closed the connection unexpectedly')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run a server to quickly execute workflows')
+    parser.add_argument('socket',
+        help='Filename of the Unix socket to listen on')
+    parser.add_argument('-m', '--module-names', default='flowws_modules',
+        help='Registered module entry_point to preload')
+    parser.add_argument('-p', '--preload', nargs='*', default=[],
+        help='Additional modules to import before accepting workflows')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    preload(args.module_names, args.preload)
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+
+    with DaemonServer(args.socket) as server:
+        logger.info('Listening on {}'.format(args.socket))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(args.socket)
+
+if __name__ == '__main__':
+    main()
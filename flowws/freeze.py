@@ -9,6 +9,13 @@ store the resulting JSON file::
 
     python -m flowws.freeze workflow.json Module1 Module2
 
+With the `--bundle` option, the workflow is instead saved as a
+precompiled bundle (see :py:mod:`flowws.bundle`), which can be loaded
+more quickly by `flowws.run` because stage classes are imported
+directly and their arguments are not validated again::
+
+    python -m flowws.freeze --bundle workflow.bundle Module1 Module2
+
 A `flowws_freeze` script is also installed for this command for
 convenience.
 
@@ -18,18 +25,26 @@ import argparse
 import json
 
 from . import Workflow
+from .bundle import write_bundle
 
 def main():
     parser = argparse.ArgumentParser(
         description='Save a workflow in JSON form')
+    parser.add_argument('--bundle', action='store_true',
+        help='Save a precompiled workflow bundle instead of JSON')
     parser.add_argument('location',
-        help='JSON filename to save')
+        help='JSON (or bundle) filename to save')
     parser.add_argument('workflow', nargs=argparse.REMAINDER,
         help='Remainder of workflow description (arguments identical to flowws.run)')
 
     args = parser.parse_args()
 
     workflow = Workflow.from_command(args=args.workflow)
+
+    if args.bundle:
+        write_bundle(workflow, args.location)
+        return
+
     json_description = workflow.to_JSON()
 
     with open(args.location, 'w') as f:
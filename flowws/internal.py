@@ -1,6 +1,9 @@
 
 import importlib
+import importlib.util
 import logging
+import os
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +18,83 @@ class FailedImport:
     def __call__(self, *args, **kwargs):
         raise self.exception
 
-def try_to_import(pkg, name, current_pkg=None):
+class LazyImport:
+    """Proxy for an attribute of a module that is imported when first used.
+
+    The module is imported the first time the proxy is called or one
+    of its attributes is accessed (or when it is used in `isinstance`
+    or `issubclass` checks); afterward, the proxy forwards everything
+    to the imported object. If the import fails, the proxy behaves
+    like a `FailedImport` object instead.
+
+    LazyImport objects are created by `try_to_import(..., lazy=True)`.
+    """
+    def __init__(self, pkg, name, current_pkg=None):
+        self._lazy_args = (pkg, name, current_pkg)
+        self._lazy_target = None
+        self._lazy_lock = threading.Lock()
+
+    def _resolve(self):
+        with self._lazy_lock:
+            if self._lazy_target is None:
+                self._lazy_target = try_to_import(*self._lazy_args)
+        return self._lazy_target
+
+    def __getattr__(self, name):
+        if name.startswith('_lazy_'):
+            raise AttributeError(name)
+        return getattr(self._resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __instancecheck__(self, instance):
+        return isinstance(instance, self._resolve())
+
+    def __subclasscheck__(self, subclass):
+        return issubclass(subclass, self._resolve())
+
+    def __repr__(self):
+        if self._lazy_target is None:
+            (pkg, name, current_pkg) = self._lazy_args
+            return '<LazyImport of {} from {}>'.format(
+                name, importlib.util.resolve_name(pkg, current_pkg)
+                if pkg.startswith('.') else pkg)
+        return repr(self._lazy_target)
+
+class LazyExecutor:
+    """Thread pool shared within a process, created when it is first used.
+
+    Forked child processes do not inherit the running threads of the
+    pool, so the pool is forgotten in the child after a fork and a
+    new one is created there when it is needed.
+
+    :param max_workers: Maximum number of threads in the pool
+    :param thread_name_prefix: Prefix of the names of the pool's threads
+    """
+    def __init__(self, max_workers, thread_name_prefix=''):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # the lock may have been held by another thread during a fork
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, **kwargs):
+        """Run a function in the pool, returning a `concurrent.futures.Future`."""
+        with self._lock:
+            if self._executor is None:
+                import concurrent.futures
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=self.thread_name_prefix)
+        return self._executor.submit(function, *args, **kwargs)
+
+def try_to_import(pkg, name, current_pkg=None, lazy=False):
     """Import an attribute from a module, or return an error-producing fake.
 
     This method is provided as a convenience for libraries that want
@@ -24,12 +103,23 @@ def try_to_import(pkg, name, current_pkg=None):
     they do not use. The fake is produced if an import fails while
     importing the given package.
 
+    With `lazy=True`, the module is not imported immediately; instead,
+    a `LazyImport` proxy is returned which imports the module when it
+    is first used. This allows packages to expose many modules with
+    expensive imports while only paying for the ones that are used::
+
+        Simulate = flowws.try_to_import('.Simulate', 'Simulate', __name__, lazy=True)
+
     :param name: Name of the attribute to return from the module
     :param pkg: Package name (can be relative)
     :param current_pkg: Name of the current package to use (i.e. if `pkg` is relative)
+    :param lazy: If True, defer importing the module until the result is first used
     :returns: Either the attribute from the successfully-imported module, or a fake module object that will produce an error if evaluated
 
     """
+    if lazy:
+        return LazyImport(pkg, name, current_pkg)
+
     try:
         mod = importlib.import_module(pkg, current_pkg)
         result = getattr(mod, name)
@@ -0,0 +1,446 @@
+"""Run frozen workflows from a queue shared between many workers
+
+The `flowws.job_queue` utility manages a directory-based queue of
+workflow descriptions created by :py:mod:`flowws.freeze`. The queue
+directory can live on a filesystem shared among many hosts; jobs are
+claimed by atomically renaming files between subdirectories, so no
+additional locking service is required. Workflows are added to the
+queue using the `enqueue` command::
+
+    python -m flowws.job_queue enqueue queue_dir workflow_1.json workflow_2.json
+
+Any number of workers (on any host that can see the queue directory)
+can then claim, run, and mark jobs as finished::
+
+    python -m flowws.job_queue worker queue_dir
+
+Several jobs can be run concurrently by a single worker using the
+`--jobs` argument; the total resources used by stages of these jobs
+(see :py:class:`flowws.ResourceBudget`) can be limited using the
+`--max-cores` and `--max-memory` arguments.
+
+Workers periodically update the modification time of the jobs they
+are running. Jobs whose heartbeat is older than the given timeout
+(for example, because the host running them crashed) are put back
+into the pending state by other workers. Modules imported by one job
+remain imported for subsequent jobs run by the same worker.
+
+The state of a queue can be checked with the `status` command, and
+stale or failed jobs can be explicitly requeued with the `requeue`
+command. A `flowws_queue` script is also installed for this command
+for convenience.
+
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from .ResourceBudget import ResourceBudget
+from .StageCache import StageCache
+from .Workflow import Workflow
+
+logger = logging.getLogger(__name__)
+
+class Job:
+    """Reference to a single workflow description within a `JobQueue`.
+
+    :param queue: `JobQueue` object this job belongs to
+    :param name: Filename of the job within the queue
+    :param owner: Contents of the worker marker file written when this job was claimed
+    """
+    def __init__(self, queue, name, owner=None):
+        self.queue = queue
+        self.name = name
+        self.owner = owner
+
+    @property
+    def path(self):
+        return os.path.join(self.queue.running_dir, self.name)
+
+    @property
+    def marker_path(self):
+        return self.path + '.worker'
+
+    def read_owner(self):
+        """Return the contents of the current worker marker file of this job, if any."""
+        try:
+            with open(self.marker_path, 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def heartbeat(self):
+        """Mark this job as still being worked on.
+
+        Returns False if the job has been taken away from this worker
+        (for example, because it was requeued as stale).
+        """
+        if self.owner is not None and self.read_owner() != self.owner:
+            return False
+
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def load(self):
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+class JobQueue:
+    """Queue of workflow descriptions stored in a (shared) directory.
+
+    Jobs move between the `pending`, `running`, `done`, and `failed`
+    subdirectories of the queue. Each transition is a single
+    `os.rename` call, which is atomic on POSIX filesystems, so only
+    one worker can successfully claim any given job.
+
+    :param path: Directory to store the queue in
+    """
+    STATES = ('pending', 'running', 'done', 'failed')
+
+    def __init__(self, path):
+        self.path = path
+
+        for state in self.STATES:
+            os.makedirs(self._state_dir(state), exist_ok=True)
+
+    def _state_dir(self, state):
+        return os.path.join(self.path, state)
+
+    @property
+    def pending_dir(self):
+        return self._state_dir('pending')
+
+    @property
+    def running_dir(self):
+        return self._state_dir('running')
+
+    @property
+    def done_dir(self):
+        return self._state_dir('done')
+
+    @property
+    def failed_dir(self):
+        return self._state_dir('failed')
+
+    def _jobs_in(self, state):
+        return sorted(name for name in os.listdir(self._state_dir(state))
+                      if name.endswith('.json'))
+
+    def _filesystem_time(self):
+        # compare heartbeats against the clock of the filesystem
+        # rather than the clock of this host, which may be skewed
+        clock_name = os.path.join(self.path, '.clock')
+        with open(clock_name, 'a'):
+            pass
+        os.utime(clock_name)
+        return os.stat(clock_name).st_mtime
+
+    def enqueue(self, json_object, name=None):
+        """Add a workflow description to the queue.
+
+        :param json_object: JSON-like workflow description, as produced by `Workflow.to_JSON`
+        :param name: Optional human-readable name to include in the job filename
+        :returns: The filename of the new job
+        """
+        stamp = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+        parts = [stamp, uuid.uuid4().hex[:8]]
+        if name:
+            parts.append(os.path.splitext(os.path.basename(name))[0])
+        job_name = '-'.join(parts) + '.json'
+
+        # write to a hidden temporary file first so that workers never
+        # see a partially-written job
+        temp_name = os.path.join(self.pending_dir, '.' + job_name)
+        with open(temp_name, 'w') as f:
+            json.dump(json_object, f)
+        os.rename(temp_name, os.path.join(self.pending_dir, job_name))
+
+        return job_name
+
+    def claim(self):
+        """Claim the next pending job.
+
+        :returns: A `Job` object, or None if no jobs are pending
+        """
+        for name in self._jobs_in('pending'):
+            pending_path = os.path.join(self.pending_dir, name)
+            try:
+                # renaming keeps the modification time, so update it
+                # first to keep the job from immediately looking stale
+                os.utime(pending_path)
+                os.rename(pending_path, os.path.join(self.running_dir, name))
+            except FileNotFoundError:
+                # another worker claimed this job first
+                continue
+
+            owner = '{} {} {}\n'.format(
+                socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+            job = Job(self, name, owner)
+            with open(job.marker_path, 'w') as f:
+                f.write(owner)
+            return job
+
+        return None
+
+    def _finish(self, job, state, log=None):
+        target = os.path.join(self._state_dir(state), job.name)
+        owner = job.owner if job.owner is not None else job.read_owner()
+        try:
+            if job.owner is not None and job.read_owner() != job.owner:
+                # requeued and claimed by another worker since
+                raise FileNotFoundError(job.path)
+            os.rename(job.path, target)
+        except FileNotFoundError:
+            logger.warning(
+                'Job {} was requeued while running; not marking it as {}'.format(
+                    job.name, state))
+            return False
+
+        # the job may have been claimed again already; only remove
+        # the marker written by the previous owner
+        if owner is not None and job.read_owner() == owner:
+            try:
+                os.remove(job.marker_path)
+            except FileNotFoundError:
+                pass
+
+        if log is not None:
+            with open(target + '.log', 'w') as f:
+                f.write(log)
+
+        return True
+
+    def complete(self, job):
+        """Mark a running job as successfully finished."""
+        return self._finish(job, 'done')
+
+    def fail(self, job, log=None):
+        """Mark a running job as failed, optionally saving a log message."""
+        return self._finish(job, 'failed', log)
+
+    def release(self, job):
+        """Return a running job to the pending state."""
+        return self._finish(job, 'pending')
+
+    def requeue_stale(self, timeout):
+        """Return running jobs without a recent heartbeat to the pending state.
+
+        :param timeout: Time (in seconds) since the last heartbeat after which a job is considered stale
+        :returns: List of requeued job names
+        """
+        now = self._filesystem_time()
+        result = []
+        for name in self._jobs_in('running'):
+            path = os.path.join(self.running_dir, name)
+            try:
+                age = now - os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+
+            if age > timeout and self.release(Job(self, name)):
+                logger.warning('Requeued stale job {}'.format(name))
+                result.append(name)
+
+        return result
+
+    def requeue_failed(self):
+        """Return all failed jobs to the pending state.
+
+        :returns: List of requeued job names
+        """
+        result = []
+        for name in self._jobs_in('failed'):
+            try:
+                os.rename(os.path.join(self.failed_dir, name),
+                          os.path.join(self.pending_dir, name))
+            except FileNotFoundError:
+                continue
+            result.append(name)
+        return result
+
+    def counts(self):
+        """Return a dictionary of the number of jobs in each state."""
+        return {state: len(self._jobs_in(state)) for state in self.STATES}
+
+class _Heartbeat:
+    def __init__(self, job, interval):
+        self.job = job
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            if not self.job.heartbeat():
+                logger.warning('Lost job {} while running'.format(self.job.name))
+                break
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.stop_event.set()
+        self.thread.join()
+
+def run_worker(queue, module_names='flowws_modules', timeout=300,
+               heartbeat=30, poll_interval=0, max_jobs=None, jobs=1,
+               resources=None):
+    """Claim and run jobs from a queue until no more work is available.
+
+    Stages that were set up (see `Stage.setup`) for earlier jobs are
+    reused by later jobs with identical stages, using a `StageCache`
+    for each thread running jobs.
+
+    :param queue: `JobQueue` object (or directory name) to take jobs from
+    :param module_names: setuptools entry_point to use for module searches
+    :param timeout: Time (in seconds) after which running jobs without a heartbeat are requeued
+    :param heartbeat: Interval (in seconds) between heartbeats for running jobs
+    :param poll_interval: If nonzero, wait this long (in seconds) for new jobs instead of exiting when the queue is empty
+    :param max_jobs: Maximum number of jobs to run before exiting
+    :param jobs: Number of jobs to run concurrently (in separate threads)
+    :param resources: Optional `ResourceBudget` shared by all concurrently-running jobs
+    :returns: Dictionary with the number of jobs that succeeded and failed
+    """
+    if not isinstance(queue, JobQueue):
+        queue = JobQueue(queue)
+
+    result = dict(done=0, failed=0)
+    lock = threading.Lock()
+    # number of jobs claimed by any thread, including running jobs
+    claimed = [0]
+
+    def claim():
+        with lock:
+            if max_jobs is not None and claimed[0] >= max_jobs:
+                return None
+            queue.requeue_stale(timeout)
+            job = queue.claim()
+            if job is not None:
+                claimed[0] += 1
+            return job
+
+    def work():
+        # stages are reused between jobs run by the same thread
+        with StageCache() as stage_cache:
+            work_with_cache(stage_cache)
+
+    def work_with_cache(stage_cache):
+        while True:
+            job = claim()
+
+            if job is None:
+                if poll_interval and (max_jobs is None or claimed[0] < max_jobs):
+                    time.sleep(poll_interval)
+                    continue
+                break
+
+            logger.info('Running job {}'.format(job.name))
+            with _Heartbeat(job, heartbeat):
+                try:
+                    workflow = Workflow.from_JSON(job.load(), module_names)
+                    workflow.resources = resources
+                    workflow.stage_cache = stage_cache
+                    workflow.run()
+                except Exception:
+                    logger.exception('Job {} failed'.format(job.name))
+                    queue.fail(job, traceback.format_exc())
+                    state = 'failed'
+                except BaseException:
+                    queue.release(job)
+                    raise
+                else:
+                    queue.complete(job)
+                    state = 'done'
+
+            with lock:
+                result[state] += 1
+
+    threads = [threading.Thread(target=work) for _ in range(1, jobs)]
+    for thread in threads:
+        thread.start()
+    work()
+    for thread in threads:
+        thread.join()
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run frozen workflows from a shared job queue')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    enqueue = subparsers.add_parser('enqueue', help='Add workflow JSON files to a queue')
+    enqueue.add_argument('queue', help='Queue directory')
+    enqueue.add_argument('workflows', nargs='+', help='Workflow JSON files to add')
+
+    worker = subparsers.add_parser('worker', help='Run jobs from a queue')
+    worker.add_argument('queue', help='Queue directory')
+    worker.add_argument('-m', '--module-names', default='flowws_modules',
+        help='Registered module entry_point to search')
+    worker.add_argument('--timeout', type=float, default=300,
+        help='Time (in seconds) after which running jobs without a heartbeat are requeued')
+    worker.add_argument('--heartbeat', type=float, default=30,
+        help='Interval (in seconds) between heartbeats for running jobs')
+    worker.add_argument('--poll-interval', type=float, default=0,
+        help='Wait for new jobs, polling with the given interval (in seconds), rather than exiting when the queue is empty')
+    worker.add_argument('--max-jobs', type=int,
+        help='Maximum number of jobs to run before exiting')
+    worker.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of jobs to run concurrently')
+    worker.add_argument('--max-cores', type=int,
+        help='Maximum number of cores for stages of all running jobs to use at once')
+    worker.add_argument('--max-memory',
+        help='Maximum amount of memory (i.e. 512M or 4G) for stages of all running jobs to use at once')
+
+    status = subparsers.add_parser('status', help='Print the number of jobs in each state')
+    status.add_argument('queue', help='Queue directory')
+
+    requeue = subparsers.add_parser('requeue', help='Return stale or failed jobs to the pending state')
+    requeue.add_argument('queue', help='Queue directory')
+    requeue.add_argument('--timeout', type=float, default=300,
+        help='Time (in seconds) after which running jobs without a heartbeat are requeued')
+    requeue.add_argument('--failed', action='store_true',
+        help='Also requeue failed jobs')
+
+    args = parser.parse_args()
+    queue = JobQueue(args.queue)
+
+    if args.command == 'enqueue':
+        for filename in args.workflows:
+            with open(filename, 'r') as f:
+                json_object = json.load(f)
+            print(queue.enqueue(json_object, filename))
+    elif args.command == 'worker':
+        logging.basicConfig(level=logging.INFO)
+        resources = None
+        if args.max_cores is not None or args.max_memory is not None:
+            resources = ResourceBudget(args.max_cores, args.max_memory)
+        result = run_worker(
+            queue, args.module_names, args.timeout, args.heartbeat,
+            args.poll_interval, args.max_jobs, args.jobs, resources)
+        print('{done} done, {failed} failed'.format(**result))
+    elif args.command == 'status':
+        for (state, count) in queue.counts().items():
+            print('{}: {}'.format(state, count))
+    elif args.command == 'requeue':
+        names = queue.requeue_stale(args.timeout)
+        if args.failed:
+            names.extend(queue.requeue_failed())
+        for name in names:
+            print(name)
+
+if __name__ == '__main__':
+    main()
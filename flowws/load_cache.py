@@ -0,0 +1,84 @@
+import collections
+import threading
+
+class LoadCache:
+    """Bounded in-memory cache of decoded file contents.
+
+    Values are stored by (full file name, decoder) in least-recently
+    used order. When adding a value would make the total size of
+    cached values exceed `max_bytes`, the least-recently used values
+    are evicted; values larger than `max_bytes` are never cached.
+    Values are not cached for files that are currently open for
+    writing (see `begin_write` and `end_write`).
+
+    The size of each value is estimated as the size of its numpy
+    buffer (for objects with an `nbytes` attribute) or the number of
+    bytes of the file it was decoded from, whichever is larger.
+
+    :param max_bytes: Maximum total size of cached values
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        # number of streams currently writing to each file
+        self._writers = collections.Counter()
+        # incremented whenever a file is discarded, so that values read
+        # while the file was being written are not cached
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached value for a key, or raise KeyError."""
+        with self._lock:
+            (value, _) = self._entries[key]
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, file_size, generation):
+        """Add a value decoded from a file of `file_size` bytes to the cache.
+
+        :param generation: Value of `generation` before the file was read
+        """
+        size = max(file_size, getattr(value, 'nbytes', 0) or 0)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if generation != self.generation or key[0] in self._writers:
+                return
+
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+
+            while self._entries and self._size + size > self.max_bytes:
+                (_, (_, evicted_size)) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+            self._entries[key] = (value, size)
+            self._size += size
+
+    def discard(self, full_name):
+        """Forget all values decoded from a file."""
+        with self._lock:
+            self.generation += 1
+            for key in [key for key in self._entries if key[0] == full_name]:
+                self._size -= self._entries.pop(key)[1]
+
+    def begin_write(self, full_name):
+        """Forget all values decoded from a file and stop caching it until `end_write` is called."""
+        with self._lock:
+            self._writers[full_name] += 1
+        self.discard(full_name)
+
+    def end_write(self, full_name):
+        """Forget values read while a file was being written, after the write finishes."""
+        with self._lock:
+            self._writers[full_name] -= 1
+            if self._writers[full_name] <= 0:
+                del self._writers[full_name]
+        self.discard(full_name)
@@ -0,0 +1,174 @@
+import collections
+import re
+import threading
+
+from .internal import LazyExecutor
+
+#: Maximum number of files being read ahead at once
+MAX_WORKERS = 8
+
+_NUMBERED_NAME = re.compile(r'^(.*?)(\d+)(\D*)$')
+
+_executor = LazyExecutor(MAX_WORKERS, 'flowws-readahead')
+
+class PrefetchBuffer:
+    """Bounded in-memory buffer of file contents read ahead of time.
+
+    Names requested through `prefetch` are read in a shared pool of
+    background threads (using `read_function`), in order, as long as
+    fewer than `max_files` files and `max_bytes` bytes are held in (or
+    being read into) the buffer. The size of each file is found
+    using `size_function` before it is read and reserved in the
+    buffer; files larger than `max_bytes` (or that do not exist) are
+    never prefetched, and files of unknown size are only read when
+    the buffer is otherwise empty. Contents are removed from the
+    buffer when they are `take`-n, freeing space for the following
+    files.
+
+    The buffer also watches the sequence of names passed to `observe`:
+    when files whose names differ only by a number increasing by one
+    (such as `frame_8.bin` and `frame_9.bin`) are read one after the
+    other, the next `readahead` files of the sequence are prefetched.
+
+    :param read_function: Function returning the binary contents of a file given its full name
+    :param max_bytes: Maximum number of bytes to hold in the buffer
+    :param max_files: Maximum number of files to hold (or be reading) in the buffer
+    :param readahead: Number of files to prefetch when a sequential pattern is detected (0 to disable detection)
+    :param size_function: Function returning the size in bytes of a file (or None if unknown) given its full name, raising an exception if the file can not be read
+    """
+    def __init__(self, read_function, max_bytes, max_files, readahead,
+                 size_function=None):
+        self.read_function = read_function
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.readahead = readahead
+        self.size_function = size_function
+
+        self._lock = threading.Lock()
+        # full name -> expected size (or None), in order
+        self._queue = collections.OrderedDict()
+        # full name -> (future, expected size or None)
+        self._entries = collections.OrderedDict()
+        self._last_name = None
+
+    def _read(self, full_name):
+        return bytes(self.read_function(full_name))
+
+    def _entry_bytes(self, future, size):
+        if future.done() and future.exception() is None:
+            return len(future.result())
+        # reads of unknown size may use the whole budget
+        return self.max_bytes if size is None else size
+
+    def _buffered_bytes(self):
+        return sum(self._entry_bytes(future, size)
+                   for (future, size) in self._entries.values())
+
+    def _fits(self, size):
+        if not self._entries:
+            return True
+        size = self.max_bytes if size is None else size
+        return self._buffered_bytes() + size <= self.max_bytes
+
+    def _fill(self):
+        # files that could not be read (or turned out to be too large)
+        # will be opened normally instead
+        for (full_name, (future, _)) in list(self._entries.items()):
+            if future.done() and (future.exception() is not None or
+                                  len(future.result()) > self.max_bytes):
+                del self._entries[full_name]
+
+        # make room for newly-requested files by forgetting the
+        # oldest files that were read but never used
+        while self._queue and self._entries:
+            next_size = next(iter(self._queue.values()))
+            if len(self._entries) < self.max_files and self._fits(next_size):
+                break
+            (full_name, (future, _)) = next(iter(self._entries.items()))
+            if not future.done():
+                break
+            del self._entries[full_name]
+
+        while self._queue and len(self._entries) < self.max_files:
+            (full_name, size) = next(iter(self._queue.items()))
+            if not self._fits(size):
+                break
+            del self._queue[full_name]
+            future = _executor.submit(self._read, full_name)
+            self._entries[full_name] = (future, size)
+
+    def _size(self, full_name):
+        if self.size_function is None:
+            return None
+        return self.size_function(full_name)
+
+    def prefetch(self, full_names):
+        """Queue files to be read in the background."""
+        requests = []
+        for full_name in full_names:
+            try:
+                size = self._size(full_name)
+            except Exception:
+                # missing files are left to be opened normally
+                continue
+            if size is None or size <= self.max_bytes:
+                requests.append((full_name, size))
+
+        with self._lock:
+            for (full_name, size) in requests:
+                if full_name not in self._entries and full_name not in self._queue:
+                    self._queue[full_name] = size
+            self._fill()
+
+    def discard(self, full_name):
+        """Forget any buffered contents of a file (for example, because it was written)."""
+        with self._lock:
+            (future, _) = self._entries.pop(full_name, (None, None))
+            self._queue.pop(full_name, None)
+            if future is not None:
+                future.cancel()
+            self._fill()
+
+    def take(self, full_name):
+        """Remove and return the buffered contents of a file.
+
+        Waits for the contents to be read if necessary. Returns None
+        if the file has not been prefetched or could not be read in
+        the background (so that it can be opened normally).
+        """
+        with self._lock:
+            (future, _) = self._entries.pop(full_name, (None, None))
+            self._queue.pop(full_name, None)
+
+        if future is None:
+            return None
+
+        try:
+            return future.result()
+        except Exception:
+            return None
+        finally:
+            with self._lock:
+                self._fill()
+
+    def observe(self, full_name):
+        """Note that a file was opened for reading, to detect sequential access."""
+        if not self.readahead:
+            return
+
+        match = _NUMBERED_NAME.match(full_name)
+        if match is None:
+            self._last_name = None
+            return
+
+        (prefix, digits, suffix) = match.groups()
+        number = int(digits)
+
+        last = self._last_name
+        self._last_name = (prefix, number, suffix)
+        if last != (prefix, number - 1, suffix):
+            return
+
+        names = ['{}{}{}'.format(prefix, str(number + i).zfill(len(digits)), suffix)
+                 for i in range(1, self.readahead + 1)]
+        self.prefetch(names)
@@ -0,0 +1,116 @@
+import cProfile
+import contextlib
+import io
+import marshal
+import pstats
+import time
+import tracemalloc
+
+#: Storage prefix under which profiling reports are written
+PROFILE_GROUP = 'flowws_profile'
+
+class StageProfiler:
+    """Profile each stage of a workflow and write reports to its storage.
+
+    For each stage, a `cProfile` report is written to
+    `flowws_profile/<index>_<StageName>.pstats` (which can be loaded
+    with `pstats.Stats` or tools such as snakeviz). If memory
+    profiling is enabled, the `top` locations allocating the most
+    memory (as measured by `tracemalloc`) are written to
+    `flowws_profile/<index>_<StageName>_memory.txt`. After the
+    workflow finishes, `write_summary` writes the timing of every
+    stage and the merged profile of all stages, sorted by cumulative
+    time, to `flowws_profile/summary.txt` (and the merged profile
+    itself to `flowws_profile/all.pstats`).
+
+    :param memory: If True, also trace memory allocations of each stage
+    :param top: Number of entries to include in text reports
+    """
+    def __init__(self, memory=False, top=25):
+        self.memory = memory
+        self.top = top
+        self.stage_count = 0
+        self.stage_times = []
+        self.merged_stats = None
+
+    def copy(self):
+        """Return an independent copy of this profiler, including its results so far."""
+        result = type(self)(self.memory, self.top)
+        result.stage_count = self.stage_count
+        result.stage_times = list(self.stage_times)
+        if self.merged_stats is not None:
+            result.merged_stats = pstats.Stats()
+            result.merged_stats.add(self.merged_stats)
+        return result
+
+    @contextlib.contextmanager
+    def profile(self, stage, storage):
+        """Context manager to profile the execution of a single stage."""
+        prefix = '{}/{:03d}_{}'.format(
+            PROFILE_GROUP, self.stage_count, type(stage).__name__)
+        self.stage_count += 1
+
+        started_tracing = False
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - start
+
+            if self.memory:
+                snapshot = tracemalloc.take_snapshot()
+                (_, peak) = tracemalloc.get_traced_memory()
+                if started_tracing:
+                    tracemalloc.stop()
+                self._write_memory_report(
+                    snapshot, peak, prefix + '_memory.txt', storage)
+
+            profiler.create_stats()
+            with storage.open(prefix + '.pstats', 'wb') as f:
+                marshal.dump(profiler.stats, f)
+
+            self.stage_times.append((prefix.split('/')[-1], duration))
+            if self.merged_stats is None:
+                self.merged_stats = pstats.Stats(profiler)
+            else:
+                self.merged_stats.add(profiler)
+
+    def _write_memory_report(self, snapshot, peak, filename, storage):
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+        statistics = snapshot.statistics('lineno')
+
+        with storage.open(filename, 'w') as f:
+            f.write('Peak traced memory: {:.1f} KiB\n\n'.format(peak/1024))
+            f.write('Top {} allocating lines:\n'.format(self.top))
+            for stat in statistics[:self.top]:
+                f.write('{}\n'.format(stat))
+
+    def write_summary(self, storage):
+        """Write per-stage timings and the merged profile of all stages."""
+        if self.merged_stats is None:
+            return
+
+        output = io.StringIO()
+        output.write('Stage wall times:\n')
+        for (name, duration) in self.stage_times:
+            output.write('{:>12.3f} s  {}\n'.format(duration, name))
+        output.write('\n')
+
+        self.merged_stats.stream = output
+        self.merged_stats.sort_stats('cumulative').print_stats(self.top)
+
+        with storage.open(PROFILE_GROUP + '/summary.txt', 'w') as f:
+            f.write(output.getvalue())
+
+        with storage.open(PROFILE_GROUP + '/all.pstats', 'wb') as f:
+            marshal.dump(self.merged_stats.stats, f)
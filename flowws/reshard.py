@@ -0,0 +1,101 @@
+"""Convert storage directories between flat and sharded layouts
+
+The `flowws.reshard` utility moves the files of an existing
+`DirectoryStorage` location into a new layout (see
+:py:class:`flowws.DirectoryStorage`), writing (or removing) the
+manifest of the directory as appropriate::
+
+    python -m flowws.reshard results/ --shard hash
+
+    python -m flowws.reshard results/ --group sweep_1 --shard none
+
+Files stored in subdirectories of a flat directory can not be told
+apart from the files of other storage groups stored below it, so
+only the files directly within a flat directory are moved unless
+`--recursive` is given. Subdirectories holding a sharded storage
+group are never moved.
+
+No other process should use the directory while it is being
+converted. A `flowws_reshard` script is also installed for this
+command for convenience.
+
+"""
+
+import argparse
+import os
+
+from .DirectoryStorage import (
+    DirectoryStorage, MANIFEST_NAME, SHARD_LAYOUTS, shard_path, write_manifest)
+
+def _flat_names(directory, recursive):
+    for (dirpath, dirnames, filenames) in os.walk(directory):
+        # never move the files of other (sharded) storage groups
+        dirnames[:] = [name for name in dirnames if recursive and not
+                       os.path.exists(os.path.join(dirpath, name, MANIFEST_NAME))]
+
+        relative_dir = os.path.relpath(dirpath, directory)
+        for filename in filenames:
+            name = os.path.normpath(os.path.join(relative_dir, filename))
+            yield name.replace(os.sep, '/')
+
+def reshard(root, group=None, shard=None, recursive=False):
+    """Move all files of a storage directory into a new layout.
+
+    :param root: Root directory of the storage
+    :param group: Optional subdirectory of `root` to convert
+    :param shard: New layout (one of `flowws.DirectoryStorage.SHARD_LAYOUTS`, or None for a flat layout)
+    :param recursive: If True, also move files in subdirectories of a flat directory (which must not be used by other storage groups)
+    :returns: A `DirectoryStorage` object using the new layout
+    """
+    storage = DirectoryStorage(root, group)
+    old_shard = storage.shard
+    if old_shard == shard:
+        return storage
+
+    directory = storage.full_prefix
+    if old_shard is None:
+        names = sorted(_flat_names(directory, recursive))
+    else:
+        names = sorted(storage.list())
+    # keep a manifest in the directory while files are moved, so that
+    # removing emptied shard directories never removes the directory itself
+    write_manifest(directory, shard or old_shard, names)
+
+    # files are moved through a temporary directory, since new shard
+    # directories may have the same names as old files (and vice versa)
+    staging = os.path.join(directory, '.flowws_reshard')
+    for (old_layout, new_layout, source_dir, destination_dir) in [
+            (old_shard, None, directory, staging),
+            (None, shard, staging, directory)]:
+        for name in names:
+            # renames creates new directories and prunes empty old ones
+            os.renames(os.path.join(source_dir, shard_path(name, old_layout)),
+                       os.path.join(destination_dir, shard_path(name, new_layout)))
+
+    if shard is None:
+        os.remove(os.path.join(directory, MANIFEST_NAME))
+    else:
+        write_manifest(directory, shard, names)
+
+    return DirectoryStorage(root, group)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert a storage directory to a new layout')
+    parser.add_argument('root',
+        help='Root directory of the storage')
+    parser.add_argument('-g', '--group',
+        help='Subdirectory of the root to convert')
+    parser.add_argument('-s', '--shard', required=True,
+        choices=list(SHARD_LAYOUTS) + ['none'],
+        help='New layout to use')
+    parser.add_argument('-r', '--recursive', action='store_true',
+        help='Also move files in subdirectories of a flat directory')
+
+    args = parser.parse_args()
+
+    shard = None if args.shard == 'none' else args.shard
+    reshard(args.root, args.group, shard, args.recursive)
+
+if __name__ == '__main__':
+    main()
@@ -24,17 +24,59 @@ using `flowws.run`::
 
     python -m flowws.run workflow.json
 
+as can precompiled workflow bundles (created by `flowws.freeze
+--bundle`), which avoid searching for modules and validating stage
+arguments again::
+
+    python -m flowws.run workflow.bundle
+
+Workflows can also be submitted to a running :py:mod:`flowws.daemon`
+process, which avoids the cost of starting python and importing
+modules for each workflow, by giving the location of its socket
+before the workflow description (or through the `FLOWWS_DAEMON`
+environment variable)::
+
+    python -m flowws.run --daemon /tmp/flowws.sock Module1 Module2
+
+Individual stages can be profiled using `--profile` (or
+`--profile-memory` to also trace memory allocations); reports for
+each stage and a merged summary are written into the
+`flowws_profile/` group of the workflow storage (see
+:py:class:`flowws.profiling.StageProfiler`)::
+
+    python -m flowws.run --profile Module1 Module2
+
 A `flowws_run` script is also installed for this command for
 convenience.
 
 """
 
 import argparse
+import os
+import sys
 
 from . import Workflow
 
 def main():
-    workflow = Workflow.from_command()
+    args = sys.argv[1:]
+    daemon = os.environ.get('FLOWWS_DAEMON')
+
+    if args and args[0] == '--daemon':
+        if len(args) < 2:
+            parser = argparse.ArgumentParser(
+                usage='%(prog)s [--daemon SOCKET] module [args] [module [args] ...]')
+            parser.error('argument --daemon: expected one argument')
+        daemon = args[1]
+        args = args[2:]
+    elif args and args[0].startswith('--daemon='):
+        daemon = args[0].split('=', 1)[1]
+        args = args[1:]
+
+    if daemon:
+        from .daemon import submit
+        sys.exit(submit(daemon, args))
+
+    workflow = Workflow.from_command(args)
     workflow.run()
 
 if __name__ == '__main__':
@@ -0,0 +1,397 @@
+"""Efficiently run many related workflows
+
+The `flowws.sweep` utility runs a set of workflows (for example, a
+parameter sweep) described by JSON files produced by
+:py:mod:`flowws.freeze`. Workflows often share a long, expensive
+prefix of identical stages (such as initialization and
+equilibration) and differ only in later stages. Rather than running
+each workflow independently, the workflows are arranged in a tree
+according to their stages (compared through `Stage.to_JSON`): shared
+stages are run only once, after which the process is forked for
+each distinct continuation. Each branch receives a copy-on-write
+snapshot of the scope of the shared stages::
+
+    python -m flowws.sweep sweep_*.json
+
+Stages shared by several workflows are run using the storage of the
+first of those workflows; after the workflows diverge, each branch
+uses the storage of its own workflow, so each workflow of the sweep
+should generally be given its own storage location or group. Note
+that this means that stages after a branch point can only access
+the results of shared stages through the scope, not through the
+storage. The final stage of each workflow is always run using its
+own storage, even for workflows that differ only in their storage.
+
+When branches are forked, storages are closed (see
+:py:meth:`flowws.Storage.Storage.close`) before forking and at the
+end of each branch. Since only one process can write to an archive
+at a time, workflows can not share a `GetarStorage` archive (even
+using different groups) in that case; give each workflow its own
+archive, or serve a shared archive using a
+:py:class:`flowws.StorageServer`.
+
+Stages that override :py:meth:`flowws.Stage.run_batch` can process
+many workflows at once: when workflows diverge at stages of the same
+type that differ only in scalar arguments, these stages are run by a
+single `run_batch` call (each with its own scope snapshot and
+storage) before forking, and later stages are batched in the same
+way for as long as the branches continue to allow it. If a batch
+fails, all workflows in the batch are considered failed. The
+resources of a batched stage (see `Stage.RESOURCES`) are acquired
+once for the whole batch, which is also profiled as a single stage.
+
+Workflows run with profiling enabled (see `Workflow`) write their
+profile summary into their own storage when they finish, and
+workflows with a catalog are recorded in it (with the files written
+by shared stages attributed to every workflow sharing them).
+
+A `flowws_sweep` script is also installed for this command for
+convenience.
+
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import traceback
+
+from .Stage import Stage
+from .StageCache import StageCache, _stage_key
+from .Workflow import Workflow
+
+logger = logging.getLogger(__name__)
+
+def _workflow_keys(workflow):
+    keys = [_stage_key(stage) for stage in workflow.stages]
+    # the final stage of each workflow is run with its own storage,
+    # even if it is otherwise identical to a stage of another workflow
+    if keys:
+        keys[-1] = json.dumps([keys[-1], workflow.storage.to_JSON()],
+                              sort_keys=True, default=repr)
+    return keys
+
+def _archive_target(storage):
+    description = storage.to_JSON()
+    if description.get('type') == 'GetarStorage':
+        return os.path.abspath(description['target'])
+    return None
+
+def _scope_key(workflow):
+    # invocation metadata (i.e. timestamps) is expected to differ
+    scope = {key: val for (key, val) in workflow.scope.items()
+             if key != 'metadata'}
+    return json.dumps(scope, sort_keys=True, default=repr)
+
+def _is_scalar(value):
+    return value is None or isinstance(value, (bool, int, float, str))
+
+def _batch_key(stage):
+    # stages can only be run together if they override run_batch and
+    # only differ in their scalar arguments
+    if getattr(type(stage).run_batch, '__func__', None) is Stage.run_batch.__func__:
+        return None
+
+    description = stage.to_JSON()
+    arguments = description.pop('arguments', {})
+    description['arguments'] = {name: value for (name, value) in arguments.items()
+                                if not _is_scalar(value)}
+    return json.dumps(description, sort_keys=True, default=repr)
+
+def _group_by(indices, key):
+    result = collections.OrderedDict()
+    for index in indices:
+        result.setdefault(key(index), []).append(index)
+    return list(result.values())
+
+class _TreeRunner:
+    def __init__(self, workflows, fork, parallel, stage_cache):
+        self.workflows = workflows
+        self.fork = fork
+        self.parallel = max(1, parallel)
+        self.stage_cache = stage_cache
+        self.stage_keys = [_workflow_keys(workflow) for workflow in workflows]
+
+        if self.fork:
+            targets = collections.Counter(
+                _archive_target(workflow.storage) for workflow in workflows)
+            shared = sorted(target for (target, count) in targets.items()
+                            if target is not None and count > 1)
+            if shared:
+                raise ValueError(
+                    'Workflows run in forked branches can not share the '
+                    'archive {}; give each workflow its own archive'.format(
+                        shared[0]))
+
+    def _close_storages(self):
+        for workflow in self.workflows:
+            workflow.storage.close()
+
+    def run(self):
+        results = {}
+        groups = _group_by(range(len(self.workflows)),
+                           lambda i: _scope_key(self.workflows[i]))
+
+        for indices in groups:
+            scope = self.workflows[indices[0]]._make_scope()
+            if any(self.workflows[i].catalog is not None for i in indices):
+                from .catalog import RunRecord
+                scope['flowws.run_record'] = RunRecord(self.workflows[indices[0]])
+            with contextlib.ExitStack() as stack:
+                scope['flowws.exit_stack'] = stack
+                results.update(self._run_node(indices, 0, scope))
+
+        return [results[i] for i in range(len(self.workflows))]
+
+    @staticmethod
+    def _branch_scope(scope):
+        # each branch records its own profile and catalog entries
+        result = scope.snapshot()
+        for key in ('flowws.profiler', 'flowws.run_record'):
+            if result.get(key) is not None:
+                result[key] = result[key].copy()
+        return result
+
+    def _finish(self, indices, scope, status):
+        """Write profiles and catalog entries of finished workflows, returning their statuses."""
+        profiler = scope.get('flowws.profiler')
+        record = scope.get('flowws.run_record')
+        for i in indices:
+            workflow = self.workflows[i]
+            if profiler is not None and not status:
+                profiler.write_summary(workflow.storage)
+            if record is not None and workflow.catalog is not None:
+                workflow.catalog.add_run(
+                    record.copy(workflow), 'failed' if status else 'ok')
+        return {i: status for i in indices}
+
+    def _run_node(self, indices, depth, scope):
+        results = {}
+        while True:
+            finished = [i for i in indices if len(self.stage_keys[i]) == depth]
+            results.update(self._finish(finished, scope, 0))
+            indices = [i for i in indices if i not in finished]
+            branches = _group_by(indices, lambda i: self.stage_keys[i][depth])
+
+            if len(branches) != 1:
+                break
+
+            workflow = self.workflows[indices[0]]
+            scope['workflow'] = scope['flowws.workflow'] = workflow
+            workflow._prefetch_inputs(workflow.stages[depth:], scope)
+            try:
+                workflow._run_stage(workflow.stages[depth], scope, self.stage_cache)
+            except Exception:
+                logger.exception('Stage {} failed for workflows {}'.format(
+                    depth, indices))
+                results.update(self._finish(indices, scope, 1))
+                return results
+            depth += 1
+
+        (tasks, failed) = self._run_batches(branches, depth, scope)
+        results.update(failed)
+
+        if self.fork:
+            results.update(self._fork_branches(tasks, scope))
+        else:
+            for (branch, branch_depth, branch_scope) in tasks:
+                if branch_scope is None:
+                    branch_scope = self._branch_scope(scope)
+                with contextlib.ExitStack() as stack:
+                    branch_scope['flowws.exit_stack'] = stack
+                    results.update(self._run_node(branch, branch_depth, branch_scope))
+
+        return results
+
+    def _can_batch(self, members, depth):
+        keys = set()
+        for (indices, _) in members:
+            # every workflow of the branch must share the next stage
+            if len({tuple(self.stage_keys[i][depth:depth + 1])
+                    for i in indices}) != 1:
+                return False
+            if len(self.stage_keys[indices[0]]) <= depth:
+                return False
+            keys.add(_batch_key(self.workflows[indices[0]].stages[depth]))
+
+        return len(keys) == 1 and None not in keys
+
+    def _run_batches(self, branches, depth, scope):
+        """Run stages of several branches together using `Stage.run_batch`.
+
+        Returns a list of (workflow indices, depth, scope) tasks that
+        remain to be run (with a scope of None for branches that
+        should use a snapshot of the current scope) and a dictionary
+        of statuses of failed workflows.
+        """
+        tasks = []
+        failed = {}
+        groups = _group_by(range(len(branches)), lambda b: (
+            _batch_key(self.workflows[branches[b][0]].stages[depth])))
+
+        for group in groups:
+            if len(group) == 1 or not self._can_batch(
+                    [(branches[b], None) for b in group], depth):
+                tasks.extend((branches[b], depth, None) for b in group)
+                continue
+
+            members = [(branches[b], self._branch_scope(scope)) for b in group]
+            member_depth = depth
+            try:
+                # keep running stages together as long as the branches allow
+                while self._can_batch(members, member_depth):
+                    self._run_batch(members, member_depth)
+                    member_depth += 1
+            except Exception:
+                indices = [i for (branch, _) in members for i in branch]
+                logger.exception('Stage {} failed for workflows {}'.format(
+                    member_depth, indices))
+                for (branch, branch_scope) in members:
+                    failed.update(self._finish(branch, branch_scope, 1))
+                continue
+
+            tasks.extend((branch, member_depth, branch_scope)
+                         for (branch, branch_scope) in members)
+
+        return tasks, failed
+
+    def _run_batch(self, members, depth):
+        workflows = [self.workflows[indices[0]] for (indices, _) in members]
+        scopes = [scope for (_, scope) in members]
+
+        for (workflow, scope) in zip(workflows, scopes):
+            scope['workflow'] = scope['flowws.workflow'] = workflow
+            workflow._prefetch_inputs(workflow.stages[depth:], scope)
+
+        with contextlib.ExitStack() as stack:
+            # resources are acquired (and the batch is profiled) once,
+            # through the first workflow
+            stages = [stack.enter_context(workflow._stage_context(
+                workflow.stages[depth], scope, self.stage_cache, primary=(i == 0)))
+                      for (i, (workflow, scope)) in enumerate(zip(workflows, scopes))]
+
+            type(stages[0]).run_batch(
+                stages, scopes, [workflow.storage for workflow in workflows])
+
+    def _fork_branches(self, tasks, scope):
+        results = {}
+        running = {}
+        tasks = list(tasks)
+        # finish writing files so that children do not share open archives
+        self._close_storages()
+
+        while tasks or running:
+            while tasks and len(running) < self.parallel:
+                (branch, depth, branch_scope) = tasks.pop(0)
+                if branch_scope is None:
+                    branch_scope = scope
+                result_file = tempfile.TemporaryFile('w+')
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    self._run_child(branch, depth, branch_scope, result_file)
+                running[pid] = (branch, result_file)
+
+            (pid, status) = os.wait()
+            if pid not in running:
+                continue
+
+            (branch, result_file) = running.pop(pid)
+            with result_file:
+                result_file.seek(0)
+                try:
+                    child_results = json.load(result_file)
+                    results.update((int(i), val) for (i, val) in child_results.items())
+                except ValueError:
+                    # child died before reporting its results
+                    results.update((i, status or 1) for i in branch)
+
+        return results
+
+    def _run_child(self, branch, depth, scope, result_file):
+        # runs inside the forked child process; never returns
+        status = 1
+        try:
+            self.stage_cache._inherit()
+            with contextlib.ExitStack() as stack:
+                scope['flowws.exit_stack'] = stack
+                results = self._run_node(branch, depth, scope)
+            # stages set up by this child are torn down here; stages
+            # inherited from the parent are torn down by the parent
+            self.stage_cache.close()
+            # os._exit skips cleanup, so archives must be finished here
+            self._close_storages()
+            json.dump(results, result_file)
+            result_file.flush()
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(status)
+
+def run_tree(workflows, fork=None, parallel=1, stage_cache=None):
+    """Run a set of workflows, running shared prefixes of stages only once.
+
+    Workflows with identical initial scopes (ignoring the `metadata`
+    entry) are arranged into a tree based on the JSON representation
+    of their stages. Stages shared by multiple workflows are run
+    once, using the storage and resources of the first of those
+    workflows (except for the final stage of each workflow, which
+    always uses its own storage); whenever workflows diverge, each branch is run in a
+    forked process (or, if `fork` is False, sequentially using a
+    snapshot of the scope; see `Scope.snapshot` and
+    `PersistentScope`). Stages of diverging branches are run
+    together when their type supports it (see `Stage.run_batch`).
+    Set-up stage objects (see `Stage.setup`) are reused for
+    equivalent stages of different workflows.
+
+    :param workflows: List of `Workflow` objects to run
+    :param fork: If True, run branches in forked processes (default: True if `os.fork` is available)
+    :param parallel: Maximum number of branches to run at the same time when forking
+    :param stage_cache: Optional `StageCache` of set-up stages to use (default: use a new cache, which is closed after all workflows finish)
+    :returns: List of statuses (0 for success) for each workflow
+    """
+    if fork is None:
+        fork = hasattr(os, 'fork')
+
+    if stage_cache is None:
+        with StageCache() as stage_cache:
+            return _TreeRunner(list(workflows), fork, parallel, stage_cache).run()
+
+    return _TreeRunner(list(workflows), fork, parallel, stage_cache).run()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run many workflows, sharing common stages')
+    parser.add_argument('workflows', nargs='+',
+        help='JSON workflow descriptions to run')
+    parser.add_argument('-m', '--module-names', default='flowws_modules',
+        help='Registered module entry_point to search')
+    parser.add_argument('-j', '--parallel', type=int, default=1,
+        help='Maximum number of branches to run at the same time')
+
+    args = parser.parse_args()
+
+    workflows = []
+    for filename in args.workflows:
+        with open(filename, 'r') as f:
+            workflows.append(Workflow.from_JSON(json.load(f), args.module_names))
+
+    statuses = run_tree(workflows, parallel=args.parallel)
+    for (filename, status) in zip(args.workflows, statuses):
+        if status:
+            print('Failed: {}'.format(filename))
+
+    sys.exit(int(any(statuses)))
+
+if __name__ == '__main__':
+    main()
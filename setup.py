@@ -26,6 +26,11 @@ setup(name='flowws',
           'console_scripts': [
               'flowws_run = flowws.run:main',
               'flowws_freeze = flowws.freeze:main',
+              'flowws_queue = flowws.job_queue:main',
+              'flowws_daemon = flowws.daemon:main',
+              'flowws_sweep = flowws.sweep:main',
+              'flowws_catalog = flowws.catalog:main',
+              'flowws_reshard = flowws.reshard:main',
           ],
       },
       extras_require={},
@@ -1,3 +1,4 @@
+import json
 import os
 
 class StorageTestBase:
@@ -33,3 +34,220 @@ class StorageTestBase:
     def test_has_filename(self):
         with self.storage.open('test.txt', 'a', on_filesystem=True) as f:
             self.assertTrue(os.path.exists(f.name))
+
+    def test_batch(self):
+        with self.storage.batch():
+            for i in range(3):
+                with self.storage.open('batch.txt', 'w', modifiers=[str(i)]) as f:
+                    f.write(str(i))
+
+            with self.storage.batch():
+                with self.storage.open('batch.txt', 'a', modifiers=['0']) as f:
+                    f.write('a')
+
+            with self.storage.open('batch.txt', 'r', modifiers=['0']) as f:
+                self.assertEqual(f.read(), '0a')
+
+        for i in range(3):
+            with self.storage.open('batch.txt', 'rb', modifiers=[str(i)]) as f:
+                self.assertEqual(f.read().decode()[:1], str(i))
+
+    def test_exists_list_stat(self):
+        self.assertFalse(self.storage.exists('listed.txt'))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.stat('listed.txt')
+
+        for i in range(3):
+            with self.storage.open('listed.txt', 'w', modifiers=[str(i)]) as f:
+                f.write('x'*(i + 1))
+        with self.storage.open('other.txt', 'w') as f:
+            f.write('y')
+
+        self.assertTrue(self.storage.exists('listed.txt', modifiers=['1']))
+        self.assertEqual(self.storage.stat('listed.txt', modifiers=['2']).size, 3)
+        self.assertEqual(self.storage.list('listed'),
+                         ['listed.0.txt', 'listed.1.txt', 'listed.2.txt'])
+        self.assertIn('other.txt', self.storage.list())
+
+    def test_compression(self):
+        contents = bytes(range(256))*1024
+        for method in ['gzip', 'bz2', 'lzma']:
+            with self.storage.open('compressed.bin', 'wb', modifiers=[method],
+                                   compress=method) as f:
+                f.write(contents)
+            with self.storage.open('compressed.bin', 'ab', modifiers=[method],
+                                   compress=method) as f:
+                f.write(b'tail')
+
+            with self.storage.open('compressed.bin', 'rb', modifiers=[method]) as f:
+                self.assertNotEqual(f.read(), contents + b'tail')
+            with self.storage.open('compressed.bin', 'rb', modifiers=[method],
+                                   compress=True) as f:
+                self.assertEqual(f.read(), contents + b'tail')
+
+        with self.storage.open('plain.txt', 'w') as f:
+            f.write('plain')
+        with self.storage.open('plain.txt', 'r', compress=True) as f:
+            self.assertEqual(f.read(), 'plain')
+
+        with self.storage.open('text.txt', 'w', compress='gzip') as f:
+            f.write('compressed text')
+        with self.storage.open('text.txt', 'r', compress=True) as f:
+            self.assertEqual(f.read(), 'compressed text')
+
+    def test_prefetch(self):
+        self.storage.prefetch_readahead = 4
+        for i in range(10):
+            with self.storage.open('frame_{:03d}.bin'.format(i), 'wb') as f:
+                f.write(bytes([i])*16)
+        with self.storage.open('config.txt', 'w') as f:
+            f.write('old')
+
+        self.storage.prefetch(['config.txt', 'missing.txt'])
+        with self.storage.open('config.txt', 'r') as f:
+            self.assertEqual(f.read(), 'old')
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open('missing.txt', 'r').read()
+
+        self.storage.prefetch(['config.txt'])
+        with self.storage.open('config.txt', 'w') as f:
+            f.write('new')
+        with self.storage.open('config.txt', 'r') as f:
+            self.assertEqual(f.read(), 'new')
+
+        # sequential reads trigger readahead of following frames
+        for i in range(10):
+            with self.storage.open('frame_{:03d}.bin'.format(i), 'rb') as f:
+                self.assertEqual(f.read(), bytes([i])*16)
+            if i == 1:
+                buffered = set(self.storage._prefetch_buffer._entries)
+                self.assertIn('frame_002.bin', buffered)
+
+    def test_prefetch_budget(self):
+        self.storage.prefetch_max_bytes = 40
+        names = ['frame_{:03d}.bin'.format(i) for i in range(5)]
+        for name in names:
+            with self.storage.open(name, 'wb') as f:
+                f.write(b'x'*16)
+        with self.storage.open('large.bin', 'wb') as f:
+            f.write(b'x'*64)
+
+        # reads in progress count against the budget
+        self.storage.prefetch(names)
+        self.assertEqual(len(self.storage._prefetch_buffer._entries), 2)
+        for name in names:
+            with self.storage.open(name, 'rb') as f:
+                self.assertEqual(f.read(), b'x'*16)
+
+        self.storage.prefetch(['large.bin'])
+        self.assertEqual(len(self.storage._prefetch_buffer._entries), 0)
+
+    def test_log(self):
+        schema = [('step', 'i8'), ('energy', 'f8'), ('flag', '?')]
+        with self.storage.log('energy.log', schema, flush_bytes=64) as log:
+            for i in range(10):
+                log.append(i, 0.5*i, i % 2 == 0)
+            log.extend([(10, 5., True)])
+
+        with self.storage.log('energy.log', schema) as log:
+            log.append(11, 5.5, False)
+
+        rows = self.storage.read_log('energy.log')
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[3], (3, 1.5, False))
+        self.assertEqual(rows[-1], (11, 5.5, False))
+
+        with self.assertRaises(ValueError):
+            self.storage.log('energy.log', [('step', 'i4')])
+
+        try:
+            import numpy as np
+        except ImportError:
+            return
+
+        array = self.storage.read_log('energy.log', as_array=True)
+        np.testing.assert_allclose(array['energy'], 0.5*np.arange(12))
+
+    def test_log_rewrite(self):
+        schema = [('step', 'i8')]
+        with self.storage.log('energy.log', schema, flush_bytes=8) as log:
+            for i in range(4):
+                log.append(i)
+        with self.storage.log('energy.log', schema, flush_bytes=8) as log:
+            log.append(4)
+
+        with self.storage.log('other.log', schema) as log:
+            log.append(10)
+        with self.storage.open('other.log', 'rb') as f:
+            contents = f.read()
+
+        # rows appended to the previous log are not kept
+        with self.storage.open('energy.log', 'wb') as f:
+            f.write(contents)
+        self.assertEqual(self.storage.read_log('energy.log'), [(10,)])
+
+        with self.storage.log('energy.log', schema, flush_bytes=8) as log:
+            log.append(11)
+            log.append(12)
+        self.assertEqual(self.storage.read_log('energy.log'),
+                         [(10,), (11,), (12,)])
+
+    def test_load(self):
+        with self.storage.open('config.json', 'w') as f:
+            json.dump(dict(value=1), f)
+
+        config = self.storage.load('config.json')
+        self.assertEqual(config, dict(value=1))
+        # decoded values are shared until the file is written again
+        self.assertIs(self.storage.load('config.json'), config)
+        self.assertEqual(self.storage.load('config.json', 'bytes'), b'{"value": 1}')
+
+        with self.storage.open('config.json', 'w') as f:
+            json.dump(dict(value=2), f)
+        self.assertEqual(self.storage.load('config.json'), dict(value=2))
+
+        with self.assertRaises(FileNotFoundError):
+            self.storage.load('missing.json')
+
+    def test_close(self):
+        with self.storage.open('first.txt', 'w') as f:
+            f.write('first')
+        self.storage.close()
+
+        # closed storages are reopened when they are used again
+        with self.storage.open('second.txt', 'w') as f:
+            f.write('second')
+        self.assertTrue(self.storage.exists('first.txt'))
+        self.storage.close()
+        self.assertTrue(self.storage.exists('second.txt'))
+        with self.storage.open('first.txt', 'r') as f:
+            self.assertEqual(f.read(), 'first')
+
+    def test_load_during_write(self):
+        with self.storage.open('value.txt', 'w') as f:
+            f.write('1')
+        self.assertEqual(self.storage.load('value.txt'), '1')
+
+        with self.storage.open('value.txt', 'w') as f:
+            f.write('2')
+            f.flush()
+            try:
+                # contents read while writing may be stale or partial
+                self.storage.load('value.txt')
+            except FileNotFoundError:
+                pass
+            f.write('3')
+        self.assertEqual(self.storage.load('value.txt'), '23')
+
+    def test_load_eviction(self):
+        self.storage.load_cache_max_bytes = 10
+        for name in ['a.txt', 'b.txt', 'c.txt']:
+            with self.storage.open(name, 'w') as f:
+                f.write(name[0]*4)
+
+        values = [self.storage.load(name) for name in ['a.txt', 'b.txt']]
+        self.assertIs(self.storage.load('a.txt'), values[0])
+        # b.txt was least recently used
+        self.storage.load('c.txt')
+        self.assertEqual(len(self.storage._load_cache), 2)
+        self.assertIs(self.storage.load('a.txt'), values[0])
@@ -0,0 +1,115 @@
+
+import asyncio
+import os
+import pstats
+import tempfile
+import threading
+import unittest
+
+import flowws
+from flowws import Argument as Arg
+
+def run_coroutine(coroutine):
+    # asyncio.run is not available before python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+class AsyncStage(flowws.Stage):
+    ARGS = [
+        Arg('count', type=int, default=4),
+    ]
+
+    async def run(self, scope, storage):
+        names = ['item_{}.bin'.format(i) for i in range(self.arguments['count'])]
+        await asyncio.gather(*[storage.write_bytes_async(name, name.encode())
+                               for name in names])
+        contents = await asyncio.gather(*[storage.read_bytes_async(name)
+                                          for name in names])
+        scope['contents'] = contents
+
+class HeavyAsyncStage(flowws.Stage):
+    RESOURCES = dict(cores=1)
+
+    async def run(self, scope, storage):
+        scope['ran'] = True
+
+def _profiled_marker():
+    return sum(range(1000))
+
+class ProfiledAsyncStage(flowws.Stage):
+    async def run(self, scope, storage):
+        scope['marker'] = _profiled_marker()
+
+class SyncStage(flowws.Stage):
+    def run(self, scope, storage):
+        scope['thread'] = threading.current_thread()
+
+class TestAsync(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.storage = flowws.DirectoryStorage(self.tempdir.name)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_run_async(self):
+        workflow = flowws.Workflow([AsyncStage(), SyncStage()], self.storage)
+        scope = run_coroutine(workflow.run_async())
+        self.assertEqual(scope['contents'][2], b'item_2.bin')
+        # synchronous stages do not block the event loop
+        self.assertIsNot(scope['thread'], threading.current_thread())
+
+    def test_acquire_async(self):
+        budget = flowws.ResourceBudget(max_cores=1)
+        workflow = flowws.Workflow([HeavyAsyncStage()], self.storage,
+                                   resources=budget)
+        held = budget.acquire(dict(cores=1))
+        held.__enter__()
+        timer = threading.Timer(.2, held.__exit__, (None, None, None))
+
+        async def check():
+            ticks = 0
+            task = asyncio.ensure_future(workflow.run_async())
+            timer.start()
+            # the event loop keeps running while resources are awaited
+            while not task.done():
+                ticks += 1
+                await asyncio.sleep(.01)
+            return (ticks, task.result())
+
+        (ticks, scope) = run_coroutine(check())
+        timer.join()
+        self.assertTrue(scope['ran'])
+        self.assertGreater(ticks, 5)
+        self.assertEqual(budget.used_cores, 0)
+
+    def test_profile_async(self):
+        workflow = flowws.Workflow([ProfiledAsyncStage()], self.storage,
+                                   profile=True)
+        run_coroutine(workflow.run_async())
+
+        # the profile covers the body of the stage
+        path = os.path.join(self.tempdir.name,
+                            'flowws_profile', '000_ProfiledAsyncStage.pstats')
+        functions = [key[2] for key in pstats.Stats(path).stats]
+        self.assertIn('_profiled_marker', functions)
+
+    def test_run(self):
+        workflow = flowws.Workflow([AsyncStage(count=2)], self.storage)
+        scope = workflow.run()
+        self.assertEqual(scope['contents'], [b'item_0.bin', b'item_1.bin'])
+
+    def test_open_async(self):
+        async def check():
+            with await self.storage.open_async('text.txt', 'w') as f:
+                f.write('text')
+            with await self.storage.open_async('text.txt') as f:
+                return f.read()
+
+        self.assertEqual(run_coroutine(check()), 'text')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+import flowws
+from flowws import Argument as Arg
+from flowws.bundle import is_bundle, load_bundle, write_bundle
+
+validations = []
+
+def counted_int(value):
+    validations.append(value)
+    return int(value)
+
+class BundledStage(flowws.Stage):
+    ARGS = [
+        Arg('count', type=counted_int, default=1),
+        Arg('names', type=[str], default=[]),
+    ]
+
+    def run(self, scope, storage):
+        scope['result'] = (self.arguments['count'], self.arguments['names'])
+
+class TestBundle(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, 'workflow.bundle')
+        storage = flowws.DirectoryStorage(self.tempdir.name)
+        stage = BundledStage(count='3', names=['a', 'b'])
+        workflow = flowws.Workflow([stage], storage, dict(value=4))
+        write_bundle(workflow, self.filename)
+        validations.clear()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_load(self):
+        self.assertTrue(is_bundle(self.filename))
+        workflow = load_bundle(self.filename)
+
+        self.assertEqual(validations, [])
+        self.assertEqual(workflow.stages[0].arguments,
+                         dict(count=3, names=['a', 'b']))
+        self.assertEqual(workflow.scope['value'], 4)
+        self.assertEqual(workflow.storage.root, self.tempdir.name)
+
+        scope = workflow.run()
+        self.assertEqual(scope['result'], (3, ['a', 'b']))
+
+    def test_changed_schema(self):
+        old_args = BundledStage.ARGS
+        BundledStage.ARGS = old_args + [Arg('extra', type=float, default=2)]
+        try:
+            workflow = load_bundle(self.filename)
+        finally:
+            BundledStage.ARGS = old_args
+
+        # arguments are validated (and new defaults filled) again
+        self.assertEqual(validations, [3])
+        self.assertEqual(workflow.stages[0].arguments['extra'], 2)
+
+    def test_from_command(self):
+        workflow = flowws.Workflow.from_command([self.filename])
+        self.assertEqual(validations, [])
+        self.assertEqual(workflow.stages[0].arguments['count'], 3)
+        self.assertEqual(
+            workflow.scope['metadata']['invocation']['name'], 'load_bundle')
+
+    def test_not_bundle(self):
+        filename = os.path.join(self.tempdir.name, 'other.json')
+        with open(filename, 'w') as f:
+            f.write('{}')
+        self.assertFalse(is_bundle(filename))
+        with self.assertRaises(ValueError):
+            load_bundle(filename)
+
+if __name__ == '__main__':
+    unittest.main()
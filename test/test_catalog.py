@@ -0,0 +1,85 @@
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import flowws
+from flowws import Argument as Arg
+from flowws import catalog
+
+class WritingStage(flowws.Stage):
+    ARGS = [
+        Arg('value', type=float, default=0),
+        Arg('values', type=[int], default=[]),
+    ]
+
+    def run(self, scope, storage):
+        if self.arguments['value'] < 0:
+            raise ValueError('Negative value')
+
+        with storage.open('value.txt', 'w') as f:
+            f.write(str(self.arguments['value']))
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, 'catalog.sqlite')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def run_workflow(self, value, values=[]):
+        storage = flowws.DirectoryStorage(
+            os.path.join(self.tempdir.name, str(value)))
+        stages = [WritingStage(value=value, values=values)]
+        workflow = flowws.Workflow(stages, storage, dict(label='run'),
+                                   catalog=self.filename)
+        workflow.run()
+
+    def test_record(self):
+        self.run_workflow(1, [3, 4])
+        self.run_workflow(2.5)
+        with self.assertRaises(ValueError):
+            self.run_workflow(-1)
+
+        db = catalog.Catalog(self.filename)
+        runs = db.query()
+        self.assertEqual([run['status'] for run in runs], ['ok', 'ok', 'failed'])
+        self.assertEqual(runs[0]['outputs'], ['value.txt'])
+        self.assertEqual(runs[2]['outputs'], [])
+        self.assertEqual(len(runs[0]['stage_durations']), 1)
+        self.assertEqual(runs[0]['stages'][0]['type'], 'WritingStage')
+
+        runs = db.query([('value', '>', 1.5)])
+        self.assertEqual([run['stages'][0]['arguments']['value'] for run in runs], [2.5])
+
+        runs = db.query([('WritingStage.values.1', '=', 4)])
+        self.assertEqual(len(runs), 1)
+
+        runs = db.query([('label', '=', 'run'), ('value', '<', 2)])
+        self.assertEqual(len(runs), 2)
+
+        with self.assertRaises(ValueError):
+            db.query([('value', 'drop', 1)])
+
+    def test_command_line(self):
+        with mock.patch.dict(os.environ, FLOWWS_CATALOG=self.filename):
+            workflow = flowws.Workflow.from_command([])
+        self.assertEqual(workflow.catalog.filename, self.filename)
+
+        self.run_workflow(1)
+        self.run_workflow(2)
+
+        output = io.StringIO()
+        argv = ['flowws_catalog', self.filename, '--where', 'value', '>=', '2']
+        with mock.patch.object(sys, 'argv', argv), mock.patch.object(sys, 'stdout', output):
+            catalog.main()
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith('2\t'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import flowws
+from flowws import Argument as Arg
+from flowws import daemon, run
+
+@flowws.register_module
+class DaemonTestStage(flowws.Stage):
+    ARGS = [
+        Arg('message', type=str),
+        Arg('status', type=int, default=0),
+    ]
+
+    def run(self, scope, storage):
+        print(self.arguments['message'], os.getpid())
+        if self.arguments['status']:
+            raise SystemExit(self.arguments['status'])
+
+@flowws.register_module
+class DaemonExitStage(flowws.Stage):
+    def run(self, scope, storage):
+        sys.exit()
+
+@flowws.register_module
+class DaemonWriteStage(flowws.Stage):
+    def run(self, scope, storage):
+        with storage.open('output.txt', 'w') as f:
+            f.write('output')
+
+def _serve(address):
+    # output is streamed even when it is captured in the server
+    sys.stdout = io.StringIO()
+    with daemon.DaemonServer(address) as server:
+        server.serve_forever()
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.tempdir.name, 'daemon.sock')
+
+        context = multiprocessing.get_context('fork')
+        self.server = context.Process(target=_serve, args=(self.address,))
+        self.server.start()
+
+        while not os.path.exists(self.address):
+            time.sleep(.01)
+
+    def tearDown(self):
+        self.server.terminate()
+        self.server.join()
+        self.tempdir.cleanup()
+
+    def test_submit(self):
+        output = io.BytesIO()
+        status = daemon.submit(
+            self.address, ['DaemonTestStage', '--message', 'hello'],
+            output=output)
+        self.assertEqual(status, 0)
+
+        (message, pid) = output.getvalue().decode().split()
+        self.assertEqual(message, 'hello')
+        self.assertNotEqual(int(pid), os.getpid())
+        self.assertNotEqual(int(pid), self.server.pid)
+
+    def test_status(self):
+        status = daemon.submit(
+            self.address, ['DaemonTestStage', '--message', 'x', '--status', '3'],
+            output=io.BytesIO())
+        self.assertEqual(status, 3)
+
+    def test_exit(self):
+        status = daemon.submit(
+            self.address, ['DaemonExitStage'], output=io.BytesIO())
+        self.assertEqual(status, 0)
+
+    def test_storage(self):
+        filename = os.path.join(self.tempdir.name, 'output.zip')
+        status = daemon.submit(
+            self.address, ['--storage', filename, 'DaemonWriteStage'],
+            output=io.BytesIO())
+        self.assertEqual(status, 0)
+
+        storage = flowws.GetarStorage(filename)
+        try:
+            with storage.open('output.txt', 'r') as f:
+                self.assertEqual(f.read(), 'output')
+        finally:
+            storage.close()
+
+    def test_missing_address(self):
+        with unittest.mock.patch.object(sys, 'argv', ['flowws_run', '--daemon']):
+            with contextlib.redirect_stderr(io.StringIO()) as stderr:
+                with self.assertRaises(SystemExit) as context:
+                    run.main()
+        self.assertEqual(context.exception.code, 2)
+        self.assertIn('--daemon', stderr.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
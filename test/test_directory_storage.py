@@ -1,9 +1,12 @@
 
+import io
 import tempfile
 import os
 import unittest
 
 import flowws
+from flowws.Storage import Storage
+from flowws.reshard import reshard
 
 from internal import StorageTestBase
 
@@ -16,5 +19,108 @@ class TestDirectoryStorage(unittest.TestCase, StorageTestBase):
     def tearDown(self):
         self.tempdir.cleanup()
 
+class TestHashShardedStorage(unittest.TestCase, StorageTestBase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        dirname = os.path.join(self.tempdir.name, 'test')
+        self.storage = flowws.DirectoryStorage(dirname, shard='hash')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+class TestGroupShardedStorage(unittest.TestCase, StorageTestBase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.storage = flowws.DirectoryStorage(
+            self.tempdir.name, 'group', shard='group')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+class StreamOnlyStorage(Storage):
+    def __init__(self):
+        self.contents = {'present.txt': b'x'}
+
+    def open_stream(self, full_name, mode):
+        if 'w' in mode or 'a' in mode:
+            raise NotImplementedError()
+        elif full_name not in self.contents:
+            raise FileNotFoundError(full_name)
+        return io.BytesIO(self.contents[full_name])
+
+class TestStreamOnlyStorage(unittest.TestCase):
+    def test_exists(self):
+        storage = StreamOnlyStorage()
+        self.assertTrue(storage.exists('present.txt'))
+        self.assertFalse(storage.exists('missing.txt'))
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tempdir.name, 'test')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def write_files(self, storage, names):
+        for name in names:
+            with storage.open(name, 'w') as f:
+                f.write(name)
+
+    def check_files(self, storage, names):
+        self.assertEqual(sorted(storage.list()), sorted(names))
+        for name in names:
+            with storage.open(name, 'r') as f:
+                self.assertEqual(f.read(), name)
+
+    def test_layout(self):
+        storage = flowws.DirectoryStorage(self.root, shard='group')
+        self.write_files(storage, ['frame_12.bin', 'frame_1012.bin', 'sub/a.txt'])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.root, 'frame_#.bin', '1', 'frame_1012.bin')))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.root, 'sub', 'a.txt', '0', 'a.txt')))
+
+        # layout is read from the manifest
+        reopened = flowws.Workflow.from_JSON(
+            dict(storage=storage.to_JSON(), stages=[])).storage
+        self.assertEqual(reopened.shard, 'group')
+        self.check_files(reopened, ['frame_12.bin', 'frame_1012.bin', 'sub/a.txt'])
+        self.check_files(flowws.DirectoryStorage(self.root), storage.list())
+
+        with self.assertRaises(ValueError):
+            flowws.DirectoryStorage(self.root, shard='hash')
+
+    def test_reshard(self):
+        names = ['frame_{}.bin'.format(i) for i in range(5)] + ['sub/a.txt']
+        storage = flowws.DirectoryStorage(self.root)
+        self.write_files(storage, names)
+
+        with self.assertRaises(ValueError):
+            flowws.DirectoryStorage(self.root, shard='hash')
+
+        for shard in ['hash', 'group', None]:
+            storage = reshard(self.root, shard=shard, recursive=True)
+            self.assertEqual(storage.shard, shard)
+            self.check_files(storage, names)
+
+        self.assertEqual(sorted(os.listdir(self.root)),
+                         sorted(names[:-1] + ['sub']))
+
+    def test_reshard_groups(self):
+        storage = flowws.DirectoryStorage(self.root)
+        self.write_files(storage, ['a.txt', 'b.txt'])
+        group = flowws.DirectoryStorage(self.root, 'other')
+        self.write_files(group, ['c.txt'])
+        sharded_group = flowws.DirectoryStorage(self.root, 'sharded', shard='hash')
+        self.write_files(sharded_group, ['d.txt'])
+
+        storage = reshard(self.root, shard='hash')
+        self.check_files(storage, ['a.txt', 'b.txt'])
+        # files of other groups are left alone
+        self.check_files(flowws.DirectoryStorage(self.root, 'other'), ['c.txt'])
+        self.check_files(flowws.DirectoryStorage(self.root, 'sharded'), ['d.txt'])
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'other', 'c.txt')))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,11 @@
 
 import tempfile
+import io
 import os
+import sys
 import unittest
+import unittest.mock
+import zipfile
 
 import flowws
 
@@ -34,5 +38,89 @@ class TestSqliteStorage(unittest.TestCase, StorageTestBase):
     def tearDown(self):
         self.tempdir.cleanup()
 
+class TestRecordLog(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_zip_chunks(self):
+        filename = os.path.join(self.tempdir.name, 'test.zip')
+        storage = flowws.GetarStorage(filename)
+        schema = [('step', 'i8'), ('energy', 'f8')]
+        with storage.log('energy.log', schema, flush_bytes=16) as log:
+            for i in range(100):
+                log.append(i, 0.5*i)
+        storage.gtar_file.close()
+
+        # each flush adds only its own rows to the archive
+        with zipfile.ZipFile(filename) as archive:
+            stored_size = sum(info.file_size for info in archive.infolist())
+        self.assertLess(stored_size, 2*100*16)
+
+        storage = flowws.GetarStorage(filename)
+        rows = storage.read_log('energy.log')
+        self.assertEqual(rows, [(i, 0.5*i) for i in range(100)])
+
+class TestLazyReads(unittest.TestCase):
+    contents = bytes(range(256))*4096
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def check_ranged_read(self, storage, name):
+        with storage.open(name, 'rb') as f:
+            self.assertTrue(f.seekable())
+            f.seek(512*1024)
+            self.assertEqual(f.read(4), self.contents[512*1024:512*1024 + 4])
+            f.seek(-3, io.SEEK_END)
+            self.assertEqual(f.read(), self.contents[-3:])
+
+    def write_archive(self, filename):
+        import gtar
+        with gtar.GTAR(filename, 'w') as archive:
+            archive.writeBytes('stored.bin', self.contents,
+                               gtar.CompressMode.NoCompress)
+            archive.writeBytes('compressed.bin', self.contents)
+            archive.writeStr('text.txt', 'text contents')
+
+    def check_archive(self, filename):
+        storage = flowws.GetarStorage(filename)
+        self.check_ranged_read(storage, 'stored.bin')
+        self.check_ranged_read(storage, 'compressed.bin')
+        with storage.open('text.txt', 'r') as f:
+            self.assertEqual(f.read(), 'text contents')
+
+    def test_zip(self):
+        filename = os.path.join(self.tempdir.name, 'test.zip')
+        self.write_archive(filename)
+
+        with zipfile.ZipFile(filename) as archive:
+            compress_types = {info.filename: info.compress_type
+                              for info in archive.infolist()}
+        self.assertEqual(compress_types['stored.bin'], zipfile.ZIP_STORED)
+        self.assertNotEqual(compress_types['compressed.bin'], zipfile.ZIP_STORED)
+
+        self.check_archive(filename)
+
+    def test_zip_public_api(self):
+        filename = os.path.join(self.tempdir.name, 'test.zip')
+        self.write_archive(filename)
+
+        # emulate a python version with an incompatible ZipExtFile
+        module = sys.modules['flowws.GetarStorage']
+        with unittest.mock.patch.object(module, '_open_zip_data',
+                                        side_effect=TypeError):
+            self.check_archive(filename)
+
+    def test_tar(self):
+        filename = os.path.join(self.tempdir.name, 'test.tar')
+        self.write_archive(filename)
+        self.check_archive(filename)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,47 @@
+
+import subprocess
+import sys
+import unittest
+
+import flowws
+from flowws.internal import FailedImport, LazyImport
+
+class TestImports(unittest.TestCase):
+    def test_lazy_import(self):
+        proxy = flowws.try_to_import('.Argument', 'Range', 'flowws', lazy=True)
+        self.assertIsInstance(proxy, LazyImport)
+        self.assertIsNone(proxy._lazy_target)
+
+        value = proxy(0, 1)
+        self.assertIsInstance(value, proxy)
+        self.assertTrue(issubclass(flowws.Range, proxy))
+        self.assertIs(proxy._lazy_target, flowws.Range)
+
+    def test_lazy_failed_import(self):
+        proxy = flowws.try_to_import('.missing_module', 'Missing', 'flowws', lazy=True)
+        stage_cls = proxy.Stage
+        self.assertIsInstance(proxy._lazy_target, FailedImport)
+        with self.assertRaises(ImportError):
+            stage_cls()
+
+        eager = flowws.try_to_import('.missing_module', 'Missing', 'flowws')
+        self.assertIsInstance(eager, FailedImport)
+
+    def test_lazy_exports(self):
+        code = '\n'.join([
+            'import sys',
+            'import flowws',
+            'assert "flowws.Workflow" not in sys.modules',
+            'import flowws.Workflow',
+            'assert isinstance(flowws.Workflow, type)',
+            'from flowws import Stage, DirectoryStorage',
+            'assert isinstance(Stage, type)',
+            'assert "Workflow" in dir(flowws)',
+        ])
+        subprocess.check_call([sys.executable, '-c', code])
+
+        with self.assertRaises(AttributeError):
+            flowws.not_an_export
+
+if __name__ == '__main__':
+    unittest.main()
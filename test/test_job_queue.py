@@ -0,0 +1,109 @@
+
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+import flowws
+from flowws import Argument as Arg
+from flowws.job_queue import JobQueue, run_worker
+
+class QueueTestStage(flowws.Stage):
+    ARGS = [
+        Arg('name', type=str),
+        Arg('fail', type=bool, default=False),
+    ]
+
+    def run(self, scope, storage):
+        if self.arguments['fail']:
+            raise RuntimeError('Failing as requested')
+
+        with storage.open(self.arguments['name'], 'w') as f:
+            f.write(str(os.getpid()))
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.queue = JobQueue(os.path.join(self.tempdir.name, 'queue'))
+        self.output = os.path.join(self.tempdir.name, 'output')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def enqueue(self, count, **kwargs):
+        for i in range(count):
+            workflow = flowws.Workflow(
+                [QueueTestStage(name='{}.txt'.format(i), **kwargs)],
+                flowws.DirectoryStorage(self.output))
+            self.queue.enqueue(workflow.to_JSON())
+
+    def test_multiple_workers(self):
+        self.enqueue(12)
+
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=run_worker, args=(self.queue.path,))
+                   for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(self.queue.counts(),
+                         dict(pending=0, running=0, done=12, failed=0))
+        self.assertEqual(len(os.listdir(self.output)), 12)
+
+    def test_failure(self):
+        self.enqueue(2, fail=True)
+
+        result = run_worker(self.queue)
+        self.assertEqual(result, dict(done=0, failed=2))
+        self.assertEqual(self.queue.counts()['failed'], 2)
+
+        self.assertEqual(len(self.queue.requeue_failed()), 2)
+        self.assertEqual(self.queue.counts()['pending'], 2)
+
+    def test_stale_requeue(self):
+        self.enqueue(1)
+
+        job = self.queue.claim()
+        self.assertIsNotNone(job)
+        os.utime(job.path, (0, 0))
+
+        self.assertEqual(self.queue.requeue_stale(60), [job.name])
+        self.assertFalse(job.heartbeat())
+        self.assertFalse(self.queue.complete(job))
+
+        self.assertEqual(run_worker(self.queue), dict(done=1, failed=0))
+
+    def test_max_jobs(self):
+        self.enqueue(6)
+
+        result = run_worker(self.queue, max_jobs=2, jobs=4)
+        self.assertEqual(result, dict(done=2, failed=0))
+        self.assertEqual(self.queue.counts()['pending'], 4)
+
+    def test_claim_not_stale(self):
+        self.enqueue(1)
+        (name,) = os.listdir(self.queue.pending_dir)
+        os.utime(os.path.join(self.queue.pending_dir, name), (0, 0))
+
+        job = self.queue.claim()
+        self.assertEqual(self.queue.requeue_stale(60), [])
+        self.assertTrue(self.queue.complete(job))
+
+    def test_marker_ownership(self):
+        self.enqueue(1)
+
+        job = self.queue.claim()
+        os.utime(job.path, (0, 0))
+        self.assertEqual(self.queue.requeue_stale(60), [job.name])
+        new_job = self.queue.claim()
+
+        # the first owner must not remove the new owner's marker
+        self.assertFalse(self.queue.fail(job))
+        self.assertTrue(os.path.exists(new_job.marker_path))
+        self.assertTrue(self.queue.complete(new_job))
+        self.assertFalse(os.path.exists(new_job.marker_path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+
+import os
+import pstats
+import tempfile
+import unittest
+
+import flowws
+
+class AllocatingStage(flowws.Stage):
+    ARGS = []
+
+    def run(self, scope, storage):
+        scope['data'] = [list(range(100)) for _ in range(100)]
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.storage = flowws.DirectoryStorage(self.tempdir.name)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_profile(self):
+        stages = [AllocatingStage(), AllocatingStage()]
+        flowws.Workflow(stages, self.storage, profile=True).run()
+
+        names = set(self.storage.list('flowws_profile/'))
+        self.assertEqual(names, {
+            'flowws_profile/000_AllocatingStage.pstats',
+            'flowws_profile/001_AllocatingStage.pstats',
+            'flowws_profile/all.pstats',
+            'flowws_profile/summary.txt',
+        })
+
+        path = os.path.join(self.tempdir.name, 'flowws_profile', 'all.pstats')
+        functions = [key[2] for key in pstats.Stats(path).stats]
+        self.assertIn('run', functions)
+
+        with self.storage.open('flowws_profile/summary.txt') as f:
+            summary = f.read()
+        self.assertIn('001_AllocatingStage', summary)
+        self.assertIn('cumulative', summary)
+
+    def test_profile_memory(self):
+        workflow = flowws.Workflow.from_command(
+            ['--storage', self.tempdir.name, '--profile-memory'])
+        self.assertEqual(workflow.profile, 'memory')
+
+        workflow = flowws.Workflow([AllocatingStage()], self.storage, profile='memory')
+        workflow.run()
+
+        with self.storage.open('flowws_profile/000_AllocatingStage_memory.txt') as f:
+            report = f.read()
+        self.assertIn('Peak traced memory', report)
+        self.assertIn('test_profiling.py', report)
+
+if __name__ == '__main__':
+    unittest.main()
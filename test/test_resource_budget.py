@@ -0,0 +1,64 @@
+
+import threading
+import time
+import unittest
+
+import flowws
+from flowws.ResourceBudget import parse_memory
+
+class HeavyStage(flowws.Stage):
+    RESOURCES = dict(cores=2)
+
+    def run(self, scope, storage):
+        budget = scope['flowws.resources']
+        scope['max_used'] = max(scope.get('max_used', 0), budget.used_cores)
+        scope['allocated_cores'] = scope['flowws.allocation']['cores']
+        time.sleep(.01)
+
+class TestResourceBudget(unittest.TestCase):
+    def test_parse_memory(self):
+        self.assertEqual(parse_memory('512'), 512)
+        self.assertEqual(parse_memory('4k'), 4096)
+        self.assertEqual(parse_memory('1.5GiB'), 3*1024**3//2)
+        with self.assertRaises(ValueError):
+            parse_memory('lots')
+
+    def test_memory_limit(self):
+        budget = flowws.ResourceBudget(max_memory='1M')
+        with self.assertRaises(ValueError):
+            with budget.acquire(dict(memory='2M')):
+                pass
+
+    def test_allocation(self):
+        budget = flowws.ResourceBudget(max_cores=1)
+        scope = flowws.Workflow(
+            [HeavyStage()], flowws.DirectoryStorage(), resources=budget).run()
+        self.assertEqual(scope['allocated_cores'], 1)
+
+        scope = flowws.Workflow(
+            [HeavyStage()], flowws.DirectoryStorage(),
+            resources=flowws.ResourceBudget()).run()
+        self.assertEqual(scope['allocated_cores'], 2)
+
+    def test_concurrent_workflows(self):
+        budget = flowws.ResourceBudget(max_cores=3)
+        scopes = []
+
+        def run():
+            workflow = flowws.Workflow(
+                [HeavyStage()]*4, flowws.DirectoryStorage(), resources=budget)
+            scopes.append(workflow.run())
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(scopes), 3)
+        for scope in scopes:
+            self.assertLessEqual(scope['max_used'], 3)
+        self.assertEqual(budget.used_cores, 0)
+
+if __name__ == '__main__':
+    unittest.main()
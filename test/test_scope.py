@@ -0,0 +1,114 @@
+
+import copy
+import threading
+import unittest
+
+import flowws
+from flowws.Workflow import PersistentScope, Scope
+
+class ScopeTestBase:
+    def test_callbacks(self):
+        scope = self.Scope(a=1)
+        calls = []
+        scope.set_call('b', lambda: calls.append(1) or 2)
+
+        self.assertIn('b', scope)
+        self.assertEqual(scope.get('a'), 1)
+        self.assertEqual(scope['b'], 2)
+        self.assertEqual(scope.get('b'), 2)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(scope.get('c', 3), 3)
+
+    def test_snapshot(self):
+        scope = self.Scope(a=1, b=2)
+        scope.set_call('lazy', lambda: 'value')
+
+        snapshot = scope.snapshot()
+        copied = copy.copy(scope)
+        scope['a'] = 10
+        del scope['b']
+
+        for other in (snapshot, copied):
+            self.assertEqual(other['a'], 1)
+            self.assertEqual(other['b'], 2)
+            self.assertEqual(other['lazy'], 'value')
+        self.assertEqual(scope['lazy'], 'value')
+        self.assertNotIn('b', scope)
+        self.assertEqual(dict(scope), dict(a=10, lazy='value'))
+
+    def test_prefetch(self):
+        scope = self.Scope()
+        started = threading.Event()
+        release = threading.Event()
+
+        def load():
+            started.set()
+            release.wait(5)
+            return threading.current_thread()
+
+        scope.set_call('eager', load, prefetch=True)
+        self.assertTrue(started.wait(5))
+        release.set()
+        self.assertIsNot(scope['eager'], threading.current_thread())
+
+        scope.set_call('lazy', threading.current_thread)
+        scope.set_call('prefetched', threading.current_thread)
+        scope.prefetch(['prefetched', 'missing'])
+        self.assertIs(scope['lazy'], threading.current_thread())
+        self.assertIsNot(scope['prefetched'], threading.current_thread())
+
+    def test_prefetch_error(self):
+        scope = self.Scope()
+        def fail():
+            raise RuntimeError('failed')
+        scope.set_call('key', fail, prefetch=True)
+        with self.assertRaises(RuntimeError):
+            scope['key']
+
+class InputStage(flowws.Stage):
+    SCOPE_INPUTS = ['value']
+
+    def run(self, scope, storage):
+        scope['result'] = scope['value']
+
+class ProducerStage(flowws.Stage):
+    def run(self, scope, storage):
+        scope.set_call('value', threading.current_thread)
+
+class TestScope(unittest.TestCase, ScopeTestBase):
+    Scope = Scope
+
+class TestPersistentScope(unittest.TestCase, ScopeTestBase):
+    Scope = PersistentScope
+
+    def test_many_snapshots(self):
+        scope = self.Scope()
+        snapshots = []
+        for i in range(200):
+            scope[i % 17] = i
+            if i % 3 == 0:
+                del scope[i % 17]
+            snapshots.append((scope.snapshot(), dict(scope)))
+
+        self.assertLess(len(scope._layers), 12)
+        for (snapshot, expected) in snapshots:
+            self.assertEqual(dict(snapshot), expected)
+            self.assertEqual(len(snapshot), len(expected))
+
+    def test_workflow(self):
+        workflow = flowws.Workflow([], flowws.DirectoryStorage(), dict(x=1),
+                                   persistent_scope=True)
+        scope = workflow.run()
+        self.assertIsInstance(scope, PersistentScope)
+        self.assertEqual(scope['x'], 1)
+
+    def test_workflow_prefetch(self):
+        for persistent_scope in (False, True):
+            workflow = flowws.Workflow(
+                [ProducerStage(), flowws.Stage(), InputStage()],
+                flowws.DirectoryStorage(), persistent_scope=persistent_scope)
+            scope = workflow.run()
+            self.assertIsNot(scope['result'], threading.current_thread())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+
+import contextlib
+import multiprocessing
+import os
+import pickle
+import subprocess
+import sys
+import unittest
+
+import flowws
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError: # python < 3.8
+    shared_memory = None
+
+def _sum_shared(shared):
+    return float(shared.array.sum())
+
+@unittest.skipIf(np is None, 'numpy is required for SharedArray')
+@unittest.skipIf(shared_memory is None, 'python 3.8 is required for SharedArray')
+class TestSharedArray(unittest.TestCase):
+    def test_pickle_by_name(self):
+        array = np.arange(1024, dtype=np.float32)
+        with contextlib.ExitStack() as stack:
+            shared = flowws.SharedArray.from_array(array, stack)
+            payload = pickle.dumps(shared)
+            self.assertLess(len(payload), array.nbytes)
+
+            context = multiprocessing.get_context('fork')
+            with context.Pool(2) as pool:
+                results = pool.map(_sum_shared, [shared]*2)
+            self.assertEqual(results, [float(array.sum())]*2)
+
+    def test_attach_spawned_process(self):
+        array = np.arange(1024, dtype=np.float32)
+        script = ('import pickle, sys; '
+                  'shared = pickle.load(sys.stdin.buffer); '
+                  'print(float(shared.array.sum())); shared.close()')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [root] + [p for p in [env.get('PYTHONPATH')] if p])
+
+        with contextlib.ExitStack() as stack:
+            shared = flowws.SharedArray.from_array(array, stack)
+            output = subprocess.run(
+                [sys.executable, '-c', script], input=pickle.dumps(shared),
+                stdout=subprocess.PIPE, env=env, check=True).stdout
+            self.assertEqual(float(output), float(array.sum()))
+
+            # the exiting process did not destroy the memory
+            attached = flowws.SharedArray(shared.name, shared.shape, shared.dtype)
+            self.assertEqual(float(attached.array.sum()), float(array.sum()))
+            attached.close()
+
+    def test_set_call(self):
+        scope = flowws.Workflow([], flowws.DirectoryStorage()).run()
+        with contextlib.ExitStack() as stack:
+            scope['flowws.exit_stack'] = stack
+            flowws.SharedArray.set_call(scope, 'values', lambda: np.ones(4))
+            shared = scope['values']
+            np.testing.assert_array_equal(np.asarray(shared), np.ones(4))
+
+    def test_set_call_finished(self):
+        scope = flowws.Workflow([], flowws.DirectoryStorage()).run()
+        self.assertIsNone(scope['flowws.exit_stack'])
+
+        flowws.SharedArray.set_call(scope, 'values', lambda: np.ones(4))
+        name = scope['values'].name
+        del scope['values']
+        import gc
+        gc.collect()
+
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+    def test_array_copy(self):
+        with contextlib.ExitStack() as stack:
+            shared = flowws.SharedArray.from_array(np.arange(4), stack)
+            self.assertIs(np.asarray(shared), shared.array)
+            copied = np.array(shared, copy=True)
+            copied[0] = 13
+            self.assertEqual(shared.array[0], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,37 @@
 
+import contextlib
+import io
 import unittest
 
 import flowws
 from flowws import Argument as Arg
 
 class StageForTesting(flowws.Stage):
+    """Stage used for testing.
+
+    :param required_value: Some value
+    """
     ARGS = [
         Arg('required_value', required=True),
         Arg('defaulted_value', default='default'),
     ]
 
+class LifecycleStage(flowws.Stage):
+    ARGS = [
+        Arg('value', type=int, default=0),
+    ]
+
+    events = []
+
+    def setup(self):
+        self.events.append(('setup', self.arguments['value']))
+
+    def teardown(self):
+        self.events.append(('teardown', self.arguments['value']))
+
+    def run(self, scope, storage):
+        self.events.append(('run', self.arguments['value']))
+
 class TestStage(unittest.TestCase):
     def test_required(self):
         with self.assertRaises(ValueError):
@@ -25,5 +47,49 @@ class TestStage(unittest.TestCase):
         stage = StageForTesting(required_value=1, defaulted_value=3)
         self.assertEqual(stage.arguments['defaulted_value'], 3)
 
+    def test_parser_cache(self):
+        first = StageForTesting.from_command(['--required-value', '1'])
+        parser = StageForTesting._get_parser()[0]
+        second = StageForTesting.from_command(['--required-value', '2'])
+        self.assertIs(StageForTesting._get_parser()[0], parser)
+        self.assertEqual(first.arguments['required_value'], '1')
+        self.assertEqual(second.arguments['required_value'], '2')
+        self.assertEqual(second.arguments['defaulted_value'], 'default')
+
+    def test_structured_arguments(self):
+        stage = StageForTesting.from_command(dict(required_value=[1, 2]))
+        self.assertEqual(stage.arguments['required_value'], [1, 2])
+
+    def test_help(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertRaises(SystemExit):
+            StageForTesting.from_command(['-h'])
+        self.assertIn('Stage used for testing.', output.getvalue())
+
+    def test_lifecycle(self):
+        del LifecycleStage.events[:]
+        stage = LifecycleStage(value=1)
+        flowws.Workflow([stage, LifecycleStage(value=2)], flowws.DirectoryStorage()).run()
+        flowws.Workflow([stage], flowws.DirectoryStorage()).run()
+        self.assertEqual(LifecycleStage.events, [
+            ('setup', 1), ('run', 1), ('setup', 2), ('run', 2),
+            ('teardown', 2), ('teardown', 1),
+            ('setup', 1), ('run', 1), ('teardown', 1)])
+
+    def test_stage_cache(self):
+        del LifecycleStage.events[:]
+        with flowws.StageCache(max_size=2) as cache:
+            for value in [1, 1, 2, 1, 3]:
+                workflow = flowws.Workflow(
+                    [LifecycleStage(value=value)], flowws.DirectoryStorage(),
+                    stage_cache=cache)
+                workflow.run()
+            self.assertEqual(len(cache), 2)
+
+        self.assertEqual(LifecycleStage.events, [
+            ('setup', 1), ('run', 1), ('run', 1), ('setup', 2), ('run', 2),
+            ('run', 1), ('teardown', 2), ('setup', 3), ('run', 3),
+            ('teardown', 1), ('teardown', 3)])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,86 @@
+
+import json
+import os
+import pickle
+import tempfile
+import unittest
+
+import flowws
+
+class ReadingStage(flowws.Stage):
+    def run(self, scope, storage):
+        scope['result'] = scope['config']['value']
+
+class TestStorageReference(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.storage = flowws.DirectoryStorage(self.tempdir.name)
+
+        with self.storage.open('inputs/config.json', 'w') as f:
+            json.dump(dict(value=13), f)
+        with self.storage.open('inputs/data.bin', 'wb') as f:
+            f.write(b'data')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def make_workflow(self, stages):
+        description = dict(
+            storage=self.storage.to_JSON(), stages=stages,
+            scope=dict(
+                config={'$storage': 'inputs/config.json'},
+                data={'$storage': 'inputs/data.bin'},
+                missing={'$storage': 'inputs/missing.bin'},
+                text={'$storage': 'inputs/data.bin', 'decoder': 'text'},
+            ))
+        return flowws.Workflow.from_JSON(description)
+
+    def test_lazy_load(self):
+        workflow = self.make_workflow([])
+        self.assertIsInstance(workflow.scope['config'], flowws.StorageReference)
+
+        # unused references (even to missing files) are never read
+        workflow.stages.append(ReadingStage())
+        scope = workflow.run()
+        self.assertEqual(scope['result'], 13)
+        self.assertEqual(scope['data'], b'data')
+        self.assertEqual(scope['text'], 'data')
+        with self.assertRaises(FileNotFoundError):
+            scope['missing']
+
+    def test_to_JSON(self):
+        workflow = self.make_workflow([])
+        description = workflow.to_JSON()
+        self.assertEqual(description['scope']['text'],
+                         {'$storage': 'inputs/data.bin', 'decoder': 'text'})
+        json.dumps(description)
+
+        self.assertEqual(flowws.Workflow.from_JSON(description).scope['data'],
+                         workflow.scope['data'])
+
+    def test_hash(self):
+        reference = flowws.StorageReference('inputs/data.bin', 'text')
+        same = flowws.StorageReference.from_JSON(
+            {'$storage': 'inputs/data.bin', 'decoder': 'text'})
+        self.assertEqual(hash(reference), hash(same))
+        self.assertEqual(len({reference, same}), 1)
+
+    def test_other_storage(self):
+        other = flowws.DirectoryStorage(os.path.join(self.tempdir.name, 'inputs'))
+        reference = flowws.StorageReference('config.json', storage=other.to_JSON())
+        workflow = flowws.Workflow([ReadingStage()], scope=dict(config=reference))
+        self.assertEqual(workflow.run()['result'], 13)
+
+        # the other storage (and its cached values) is reused
+        first = reference.load(None)
+        self.assertIs(reference.load(None), first)
+
+        copied = pickle.loads(pickle.dumps(reference))
+        self.assertEqual(copied, reference)
+        self.assertEqual(copied.load(None), first)
+
+        with self.assertRaises(ValueError):
+            flowws.StorageReference('config.json', decoder='unknown')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+import flowws
+
+from internal import StorageTestBase
+
+def _append_lines(args):
+    (storage, index) = args
+    with storage.open('shared.txt', 'a') as f:
+        f.write('{}\n'.format(index))
+    with storage.open('worker.txt', 'wb', modifiers=[str(index)]) as f:
+        # getar archives can not hold empty records
+        f.write(b'x'*(index + 1))
+    return index
+
+class TestStorageServer(unittest.TestCase, StorageTestBase):
+    def make_storage(self):
+        dirname = os.path.join(self.tempdir.name, 'test')
+        return flowws.DirectoryStorage(dirname)
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.server = flowws.StorageServer(self.make_storage())
+        self.server.start()
+        self.storage = self.server.storage
+
+    def tearDown(self):
+        self.server.stop()
+        self.tempdir.cleanup()
+
+    def test_parallel_writers(self):
+        context = multiprocessing.get_context('fork')
+        with context.Pool(4) as pool:
+            pool.map(_append_lines, [(self.storage, i) for i in range(16)])
+
+        with self.storage.open('shared.txt', 'r') as f:
+            lines = sorted(int(line) for line in f)
+        self.assertEqual(lines, list(range(16)))
+
+        for i in range(16):
+            with self.storage.open('worker.txt', 'rb', modifiers=[str(i)]) as f:
+                self.assertEqual(len(f.read()), i + 1)
+
+    def test_reopen(self):
+        with self.storage.open('value.txt', 'w') as f:
+            f.write('value')
+        self.server.stop()
+
+        # the archive is intact once the server has finished writing it
+        storage = self.make_storage()
+        try:
+            with storage.open('value.txt', 'r') as f:
+                self.assertEqual(f.read(), 'value')
+        finally:
+            storage.close()
+
+    def test_description(self):
+        self.server.stop()
+        description = self.make_storage()
+        self.server = flowws.StorageServer(description.to_JSON())
+        description.close()
+        with self.server:
+            with self.server.storage.open('value.txt', 'w') as f:
+                f.write('value')
+            with self.server.storage.open('value.txt', 'r') as f:
+                self.assertEqual(f.read(), 'value')
+
+class TestServedZipStorage(TestStorageServer):
+    def make_storage(self):
+        return flowws.GetarStorage(os.path.join(self.tempdir.name, 'test.zip'))
+
+class TestServedTarStorage(TestStorageServer):
+    def make_storage(self):
+        return flowws.GetarStorage(os.path.join(self.tempdir.name, 'test.tar'))
+
+class TestServedSqliteStorage(TestStorageServer):
+    def make_storage(self):
+        return flowws.GetarStorage(os.path.join(self.tempdir.name, 'test.sqlite'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,271 @@
+
+import os
+import tempfile
+import unittest
+
+import flowws
+from flowws import Argument as Arg
+from flowws.catalog import Catalog
+from flowws.sweep import run_tree
+
+class CountingStage(flowws.Stage):
+    ARGS = [
+        Arg('log', type=str),
+        Arg('value', type=int, default=0),
+    ]
+
+    def run(self, scope, storage):
+        if self.arguments['value'] < 0:
+            raise ValueError('Negative value')
+
+        with open(self.arguments['log'], 'a') as f:
+            f.write('{}\n'.format(self.arguments['value']))
+
+        scope['total'] = scope.get('total', 0) + self.arguments['value']
+        with storage.open('total.txt', 'w') as f:
+            f.write(str(scope['total']))
+
+class BatchStage(flowws.Stage):
+    ARGS = [
+        Arg('log', type=str),
+        Arg('scale', type=float, default=1),
+    ]
+
+    def run(self, scope, storage):
+        raise RuntimeError('Stage should be run in a batch')
+
+    @classmethod
+    def run_batch(cls, stages, scopes, storages):
+        with open(stages[0].arguments['log'], 'a') as f:
+            f.write('{}\n'.format(-len(stages)))
+
+        resources = scopes[0].get('flowws.resources')
+        if resources is not None:
+            with storages[0].open('used_cores.txt', 'w') as f:
+                f.write(str(resources.used_cores))
+
+        for (stage, scope, storage) in zip(stages, scopes, storages):
+            scope['total'] = scope['total']*stage.arguments['scale']
+            with storage.open('total.txt', 'w') as f:
+                f.write(str(scope['total']))
+
+class CompressedStage(flowws.Stage):
+    ARGS = [
+        Arg('name', type=str),
+    ]
+
+    def run(self, scope, storage):
+        with storage.open(self.arguments['name'] + '.bin', 'wb', compress='gzip') as f:
+            f.write(self.arguments['name'].encode()*1024)
+
+class SetupStage(flowws.Stage):
+    ARGS = [
+        Arg('log', type=str),
+        Arg('name', type=str),
+    ]
+
+    def _record(self, event):
+        with open(self.arguments['log'], 'a') as f:
+            f.write('{} {} {}\n'.format(event, self.arguments['name'], os.getpid()))
+
+    def setup(self):
+        self._record('setup')
+
+    def teardown(self):
+        self._record('teardown')
+
+    def run(self, scope, storage):
+        pass
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.tempdir.name, 'log.txt')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def make_workflows(self, values):
+        result = []
+        for (i, value) in enumerate(values):
+            stages = [CountingStage(log=self.log, value=1),
+                      CountingStage(log=self.log, value=10),
+                      CountingStage(log=self.log, value=value)]
+            storage = flowws.DirectoryStorage(self.tempdir.name, str(i))
+            result.append(flowws.Workflow(stages, storage))
+        return result
+
+    def check(self, fork):
+        workflows = self.make_workflows([100, 200, -1, 200])
+        statuses = run_tree(workflows, fork=fork, parallel=2)
+        self.assertEqual(statuses, [0, 0, 1, 0])
+
+        with open(self.log, 'r') as f:
+            values = sorted(int(line) for line in f)
+        # shared stages only run once, but the duplicate final stage
+        # is run for the storage of each workflow
+        self.assertEqual(values, [1, 10, 100, 200, 200])
+
+        for (i, value) in [(0, 100), (1, 200), (3, 200)]:
+            with workflows[i].storage.open('total.txt', 'r') as f:
+                self.assertEqual(int(f.read()), 11 + value)
+        self.assertFalse(workflows[2].storage.exists('total.txt'))
+
+    def test_fork(self):
+        self.check(True)
+
+    def test_no_fork(self):
+        self.check(False)
+
+    def check_batch(self, fork):
+        workflows = []
+        for (i, scale) in enumerate([2, 3, 4]):
+            stages = [CountingStage(log=self.log, value=1),
+                      BatchStage(log=self.log, scale=scale),
+                      BatchStage(log=self.log, scale=10)]
+            storage = flowws.DirectoryStorage(self.tempdir.name, str(i))
+            workflows.append(flowws.Workflow(stages, storage))
+
+        # a different type of stage is run separately
+        stages = [CountingStage(log=self.log, value=1),
+                  CountingStage(log=self.log, value=5)]
+        storage = flowws.DirectoryStorage(self.tempdir.name, 'other')
+        workflows.append(flowws.Workflow(stages, storage))
+
+        statuses = run_tree(workflows, fork=fork)
+        self.assertEqual(statuses, [0, 0, 0, 0])
+
+        with open(self.log, 'r') as f:
+            values = sorted(int(line) for line in f)
+        # both BatchStages are each run once for all three workflows
+        self.assertEqual(values, [-3, -3, 1, 5])
+
+        for (i, scale) in enumerate([2, 3, 4]):
+            with workflows[i].storage.open('total.txt', 'r') as f:
+                self.assertEqual(float(f.read()), scale*10)
+
+    def check_batch_hooks(self, fork):
+        budget = flowws.ResourceBudget(max_cores=1)
+        catalog = os.path.join(self.tempdir.name, 'catalog.sqlite')
+        workflows = []
+        for (i, scale) in enumerate([2, 3, -1]):
+            stages = [CountingStage(log=self.log, value=1),
+                      BatchStage(log=self.log, scale=scale),
+                      CountingStage(log=self.log, value=scale)]
+            storage = flowws.DirectoryStorage(self.tempdir.name, str(i))
+            workflows.append(flowws.Workflow(
+                stages, storage, resources=budget, profile=True, catalog=catalog))
+
+        statuses = run_tree(workflows, fork=fork)
+        self.assertEqual(statuses, [0, 0, 1])
+
+        # the batch acquires resources once, through the first workflow
+        with workflows[0].storage.open('used_cores.txt', 'r') as f:
+            self.assertEqual(f.read(), '1')
+        self.assertEqual(budget.used_cores, 0)
+
+        for (i, workflow) in enumerate(workflows):
+            self.assertEqual(workflow.storage.exists('flowws_profile/summary.txt'),
+                             i < 2)
+
+        runs = Catalog(catalog).query()
+        self.assertEqual(
+            sorted((run['storage']['group'], run['status']) for run in runs),
+            [('0', 'ok'), ('1', 'ok'), ('2', 'failed')])
+        for run in runs:
+            self.assertTrue(all(duration is not None
+                                for duration in run['stage_durations']))
+
+    def test_fork_compressed(self):
+        workflows = []
+        for name in ['a', 'b']:
+            # compression threads are started before forking
+            stages = [CompressedStage(name='prefix'), CompressedStage(name=name)]
+            storage = flowws.DirectoryStorage(self.tempdir.name, name)
+            workflows.append(flowws.Workflow(stages, storage))
+
+        statuses = run_tree(workflows, fork=True, parallel=2)
+        self.assertEqual(statuses, [0, 0])
+
+        for (i, name) in enumerate(['a', 'b']):
+            with workflows[i].storage.open(name + '.bin', 'rb', compress=True) as f:
+                self.assertEqual(f.read(), name.encode()*1024)
+
+    def test_fork_archives(self):
+        workflows = []
+        for name in ['a', 'b']:
+            # compression threads are started before forking
+            stages = [CompressedStage(name='prefix'), CompressedStage(name=name)]
+            storage = flowws.GetarStorage(
+                os.path.join(self.tempdir.name, name + '.zip'))
+            workflows.append(flowws.Workflow(stages, storage))
+
+        statuses = run_tree(workflows, fork=True, parallel=2)
+        self.assertEqual(statuses, [0, 0])
+
+        for (name, expected) in [('a', ['a.bin', 'prefix.bin']), ('b', ['b.bin'])]:
+            storage = flowws.GetarStorage(
+                os.path.join(self.tempdir.name, name + '.zip'))
+            try:
+                self.assertEqual(storage.list(), expected)
+                with storage.open(name + '.bin', 'rb', compress=True) as f:
+                    self.assertEqual(f.read(), name.encode()*1024)
+            finally:
+                storage.close()
+
+    def test_fork_shared_archive(self):
+        filename = os.path.join(self.tempdir.name, 'shared.zip')
+        workflows = []
+        for name in ['a', 'b']:
+            stages = [CountingStage(log=self.log, value=1),
+                      CountingStage(log=self.log, value=len(name))]
+            storage = flowws.GetarStorage(filename, name)
+            workflows.append(flowws.Workflow(stages, storage))
+
+        with self.assertRaises(ValueError):
+            run_tree(workflows, fork=True)
+
+        # sequential branches can share the archive
+        self.assertEqual(run_tree(workflows, fork=False), [0, 0])
+        workflows[0].storage.close()
+
+    def test_fork_teardown(self):
+        workflows = []
+        for name in ['a', 'b']:
+            stages = [SetupStage(log=self.log, name='shared'),
+                      SetupStage(log=self.log, name=name)]
+            storage = flowws.DirectoryStorage(self.tempdir.name, name)
+            workflows.append(flowws.Workflow(stages, storage))
+
+        statuses = run_tree(workflows, fork=True, parallel=2)
+        self.assertEqual(statuses, [0, 0])
+
+        with open(self.log, 'r') as f:
+            events = [line.split() for line in f]
+        pids = {}
+        for (event, name, pid) in events:
+            pids.setdefault((event, name), []).append(int(pid))
+
+        # the shared stage is set up and torn down once, by the parent
+        self.assertEqual(pids[('setup', 'shared')], [os.getpid()])
+        self.assertEqual(pids[('teardown', 'shared')], [os.getpid()])
+        # stages set up in a child are torn down there
+        for name in ['a', 'b']:
+            self.assertEqual(len(pids[('setup', name)]), 1)
+            self.assertEqual(pids[('teardown', name)], pids[('setup', name)])
+            self.assertNotEqual(pids[('setup', name)], [os.getpid()])
+
+    def test_batch_hooks_fork(self):
+        self.check_batch_hooks(True)
+
+    def test_batch_hooks_no_fork(self):
+        self.check_batch_hooks(False)
+
+    def test_batch_fork(self):
+        self.check_batch(True)
+
+    def test_batch_no_fork(self):
+        self.check_batch(False)
+
+if __name__ == '__main__':
+    unittest.main()